@@ -0,0 +1,37 @@
+import argparse
+import sys
+
+from storemanager.storage.index import opencontinent
+from storemanager.locations.continent import ParallelUpdate
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Advance every town in ./towns by a number of weeks,'
+                    ' without the GUI, e.g. between sessions.')
+    parser.add_argument('weeks', type=int, help='number of weeks to advance')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: all CPUs)')
+    args = parser.parse_args()
+
+    index = opencontinent()
+    index.refresh()
+    update = ParallelUpdate(index, args.workers, args.weeks)
+    for done, total in update.run(poll=1):
+        sys.stderr.write('\r%s/%s towns' % (done, total))
+        sys.stderr.flush()
+    sys.stderr.write('\n')
+
+    print('Advanced %s towns by %s weeks in %.1f s with %s workers.'
+          % (len(index), args.weeks, update.elapsed, update.workers))
+    print('Commissions due:')
+    for item in update.removed:
+        player, character, commission = item.get_commission()
+        print('  %s (%s) -- %s: $%s' % (character, player, item.name,
+                                        commission))
+    if not update.removed:
+        print('  none')
+
+
+if __name__ == '__main__':
+    main()
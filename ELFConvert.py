@@ -0,0 +1,53 @@
+import argparse
+import glob
+import os
+import time
+
+from storemanager.locations.town import Town
+from storemanager.storage import binary
+from storemanager.storage.index import ContinentIndex
+from storemanager.storage.sqlite import ContinentDB
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert pickled .town files to the binary town format.'
+                    ' Towns already in the binary format are left alone.')
+    parser.add_argument('files', nargs='*',
+                        help='town files to convert (default: towns/*.town)')
+    parser.add_argument('--sqlite', action='store_true',
+                        help='also copy the towns into towns/continent.db,'
+                             ' which is then used in place of the town files')
+    args = parser.parse_args()
+
+    files = args.files or glob.glob(os.path.join('towns', '*.town'))
+    converted = 0
+    before = after = 0
+    start = time.time()
+    for filename in files:
+        if binary.isbinary(filename):
+            continue
+        size = os.path.getsize(filename)
+        town = Town.load(filename)
+        checksum = town.write(full=True)
+        ContinentIndex(os.path.dirname(filename)).update(town, filename,
+                                                         checksum)
+        before += size
+        after += os.path.getsize(filename)
+        converted += 1
+        print('%s: %s -> %s bytes' % (filename, size,
+                                      os.path.getsize(filename)))
+    print('Converted %s of %s towns in %.1f s (%s -> %s bytes)'
+          % (converted, len(files), time.time() - start, before, after))
+
+    if args.sqlite:
+        start = time.time()
+        db = ContinentDB(os.path.join('towns', 'continent.db'))
+        for filename in files:
+            db.save(Town.load(filename))
+        print('Copied %s towns to %s in %.1f s'
+              % (len(files), db.filename, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
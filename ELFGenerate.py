@@ -0,0 +1,63 @@
+import argparse
+import sys
+
+from storemanager.storage.index import opencontinent
+from storemanager.locations.continent import ParallelGenerate
+
+
+def parsesizes(text):
+    """Return a list of (size, weight) pairs for a --sizes argument.
+
+    '3' is always size 3, '2-4' is sizes 2 to 4 equally, and '1:5,2:3,3:1'
+    gives each size a weight.
+
+    """
+    if text is None:
+        return None
+    try:
+        if ':' in text:
+            pairs = [part.split(':') for part in text.split(',')]
+            return [(int(size), float(weight)) for size, weight in pairs]
+        if '-' in text:
+            low, high = text.split('-')
+            return [(size, 1) for size in range(int(low), int(high) + 1)]
+        return [(int(text), 1)]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size distribution: %r'
+                                         % text)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a continent of towns, without the GUI. Towns'
+                    ' are saved in ./towns, beside any existing towns.')
+    parser.add_argument('count', type=int, help='number of towns to generate')
+    parser.add_argument('-s', '--sizes', type=parsesizes, default=None,
+                        help="town sizes: '3', '2-4', or weighted"
+                             " '1:5,2:3,3:1' (default: usual distribution)")
+    parser.add_argument('--seed', type=int, default=None,
+                        help='continent seed, to generate the same towns again')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: all CPUs)')
+    args = parser.parse_args()
+
+    index = opencontinent()
+    index.refresh()
+    generate = ParallelGenerate(index, args.count, args.sizes, args.seed,
+                                args.workers)
+    for done, total in generate.run(poll=1):
+        rate = done / generate.elapsed if generate.elapsed else 0
+        sys.stderr.write('\r%s/%s towns (%.1f towns/s)' % (done, total, rate))
+        sys.stderr.flush()
+    sys.stderr.write('\n')
+
+    elapsed = max(generate.elapsed, 1e-9)
+    print('Generated %s towns (%s items) in %.1f s with %s workers:'
+          % (args.count, generate.items, generate.elapsed, generate.workers))
+    print('  %.1f towns/s, %.0f items/s' % (args.count / elapsed,
+                                            generate.items / elapsed))
+    print('  seed %s' % generate.seed)
+
+
+if __name__ == '__main__':
+    main()
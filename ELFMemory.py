@@ -0,0 +1,52 @@
+import argparse
+import sys
+import gc
+import tracemalloc
+
+from storemanager.locations.town import Town
+
+
+def measure(towns, size):
+    """Return (items, bytes per item, extra bytes per item after a search).
+
+    The towns are generated in memory only. A text search is simulated by
+    building every item's search text.
+
+    """
+    gc.collect()
+    tracemalloc.start()
+    generated = [Town('Town %s' % i, size, seed=i) for i in range(towns)]
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    items = 0
+    for town in generated:
+        for item in town.getitems():
+            item.searchtext()
+            items += 1
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return items, before / items, (after - before) / items
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the memory used per item for sale, for one town'
+                    ' and for a whole continent of generated towns. Nothing'
+                    ' is saved.')
+    parser.add_argument('--towns', type=int, default=1000,
+                        help='number of towns in the continent (default: 1000)')
+    parser.add_argument('--size', type=int, default=5,
+                        help='size of each town, 1..5 (default: 5)')
+    args = parser.parse_args()
+
+    for towns in sorted(set([1, args.towns])):
+        sys.stderr.write('Generating %s towns of size %s...\n'
+                         % (towns, args.size))
+        items, base, search = measure(towns, args.size)
+        print('%5s towns, %7s items: %5.0f bytes/item, %4.0f more after a'
+              ' text search' % (towns, items, base, search))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import argparse
+import sys
+
+from storemanager.storage.index import opencontinent
+from storemanager.locations.continent import ParallelPrint
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Print the full listing of every town in ./towns to one'
+                    ' text file, e.g. as a campaign catalog.')
+    parser.add_argument('filename', nargs='?', default='continent.txt',
+                        help='file to write (default: continent.txt)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: all CPUs)')
+    args = parser.parse_args()
+
+    index = opencontinent()
+    index.refresh()
+    printer = ParallelPrint(index, args.filename, args.workers)
+    for done, total in printer.run(poll=1):
+        sys.stderr.write('\r%s/%s towns' % (done, total))
+        sys.stderr.flush()
+    sys.stderr.write('\n')
+
+    print('Printed %s towns to %s in %.1f s with %s workers.'
+          % (len(index), args.filename, printer.elapsed, printer.workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import argparse
+import os
+import time
+
+from storemanager.storage.index import opencontinent
+from storemanager.search import snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Export a read-only snapshot of every item for sale in'
+                    ' ./towns, which searches use in place of loading each'
+                    ' town. Run it again after the towns change.')
+    parser.parse_args()
+
+    index = opencontinent()
+    index.refresh()
+    start = time.time()
+    filename = snapshot.export(index)
+    elapsed = time.time() - start
+    mapped = snapshot.MappedColumns(filename)
+    print('Exported %s items from %s towns to %s in %.1f s (%s bytes)'
+          % (len(mapped), len(mapped.towns), filename, elapsed,
+             os.path.getsize(filename)))
+    mapped.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ from PyQt4 import QtGui, QtCore
 
 from elvenfire import ELFError
 from storemanager.GUI.continent import ContinentWidget
+from storemanager.GUI import icons
 
 
 VERSION = '0.2.0'
@@ -11,6 +12,7 @@ VERSION = '0.2.0'
 
 def main():
     app = QtGui.QApplication(sys.argv)
+    icons.preload()
     
     try:
         mw = ContinentWidget(None)
@@ -719,9 +719,9 @@ class AddItemWidget (QtGui.QWidget):
         item = WeaponStockItem(type=self.spectype.currentText(),
                                abilities=self.abilities,
                                secondaryweapon=self.secondaryweapon)
-        self.store.additem(item)
+        self.parent.town.additem(self.store, item)
         self.parent.town.save()
-        self.parent._buildtree(expand=self.store)
+        self.parent._storechanged(self.store)
         self.window_.close()
 
     def create(self):
@@ -919,9 +919,9 @@ class AddItemWidget (QtGui.QWidget):
             return
 
         # Add item
-        self.store.additem(item)
+        self.parent.town.additem(self.store, item)
         self.parent.town.save()
-        self.parent._buildtree(expand=self.store)
+        self.parent._storechanged(self.store)
         self.window_.close()
 
 
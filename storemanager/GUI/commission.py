@@ -46,6 +46,7 @@ class CommissionTree (ItemTree):
         QtGui.QTreeWidgetItem.__init__(self, parent)
         self.item = item
 
+        self._seticon(item)
         self.setText(self.col_name, item.short())
         self.setToolTip(self.col_name, item.description())
         (player, character, commission) = item.get_commission()
@@ -1,11 +1,15 @@
 import random
-import pickle
-import glob
 
 from PyQt4 import QtGui, QtCore
 
 from storemanager.locations.town import Town
+from storemanager.locations.continent import ParallelUpdate, ParallelGenerate
+from storemanager.locations.continent import ParallelPrint
+from storemanager.storage.index import opencontinent
 from storemanager.GUI.town import TownWidget
+from storemanager.search.planner import Planner
+from storemanager.search.worker import SearchJob
+from storemanager.search.snapshot import opensnapshot
 from storemanager.GUI.search import SearchWidget, ResultsWindow
 from storemanager.GUI.treeitems import *
 from storemanager.GUI.commission import CommissionWindow
@@ -99,6 +103,7 @@ class NewTownWidget(QtGui.QWidget):
                               'Invalid town name; please try again!', 
                               QtGui.QMessageBox.Ok).exec_()
             return
+        self.parent.index.cache(t)
         self.emit(QtCore.SIGNAL('town_created'))
         TownWidget(self.parent, t)
         self.window_.close()
@@ -166,10 +171,18 @@ class PrePopulateWidget (QtGui.QWidget):
         self.connect(self.cancel, QtCore.SIGNAL('clicked()'), self.canceled)
 
     def create(self):
-        for i in range(self.numbox.value()):
-            size = random.randint(self.min.value(), self.max.value())
-            t = Town(None, size)
-            t.save()
+        sizes = [(size, 1) for size in range(self.min.value(),
+                                             self.max.value() + 1)]
+        generate = ParallelGenerate(self.parent.index, self.numbox.value(),
+                                    sizes or [(self.min.value(), 1)])
+        progress = QtGui.QProgressDialog('Creating towns...', None,
+                                         0, self.numbox.value(), self)
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        for done, total in generate.run():
+            progress.setValue(done)
+            QtGui.QApplication.processEvents()
+        progress.close()
         self.emit(QtCore.SIGNAL('population_done'))
         self.window_.close()
 
@@ -203,11 +216,15 @@ class ContinentWidget(QtGui.QWidget):
 
     def __init__(self, parent):
         QtGui.QWidget.__init__(self, parent)
+        self.index = None
+        self.snapshot = None
+        self.connect(QtGui.QApplication.instance(),
+                     QtCore.SIGNAL('aboutToQuit()'), self._closesnapshot)
         self._prepare()
         self._gathertowns()
 
         # Offer to pre-populate a blank continent
-        if self.townlist == []:
+        if len(self.index) == 0:
             res = QtGui.QMessageBox(QtGui.QMessageBox.Information,
                                     'Pre-Populate Continent?',
                                     'There are currently no towns available' +
@@ -249,6 +266,9 @@ class ContinentWidget(QtGui.QWidget):
         self.connect(self.townselect, 
                      QtCore.SIGNAL('itemDoubleClicked(QTreeWidgetItem *, int)'), 
                      self.open_town)
+        self.connect(self.townselect,
+                     QtCore.SIGNAL('itemExpanded(QTreeWidgetItem *)'),
+                     self._expanded)
 
         # Buttons: Cross-Continent
         vbox = QtGui.QVBoxLayout()
@@ -259,6 +279,9 @@ class ContinentWidget(QtGui.QWidget):
         self.update = QtGui.QPushButton('Update All', self)
         self.connect(self.update, QtCore.SIGNAL('clicked()'), self.update_all)
         vbox.addWidget(self.update)
+        self.printall = QtGui.QPushButton('Print All', self)
+        self.connect(self.printall, QtCore.SIGNAL('clicked()'), self.print_all)
+        vbox.addWidget(self.printall)
         sep = QtGui.QFrame(self)
         sep.setFrameShape(QtGui.QFrame.HLine)
         vbox.addWidget(sep)
@@ -289,20 +312,11 @@ class ContinentWidget(QtGui.QWidget):
         self.connect(sw, QtCore.SIGNAL('QuickSearch()'), self.search_done)
 
     def search_done(self):
-        results = []
-        for town in self.townlist:
-            for store in town.stores:
-                list = self.searchcriteria.search(store)
-                for item in list:
-                    item.store = store
-                    item.town = town
-                results += list
-        if results == []:
-            QtGui.QMessageBox(QtGui.QMessageBox.Information, 'No Results',
-                              'There are no items available matching your' + \
-                              ' specified criteria.', QtGui.QMessageBox.Ok).exec_()
-            return
-        ResultsWindow(self, results)
+        criteria = Planner().plan(self.searchcriteria)
+        if self.snapshot is None:
+            self.snapshot = opensnapshot(self.index)
+        ResultsWindow(self, job=SearchJob(self.index, criteria,
+                                          snapshot=self.snapshot))
 
     def update_all(self):
         res = QtGui.QMessageBox(QtGui.QMessageBox.Warning,
@@ -312,12 +326,32 @@ class ContinentWidget(QtGui.QWidget):
                                 + ' items may be sold or added when you update.',
                                 QtGui.QMessageBox.Yes | QtGui.QMessageBox.No).exec_()
         if (res == QtGui.QMessageBox.Yes):
-            removedlist = []
-            for town in self.townlist:
-                removedlist += town.update()
-                town.save()
+            update = ParallelUpdate(self.index)
+            progress = QtGui.QProgressDialog('Updating all towns...', None,
+                                             0, len(self.index), self)
+            progress.setWindowModality(QtCore.Qt.WindowModal)
+            progress.setMinimumDuration(0)
+            for done, total in update.run():
+                progress.setValue(done)
+                QtGui.QApplication.processEvents()
+            progress.close()
             self._buildlist()
-            CommissionWindow(self, removedlist)
+            CommissionWindow(self, update.removed)
+
+    def print_all(self):
+        filename = QtGui.QFileDialog.getSaveFileName(self, 'Print All Towns',
+                                                     'continent.txt',
+                                                     'Text files (*.txt)')
+        if filename:
+            printer = ParallelPrint(self.index, str(filename))
+            progress = QtGui.QProgressDialog('Printing all towns...', None,
+                                             0, len(self.index), self)
+            progress.setWindowModality(QtCore.Qt.WindowModal)
+            progress.setMinimumDuration(0)
+            for done, total in printer.run():
+                progress.setValue(done)
+                QtGui.QApplication.processEvents()
+            progress.close()
 
     def _selected(self):
         i = self.townselect.currentItem()
@@ -326,13 +360,15 @@ class ContinentWidget(QtGui.QWidget):
         return None
 
     def _gathertowns(self):
-        townfiles = glob.glob('towns/*.town')
-        self.townlist = []
-        for file in townfiles:
-            myfile = open(file, 'rb')
-            town = pickle.load(myfile)
-            myfile.close()
-            self.townlist.append(town)
+        if self.index is None:
+            self.index = opencontinent()
+        self.index.refresh()
+        self._closesnapshot()
+
+    def _closesnapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
 
     def _buildlist(self, recheck=False):
         if recheck:
@@ -340,8 +376,12 @@ class ContinentWidget(QtGui.QWidget):
         self.townselect.clear()
         self.townselect.setColumnCount(4)
         self.townselect.setHeaderLabels(('', 'Name', 'Size', '# Stores'))
-        for town in self.townlist:
-            TownTree(self.townselect, town)
+        for entry in self.index:
+            TownTree(self.townselect, entry, self.index)
+
+    def _expanded(self, item):
+        if isinstance(item, TownTree):
+            item.populate()
 
     def new_town(self):
         """Create a new town."""
@@ -350,7 +390,7 @@ class ContinentWidget(QtGui.QWidget):
                      self.new_town_done)
 
     def new_town_done(self):
-        self._buildlist(recheck=True)
+        self._buildlist()
 
     def rename(self):
         """Rename the selected town/store."""
@@ -364,9 +404,14 @@ class ContinentWidget(QtGui.QWidget):
                                         "Enter a new name for %s:" % loc.name,
                                         QtGui.QLineEdit.Normal, str(loc.name))
         if ok:
-            loc.name = name
+            if loc is i.town:
+                loc.name = name
+            else:
+                i.town.renamestore(loc, name)
             i.rename(str(loc))
         i.town.save()  # always save, to replace town removal on a cancel
+        self.index.cache(i.town)
+        self._buildlist()
 
     def delete_town(self):
         """Delete the selected town."""
@@ -383,9 +428,7 @@ class ContinentWidget(QtGui.QWidget):
                                 QtGui.QMessageBox.Yes | QtGui.QMessageBox.No).exec_()
         if (res == QtGui.QMessageBox.Yes):
             town.delete()
-            self.townselect.removeItemWidget(self.townselect.currentItem(), 0)
-            self.townlist.remove(town)
-            self._buildlist(recheck=True)
+            self._buildlist()
 
     def open_town(self):
         town = self._selected()
@@ -0,0 +1,150 @@
+import os
+from PyQt4 import QtGui
+
+from elvenfire.artifacts.potion import *
+from storemanager.locations import store
+from storemanager.stockitems import capabilities
+from storemanager.stockitems.special import SpecialArtifactStockItem, STBatteryStockItem, TrainableAnimalStockItem
+from storemanager.stockitems.combat import WeaponStockItem, ArmorStockItem
+from storemanager.stockitems.greater import RodStockItem, RingStockItem
+from storemanager.stockitems.lesser import GemStockItem, AmuletStockItem
+from storemanager.stockitems.written import ScrollStockItem, BookStockItem
+from storemanager.stockitems.potion import *
+
+
+directory = 'icons'
+
+itemicons = {RodStockItem : 'rod.png',
+             TrainableAnimalStockItem : 'animal.png',
+             RingStockItem : 'ring.png',
+             ArmorStockItem : 'shield.png',
+             WeaponStockItem : 'weapon.png',
+             GemStockItem : 'gem.png',
+             BookStockItem : 'book.png',
+             ScrollStockItem : 'scroll.png',
+             SpecialArtifactStockItem : 'magic.png',
+             PotionStockItem : 'potion.png',
+             AmuletStockItem : 'amulet.png',
+             STBatteryStockItem : 'STBattery.png',
+
+             'Sword' : 'sword.png',
+             'Ax/Mace/Hammer' : 'ax.png',
+             'Pole Weapon' : 'poleweapons.png',
+             #'Unusual Weapon',
+             'Drawn Bow' : 'bow.png',
+             'Cross Bow' : 'crossbow.png',
+
+             HealingPotion : 'potionblue.png',
+             WeaponPoison : 'potionteal.png',
+             Grenade : 'potionred.png',
+             AttributePotion : 'potionyellow.png',
+             AbilityPotion : 'potionpurple.png',
+             SpecialPotion : 'potiongrey.png',
+            }
+
+storeicons = {store.GeneralStore : 'general.png',
+              store.AnimalStore : 'animal.png',
+              store.BookStore : 'book.png',
+              store.PotionStore : 'potion.png',
+              store.PhysicalWeaponStore : 'weapon.png',
+              store.WeaponStore : 'rod.png',
+              store.ArmorStore : 'armorstore.png',
+              store.MagicStore : 'magic.png',
+              store.GemStore : 'gem.png',
+             }
+
+othericons = ('helmet.png', 'search.png')
+
+_icons = {}     # filename -> QIcon, or None if there is no such file
+_items = {}     # itemkey() -> (filename, tooltip)
+
+
+def classname(cls):
+    """Return e.g. 'HealingPotion' for <class 'something.HealingPotion'>."""
+    name = str(cls)
+    i1 = name.rfind('.')
+    i2 = name.find("'", i1)
+    return name[i1+1:i2]
+
+
+def icon(filename):
+    """Return the QIcon for a file in the icons directory, or None.
+
+    Each file is checked and loaded only once per process.
+
+    """
+    if filename not in _icons:
+        path = os.path.join(directory, str(filename))
+        _icons[filename] = QtGui.QIcon(path) if os.path.isfile(path) else None
+    return _icons[filename]
+
+
+def preload():
+    """Load every known icon, e.g. once at startup."""
+    for filename in (list(itemicons.values()) + list(storeicons.values()) +
+                     list(othericons)):
+        icon(filename)
+
+
+def itemkey(item):
+    """Return the key deciding an item's icon: class, armor, style, potion."""
+    cls = type(item)
+    if cls == ArmorStockItem:
+        return (cls, item.type in item.armortypes,
+                item.type in item.shieldtypes)
+    if cls == PotionStockItem:
+        return (cls, item.cls)
+    if capabilities(item).style:
+        return (cls, item.style)
+    return (cls,)
+
+
+def _itemlookup(item):
+    """Return (icon filename, icon tooltip) for item; tooltip may be None."""
+    cls = type(item)
+    filename = itemicons[cls]
+    tooltip = None
+    if cls == ArmorStockItem and item.type in item.armortypes:
+        filename = 'helmet.png'
+    elif cls == PotionStockItem and item.cls in itemicons:
+        filename = itemicons[item.cls]
+    if capabilities(item).style and item.style in itemicons:  # Weapon
+        filename = itemicons[item.style]
+    if cls == ArmorStockItem and item.type in item.shieldtypes:
+        tooltip = 'Shield'
+    if cls == PotionStockItem:
+        tooltip = classname(item.cls)  # e.g. 'HealingPotion'
+    if cls == WeaponStockItem:
+        tooltip = item.style
+    return (filename, tooltip)
+
+
+def _item(item):
+    if type(item) not in itemicons:
+        return (None, None)
+    key = itemkey(item)
+    if key not in _items:
+        _items[key] = _itemlookup(item)
+    return _items[key]
+
+
+def itemicon(item):
+    """Return the QIcon for item, or None."""
+    filename = _item(item)[0]
+    return icon(filename) if filename is not None else None
+
+
+def itemtooltip(item):
+    """Return the tooltip for the icon of item, or None."""
+    if type(item) not in itemicons:
+        return None
+    tooltip = _item(item)[1]
+    if tooltip is None and capabilities(item).itemtype:
+        return item.itemtype
+    return tooltip
+
+
+def storeicon(store):
+    """Return the QIcon for store, or None."""
+    cls = type(store)
+    return icon(storeicons[cls]) if cls in storeicons else None
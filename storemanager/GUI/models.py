@@ -0,0 +1,428 @@
+from operator import attrgetter
+from PyQt4 import QtGui, QtCore
+
+from elvenfire.abilities.itemabilities import WeaponAbility
+from elvenfire.artifacts.potion import HealingPotion
+from storemanager.locations.university import University, Class
+from storemanager.stockitems import _StockItem, capabilities
+from storemanager.stockitems.combat import WeaponStockItem
+from storemanager.GUI import icons
+
+
+class Node:
+
+    """One row of a TreeModel.
+
+    Rows are created without computing any text; children are created the
+    first time they are asked for. Like the QTreeWidgetItems they replace,
+    rows offer store and item attributes for the selected store/item.
+
+    Attributes:
+      kind   -- 'store', 'university', 'day', 'course', 'healing', 'item',
+                'ability', or 'results'
+      obj    -- the Store, Class, item, ability, etc displayed
+      parent -- parent Node (None for the root)
+      row    -- position within parent
+      store  -- Store the row belongs to, if any
+      town   -- Town the row belongs to, if known (for search results)
+      item   -- item the row belongs to, if any
+
+    """
+
+    def __init__(self, parent, kind, obj, row=0):
+        self.parent = parent
+        self.kind = kind
+        self.obj = obj
+        self.row = row
+        self.store = parent.store if parent is not None else None
+        self.town = parent.town if parent is not None else None
+        self.item = parent.item if parent is not None else None
+        if kind in ('store', 'university', 'healing'):
+            self.store = obj
+        elif kind in ('item', 'course'):
+            self.item = obj
+        self.results = []  # (item, store, town), for 'results' and the root
+        self._children = None
+
+    def children(self):
+        if self._children is None:
+            self._children = self._build()
+        return self._children
+
+    def _nodes(self, kind, objects):
+        return [Node(self, kind, obj, row) for row, obj in enumerate(objects)]
+
+    def _build(self):
+        """Return the child Nodes of this row."""
+        if self.kind == 'store':
+            nodes = []
+            if self.obj.healingpotion > 0:
+                nodes.append(Node(self, 'healing', self.obj))
+            for item in self.obj.getitems():
+                nodes.append(Node(self, 'item', item, len(nodes)))
+            return nodes
+        if self.kind == 'university':
+            return self._nodes('day', range(5))
+        if self.kind == 'day':
+            return self._nodes('course', self.parent.obj.getitems(self.obj))
+        if self.kind == 'results':
+            return self._results(self.results)
+        if self.kind == 'item':
+            item = self.obj
+            if isinstance(item, WeaponStockItem) and item.changling:
+                return self._nodes('item', (item.primaryweapon,
+                                            item.secondaryweapon))
+            if capabilities(item).abilities and len(item.abilities) > 1:
+                return self._nodes('ability', _byIIQ(item.abilities))
+            return []
+        if self.kind == 'ability':
+            ability = self.obj
+            if (isinstance(ability, WeaponAbility) and
+                    ability.type == 'Enhanced' and len(ability.abilities) > 1):
+                return self._nodes('ability', _byIIQ(ability.abilities))
+            return []
+        return []
+
+    def _results(self, results, start=0):
+        """Return item Nodes for (item, store, town) search results."""
+        nodes = []
+        for row, (item, store, town) in enumerate(results, start):
+            node = Node(self, 'item', item, row)
+            node.store, node.town = store, town
+            nodes.append(node)
+        return nodes
+
+    def renumber(self, start=0):
+        for row in range(start, len(self._children)):
+            self._children[row].row = row
+
+
+def _byIIQ(abilities):
+    """Return abilities sorted by IIQ, highest first, where possible."""
+    try:
+        return sorted(abilities, key=attrgetter('IIQ'), reverse=True)
+    except AttributeError:
+        return list(abilities)
+
+
+class TreeModel (QtCore.QAbstractItemModel):
+
+    """Lazy model of the stores of a town, or of a list of search results.
+
+    Text, icons, and tooltips are computed by data() only for the rows the
+    view actually displays, and rows are inserted and removed individually
+    as the town changes, instead of rebuilding the whole tree.
+
+    Usage:
+      TreeModel(town=town)       -- stores of town (TownWidget)
+      TreeModel(results=found)   -- (item, store, town) search results, with
+                                    store & town columns
+
+    Sort a view of the model through a QSortFilterProxyModel with
+    sortRole set to TreeModel.SortRole.
+
+    """
+
+    SortRole = QtCore.Qt.UserRole
+
+    def __init__(self, parent=None, town=None, results=None):
+        QtCore.QAbstractItemModel.__init__(self, parent)
+        self.town = town
+        self.showloc = town is None
+        if self.showloc:
+            self.columns = ('icon', 'name', 'store', 'town', 'FMV', 'price')
+            self.headers = ('', 'Name', 'Store', 'Town', 'FMV', 'Price')
+        else:
+            self.columns = ('icon', 'name', 'FMV', 'price')
+            self.headers = ('', 'Name', 'FMV', 'Price')
+        self.root = None
+        self._setroot(results or [])
+
+    def _setroot(self, results=()):
+        self.root = Node(None, 'results', None)
+        self.root.results = list(results)
+        if self.town is not None:
+            nodes = []
+            for store in self.town.stores:
+                kind = 'university' if isinstance(store, University) \
+                                    else 'store'
+                nodes.append(Node(self.root, kind, store, len(nodes)))
+            self.root._children = nodes
+
+    ## Structure
+
+    def node(self, index):
+        """Return the Node for a model index (the root if invalid)."""
+        if not index.isValid():
+            return self.root
+        return index.internalPointer()
+
+    def indexof(self, node):
+        """Return the model index of a Node."""
+        if node is self.root:
+            return QtCore.QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        children = self.node(parent).children()
+        if not (0 <= row < len(children) and
+                0 <= column < len(self.columns)):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        return self.indexof(index.internalPointer().parent)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() and parent.column() > 0:
+            return 0
+        return len(self.node(parent).children())
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.columns)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal and
+                role == QtCore.Qt.DisplayRole):
+            return self.headers[section]
+        return None
+
+    ## Changes
+
+    def reset(self):
+        """Rebuild the model after the town's stores changed."""
+        self.beginResetModel()
+        self._setroot(self.root.results)
+        self.endResetModel()
+
+    def _insert(self, parent, nodes, row=None):
+        children = parent.children()
+        if row is None:
+            row = len(children)
+        if not nodes:
+            return
+        self.beginInsertRows(self.indexof(parent), row, row + len(nodes) - 1)
+        children[row:row] = nodes
+        parent.renumber(row)
+        self.endInsertRows()
+
+    def _remove(self, node):
+        parent = node.parent
+        self.beginRemoveRows(self.indexof(parent), node.row, node.row)
+        del parent._children[node.row]
+        parent.renumber(node.row)
+        self.endRemoveRows()
+
+    def appenditems(self, items):
+        """Add (item, store, town) search results to a results model."""
+        start = len(self.root.children())
+        self.root.results += items
+        self._insert(self.root, self.root._results(items, start))
+
+    def addresults(self, items, tooltip=''):
+        """Add a 'Search Results' row holding (item, store, town); return it."""
+        node = Node(self.root, 'results', tooltip)
+        node.results = list(items)
+        self._insert(self.root, [node])
+        return node
+
+    def clearresults(self):
+        """Remove all 'Search Results' rows."""
+        for node in reversed(self.root.children()):
+            if node.kind == 'results':
+                self._remove(node)
+
+    def removeitem(self, item, parent=None):
+        """Remove every row displaying item (e.g. after a purchase).
+
+        Only rows already built are searched; rows built later are built
+        from the current stock.
+
+        """
+        if parent is None:
+            parent = self.root
+        for node in list(parent._children or ()):
+            if node.obj is item and node.kind == 'item':
+                self._remove(node)
+            else:
+                self.removeitem(item, node)
+
+    def storechanged(self, store):
+        """Rebuild the rows of store (e.g. after adding an item); return it."""
+        for node in self.root.children():
+            if node.obj is store and node.kind == 'store':
+                if node._children is not None:  # built, perhaps empty
+                    if node._children:
+                        self.beginRemoveRows(self.indexof(node), 0,
+                                             len(node._children) - 1)
+                        node._children = []
+                        self.endRemoveRows()
+                    self._insert(node, node._build())
+                last = self.createIndex(node.row, len(self.columns) - 1, node)
+                self.emit(QtCore.SIGNAL('dataChanged(QModelIndex,QModelIndex)'),
+                          self.indexof(node), last)
+                return node
+
+    def findstore(self, store):
+        """Return the Node of store, or None."""
+        for node in self.root.children():
+            if node.obj is store:
+                return node
+
+    ## Display
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        column = self.columns[index.column()]
+        if role == self.SortRole:
+            return self._sortkey(node, column)
+        if role == QtCore.Qt.TextAlignmentRole:
+            if column in ('FMV', 'price') and node.kind != 'ability':
+                return QtCore.Qt.AlignRight
+            return None
+        method = getattr(self, '_%s' % node.kind)
+        return method(node, column, role)
+
+    def _sortkey(self, node, column):
+        if node.kind == 'item' and isinstance(node.obj, _StockItem):
+            if column == 'FMV':
+                return node.obj.value
+            if column == 'price':
+                return node.obj.price()
+        return self.data(self.createIndex(node.row,
+                                          self.columns.index(column), node))
+
+    def _store(self, node, column, role):
+        store = node.obj
+        if column == 'icon':
+            cls = type(store)
+            if cls in icons.storeicons:
+                if role == QtCore.Qt.DecorationRole:
+                    return icons.storeicon(store)
+                if role == QtCore.Qt.ToolTipRole:
+                    return cls.__doc__
+        elif column == 'name':
+            if role == QtCore.Qt.DisplayRole:
+                return str(store)
+            if role == QtCore.Qt.ToolTipRole:
+                return str(store.description)
+        return None
+
+    def _university(self, node, column, role):
+        if column == 'name' and role == QtCore.Qt.DisplayRole:
+            return node.obj.name
+        return None
+
+    def _day(self, node, column, role):
+        if column == 'name' and role == QtCore.Qt.DisplayRole:
+            return Class.Days[node.obj]
+        return None
+
+    def _course(self, node, column, role):
+        if role == QtCore.Qt.DisplayRole:
+            if column == 'name':
+                return str(node.obj.name)
+            if column == 'price':
+                return str(node.obj.value)
+        return None
+
+    def _results(self, node, column, role):
+        if column == 'icon' and role == QtCore.Qt.DecorationRole:
+            return icons.icon('search.png')
+        if column == 'name':
+            if role == QtCore.Qt.DisplayRole:
+                return 'Search Results'
+            if role == QtCore.Qt.ToolTipRole:
+                return node.obj
+        return None
+
+    def _ability(self, node, column, role):
+        ability = node.obj
+        if column == 'name':
+            if role == QtCore.Qt.DisplayRole:
+                return str(ability)
+            if role == QtCore.Qt.ToolTipRole:
+                return str(ability.description())
+        elif column == 'FMV':
+            if role == QtCore.Qt.DisplayRole:
+                return str(ability.AC)
+            if role == QtCore.Qt.ToolTipRole:
+                return 'Base AC for this ability'
+        return None
+
+    def _healing(self, node, column, role):
+        store = node.obj
+        if column == 'icon':
+            if role == QtCore.Qt.DecorationRole:
+                return icons.icon(icons.itemicons[HealingPotion])
+            if role == QtCore.Qt.ToolTipRole:
+                return 'HealingPotion'
+        elif column == 'name':
+            if role == QtCore.Qt.DisplayRole:
+                return ("Healing Potion (%s doses available)" %
+                        store.healingpotion)
+            if role == QtCore.Qt.ToolTipRole:
+                return getattr(HealingPotion, 'desc', None)
+        elif column == 'FMV':
+            if role == QtCore.Qt.DisplayRole:
+                return '50'
+            if role == QtCore.Qt.ToolTipRole:
+                return 'Fair Market Value, per dose'
+        elif column == 'price':
+            if role == QtCore.Qt.DisplayRole:
+                return str(store.healingprice())
+            return _markup(store.healingmarkup, role, 'Per Dose ')
+        return None
+
+    def _item(self, node, column, role):
+        item = node.obj
+        stockitem = isinstance(item, _StockItem)  # catch Changling subs
+        if column == 'icon':
+            if role == QtCore.Qt.DecorationRole:
+                return icons.itemicon(item)
+            if role == QtCore.Qt.ToolTipRole:
+                return icons.itemtooltip(item)
+        elif column == 'name':
+            if role == QtCore.Qt.DisplayRole:
+                return item.short() if stockitem else str(item)
+            if role == QtCore.Qt.ToolTipRole:
+                return item.description()
+        elif column == 'FMV':
+            if role == QtCore.Qt.DisplayRole:
+                return str(item.value)
+            if role == QtCore.Qt.ToolTipRole:
+                return 'Fair Market Value'
+        elif column == 'price' and stockitem:
+            if role == QtCore.Qt.DisplayRole:
+                return str(item.price())
+            return _markup(item.markup, role)
+        elif column == 'store' and node.store is not None:
+            if role == QtCore.Qt.DisplayRole:
+                return str(node.store)
+            if role == QtCore.Qt.ToolTipRole:
+                return str(node.store.description)
+        elif column == 'town' and node.town is not None:
+            if role == QtCore.Qt.DisplayRole:
+                return str(node.town)
+            if role == QtCore.Qt.ToolTipRole:
+                if hasattr(node.town, 'description'):
+                    return str(node.town.description)
+        return None
+
+
+def _markup(markup, role, prefix=''):
+    """Return the tooltip or text colour for a price with markup."""
+    if role == QtCore.Qt.ToolTipRole:
+        if markup >= 100:
+            return '%sMarkup: %s%%' % (prefix, markup - 100)
+        return '%sMarkdown: %s%%' % (prefix, 100 - markup)
+    if role == QtCore.Qt.ForegroundRole:
+        if markup > 115:
+            return QtGui.QColor(150, 0, 0)  # red text
+        if markup < 100:
+            return QtGui.QColor(0, 150, 0)  # green text
+    return None
@@ -12,6 +12,7 @@ from elvenfire.abilities.charabilities import *
 from storemanager.search.criterion import *
 from storemanager.search.criteriaset import *
 from storemanager.GUI.treeitems import *
+from storemanager.GUI.models import TreeModel
 from storemanager.GUI import GUIError
 
 
@@ -319,6 +320,10 @@ class SearchWidget(QtGui.QWidget):
         box.addWidget(label)
         self.textsearch = QtGui.QLineEdit(self)
         box.addWidget(self.textsearch)
+        self.allwords = QtGui.QCheckBox('All words', self)
+        self.allwords.setToolTip('Match items containing every word, in any' +
+                                 ' order.')
+        box.addWidget(self.allwords)
 
         # Item Type
         box = QtGui.QHBoxLayout()
@@ -719,8 +724,9 @@ class SearchWidget(QtGui.QWidget):
         self.maincriteria = ANDCriteriaSet([])
 
         # Text Search
-        if self.textsearch.text() != '':
-            crit = TextCriterion(self.textsearch.text())
+        if self.textsearch.text().strip() != '':
+            crit = TextCriterion(self.textsearch.text(),
+                                 self.allwords.isChecked())
             self.maincriteria.addcriterion(crit)
 
         # Item Type
@@ -842,22 +848,99 @@ class SearchWidget(QtGui.QWidget):
             QtGui.QWidget.keyPressEvent(self, event)
 
 
+class SearchThread(QtCore.QThread):
+
+    """Run a SearchJob in the background.
+
+    Emits found(items) with each chunk of matching items, and the usual
+    finished() once the job is done or cancelled.
+
+    """
+
+    def __init__(self, parent, job):
+        QtCore.QThread.__init__(self, parent)
+        self.job = job
+
+    def run(self):
+        for items in self.job.run():
+            self.emit(QtCore.SIGNAL('found'), items)
+
+
 class ResultsWindow(QtGui.QMainWindow):
 
-    def __init__(self, parent, results):
+    """Display search results, optionally filled in by a SearchJob.
+
+    If a job is given, it is run in a SearchThread and results are added
+    as they are found. The search may be cancelled from the Search menu,
+    or by closing the window.
+
+    """
+
+    def __init__(self, parent, results=(), job=None):
         QtGui.QMainWindow.__init__(self, parent)
         self.setGeometry(200, 100, 850, 800)
         self.setWindowTitle('Search Results')
-        display = QtGui.QTreeWidget(self)
-        self.setCentralWidget(display)
-
-        display.setColumnCount(6)
-        display.setSortingEnabled(True)
-        for item in results:
-            ItemTree(display, item, showloc=True)
+        self.model = TreeModel(self, results=results)
+        self.proxy = QtGui.QSortFilterProxyModel(self)
+        self.proxy.setSortRole(TreeModel.SortRole)
+        self.proxy.setSourceModel(self.model)
+        self.display = QtGui.QTreeView(self)
+        self.display.setUniformRowHeights(True)
+        self.display.setModel(self.proxy)
+        self.setCentralWidget(self.display)
+        self.display.setColumnWidth(0, 75)
+        self.display.setColumnWidth(1, 250)
+        self.display.setColumnWidth(2, 175)
+        self.display.setColumnWidth(3, 125)
+        self.display.setSortingEnabled(True)
+
+        self.job = job
+        if self.job is not None:
+            cancel = QtGui.QAction('&Cancel Search', self)
+            cancel.setShortcut('Esc')
+            cancel.setStatusTip('Stop searching; keep the results so far')
+            self.connect(cancel, QtCore.SIGNAL('triggered()'), self.cancel)
+            self.menuBar().addMenu('Search').addAction(cancel)
+            self.display.setSortingEnabled(False)  # until all are added
+            self.thread = SearchThread(self, job)
+            self.connect(self.thread, QtCore.SIGNAL('found'), self.add)
+            self.connect(self.thread, QtCore.SIGNAL('finished()'),
+                         self.search_done)
+            self.statusBar().showMessage('Searching...')
+            self.thread.start()
         self.center()
         self.show()
 
+    def add(self, items):
+        self.model.appenditems(items)
+        if self.job is not None:
+            self.statusBar().showMessage('Searching... %s found (%s/%s towns)'
+                                         % (self.job.found, self.job.done,
+                                            self.job.total))
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    def search_done(self):
+        self.display.setSortingEnabled(True)
+        if self.job.cancelled():
+            self.statusBar().showMessage('Search cancelled: %s found' %
+                                         self.job.found)
+            return
+        self.statusBar().showMessage('%s found' % self.job.found)
+        if self.job.found == 0:
+            QtGui.QMessageBox(QtGui.QMessageBox.Information, 'No Results',
+                              'There are no items available matching your' + \
+                              ' specified criteria.', QtGui.QMessageBox.Ok).exec_()
+            self.close()
+
+    def closeEvent(self, event):
+        if self.job is not None:
+            self.job.cancel()
+            self.thread.wait()
+        QtGui.QMainWindow.closeEvent(self, event)
+
     def center(self):
         screen = QtGui.QDesktopWidget().screenGeometry()
         size = self.geometry()
@@ -9,8 +9,11 @@ from elvenfire.artifacts.written import *
 from elvenfire.artifacts.potion import *
 from storemanager.locations.store import *
 from storemanager.locations.university import *
+from storemanager.search.planner import Planner
 from storemanager.GUI.search import SearchWidget
 from storemanager.GUI.treeitems import *
+from storemanager.GUI.models import TreeModel
+from storemanager.GUI import icons
 from storemanager.GUI.additem import AddItemWidget
 from storemanager.GUI.commission import CommissionWindow
 
@@ -162,28 +165,6 @@ class NewStoreWidget(QtGui.QWidget):
 
 class TownWidget(QtGui.QWidget):
 
-    iconlookup = {Rod : 'rod.png',
-                  TrainableAnimal : 'animal.png',
-                  Ring : 'ring.jpg',
-                  Armor : 'shield.png',
-                  Weapon : 'weapon.png',
-                  Gem : 'gem.jpg',
-                  Book : 'book.png',
-                  Scroll : 'scroll.jpg',
-                  SpecialArtifact : 'magic.png',
-                  Potion : 'potion.png',
-
-                  GeneralStore : 'general.png',
-                  AnimalStore : 'animal.png',
-                  BookStore : 'book.png',
-                  PotionStore : 'potion.png',
-                  PhysicalWeaponStore : 'weapon.png',
-                  WeaponStore : 'rod.png',
-                  ArmorStore : 'shield.png',
-                  MagicStore : 'magic.png',
-                  GemStore : 'gems.jpg',
-                 }
-
     def show(self):
         self.window_ = QtGui.QMainWindow()
         self.window_.setGeometry(200, 100, 850, 750)
@@ -204,9 +185,9 @@ class TownWidget(QtGui.QWidget):
                           (screen.height() - size.height()) / 2)
 
     def _seticon(self, action, name):
-        filename = 'icons/' + str(name)
-        if os.path.isfile(filename):
-            action.setIcon(QtGui.QIcon(filename))
+        icon = icons.icon(name)
+        if icon is not None:
+            action.setIcon(icon)
 
     def __init__(self, parent, town):
         self.town = town
@@ -304,7 +285,7 @@ class TownWidget(QtGui.QWidget):
 
         # Connect Actions
         self.connect(update, QtCore.SIGNAL('triggered()'), self.update)
-        self.connect(clear, QtCore.SIGNAL('triggered()'), self._buildtree)
+        self.connect(clear, QtCore.SIGNAL('triggered()'), self.clear)
         self.connect(search, QtCore.SIGNAL('triggered()'), self.search)
         self.connect(purchase, QtCore.SIGNAL('triggered()'), self.purchase)
         self.connect(additem, QtCore.SIGNAL('triggered()'), self.additem)
@@ -336,9 +317,16 @@ class TownWidget(QtGui.QWidget):
         hbox.addWidget(self.update_btn, 2)
 
         # Store listing
-        self.storeselect = QtGui.QTreeWidget(self)
+        self.model = TreeModel(self, town=self.town)
+        self.proxy = QtGui.QSortFilterProxyModel(self)
+        self.proxy.setSortRole(TreeModel.SortRole)
+        self.proxy.setSourceModel(self.model)
+        self.storeselect = QtGui.QTreeView(self)
+        self.storeselect.setUniformRowHeights(True)
+        self.storeselect.setModel(self.proxy)
+        self.storeselect.setColumnWidth(0, 75)
+        self.storeselect.setColumnWidth(1, 500)
         self.storeselect.setSortingEnabled(True)
-        self._buildtree()
         mbox.addWidget(self.storeselect)
 
         # Buttons: Search
@@ -399,30 +387,40 @@ class TownWidget(QtGui.QWidget):
         itemmenu.addAction(additem)
         
 
+    def _selected(self):
+        index = self.storeselect.currentIndex()
+        if not index.isValid():
+            return None
+        return self.model.node(self.proxy.mapToSource(index))
+
     def _selectedstore(self):
-        i = self.storeselect.currentItem()
-        if 'store' in dir(i):
-            return self.storeselect.currentItem().store
-        return None
+        node = self._selected()
+        return node.store if node is not None else None
 
     def _selecteditem(self):
-        i = self.storeselect.currentItem()
-        if 'item' in dir(i):
-            return i.item
-        return None
+        node = self._selected()
+        return node.item if node is not None else None
+
+    def _expand(self, node):
+        index = self.proxy.mapFromSource(self.model.indexof(node))
+        self.storeselect.setExpanded(index, True)
+        return index
 
     def _buildtree(self, expand=None):
-        self.storeselect.clear()
-        self.storeselect.setColumnCount(4)
-        for store in self.town.stores:
-            if isinstance(store, University):
-                UniversityTree(self.storeselect, store)
-            else:
-                s = StoreTree(self.storeselect, store)
-                if expand is not None and expand == store:
-                    s.setExpanded(True)
+        """Refresh the display after the stores of the town changed."""
+        self.model.reset()
+        if expand is not None:
+            self._expand(self.model.findstore(expand))
+        self.parent._buildlist()
+
+    def _storechanged(self, store):
+        """Refresh the display of store after its items changed."""
+        self._expand(self.model.storechanged(store))
         self.parent._buildlist()
 
+    def clear(self):
+        self.model.clearresults()
+
 
     ## Town-Wide Actions ##
 
@@ -444,17 +442,12 @@ class TownWidget(QtGui.QWidget):
         self.connect(sw, QtCore.SIGNAL('QuickSearch()'), self.search_done)
 
     def search_done(self):
-        itemlist = self.searchcriteria.search(self.town)
-        s = QtGui.QTreeWidgetItem(self.storeselect)
-        s.store = self.town
-        searchicon = 'icons/search.png'
-        if os.path.isfile(searchicon):
-            s.setIcon(0, QtGui.QIcon(searchicon))
-        s.setText(1, 'Search Results')
-        for item in itemlist:
-            ItemTree(s, item)
-        s.setExpanded(True)
-        self.storeselect.scrollToItem(s)
+        planner = Planner(self.town.itemindex())
+        itemlist = planner.plan(self.searchcriteria).search(self.town)
+        found = [(item, self.town.holder(item), self.town) for item in itemlist]
+        s = self.model.addresults(found,
+                                  planner.explain(self.searchcriteria))
+        self.storeselect.scrollTo(self._expand(s))
 
     def print(self):
         filename = QtGui.QFileDialog.getSaveFileName(self, 'Print Town to File',
@@ -483,7 +476,8 @@ class TownWidget(QtGui.QWidget):
     def purchase(self):
         item = self._selecteditem()
         store = self._selectedstore()
-        if isinstance(self.storeselect.currentItem(), HealingPotionTree):
+        node = self._selected()
+        if node is not None and node.kind == 'healing':
             return self.purchase_healingpotion(store)
         if item is None:
             if store is not None:
@@ -511,9 +505,10 @@ class TownWidget(QtGui.QWidget):
                                 QtGui.QMessageBox.Yes | 
                                 QtGui.QMessageBox.No).exec_()
             if (res == QtGui.QMessageBox.Yes):
-                store.purchase(item)
+                self.town.purchase(item, store)
                 self.town.save()
-                self._buildtree(expand=store)
+                self.model.removeitem(item)
+                self.parent._buildlist()
                 if item.commission:
                     CommissionWindow(self, [item])
 
@@ -523,9 +518,9 @@ class TownWidget(QtGui.QWidget):
                                               ' like to purchase?', 1,
                                               1, store.healingpotion)
         if ok:
-            store.healingpotion -= doses
+            self.town.purchase_healingpotion(store, doses)
             self.town.save()
-            self._buildtree(expand=store)
+            self._storechanged(store)
 
 
     ## Store Actions ##
@@ -560,7 +555,7 @@ class TownWidget(QtGui.QWidget):
                                        QtGui.QMessageBox.No).exec_()
                 if res != QtGui.QMessageBox.Yes:
                     return
-            store.name = name
+            self.town.renamestore(store, name)
             self.town.save()
             self._buildtree()
 
@@ -578,7 +573,7 @@ class TownWidget(QtGui.QWidget):
                                 QtGui.QMessageBox.Yes | 
                                 QtGui.QMessageBox.No).exec_()
         if (res == QtGui.QMessageBox.Yes):
-            self.town.stores.remove(store)
+            self.town.removestore(store)
             self.town.save()
             self._buildtree()
 
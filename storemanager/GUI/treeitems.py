@@ -1,4 +1,3 @@
-import os
 from operator import attrgetter
 from PyQt4 import QtGui, QtCore
 
@@ -6,13 +5,9 @@ from elvenfire.abilities.itemabilities import WeaponAbility
 from elvenfire.artifacts.potion import *
 from storemanager.locations import store
 from storemanager.locations.university import Class
-from storemanager.stockitems import _StockItem
-from storemanager.stockitems.special import SpecialArtifactStockItem, STBatteryStockItem, TrainableAnimalStockItem
-from storemanager.stockitems.combat import WeaponStockItem, ArmorStockItem
-from storemanager.stockitems.greater import RodStockItem, RingStockItem
-from storemanager.stockitems.lesser import GemStockItem, AmuletStockItem
-from storemanager.stockitems.written import ScrollStockItem, BookStockItem
-from storemanager.stockitems.potion import *
+from storemanager.stockitems import _StockItem, capabilities
+from storemanager.stockitems.combat import WeaponStockItem
+from storemanager.GUI import icons
 
 class AbilityTree (QtGui.QTreeWidgetItem):
 
@@ -40,42 +35,18 @@ class AbilityTree (QtGui.QTreeWidgetItem):
         # Special: Enhanced has sub-abilities
         if isinstance(ability, WeaponAbility) and self.type == 'Enhanced':
             if len(ability.abilities) > 1:
+                abilities = ability.abilities  # shared; do not sort in place
                 try:
-                    ability.abilities.sort(key=attrgetter('IIQ'), reverse=True)
+                    abilities = sorted(abilities, key=attrgetter('IIQ'),
+                                       reverse=True)
                 except AttributeError: pass
-                for a in ability.abilities:
+                for a in abilities:
                     AbilityTree(self, a)
 
 
 class ItemTree (QtGui.QTreeWidgetItem):
 
-    iconlookup = {RodStockItem : 'rod.png',
-                  TrainableAnimalStockItem : 'animal.png',
-                  RingStockItem : 'ring.png',
-                  ArmorStockItem : 'shield.png',
-                  WeaponStockItem : 'weapon.png',
-                  GemStockItem : 'gem.png',
-                  BookStockItem : 'book.png',
-                  ScrollStockItem : 'scroll.png',
-                  SpecialArtifactStockItem : 'magic.png',
-                  PotionStockItem : 'potion.png',
-                  AmuletStockItem : 'amulet.png',
-                  STBatteryStockItem : 'STBattery.png',
-
-                  'Sword' : 'sword.png',
-                  'Ax/Mace/Hammer' : 'ax.png',
-                  'Pole Weapon' : 'poleweapons.png',
-                  #'Unusual Weapon',
-                  'Drawn Bow' : 'bow.png',
-                  'Cross Bow' : 'crossbow.png',
-
-                  HealingPotion : 'potionblue.png',
-                  WeaponPoison : 'potionteal.png',
-                  Grenade : 'potionred.png',
-                  AttributePotion : 'potionyellow.png',
-                  AbilityPotion : 'potionpurple.png',
-                  SpecialPotion : 'potiongrey.png',
-                 }
+    iconlookup = icons.itemicons
 
     # Columns:
     col_icon = 0
@@ -101,31 +72,7 @@ class ItemTree (QtGui.QTreeWidgetItem):
         self.stockitem = isinstance(item, _StockItem)  # catch Changling subs
 
         # Display Icon
-        cls = type(item)
-        if cls in self.iconlookup:
-            filename = self.iconlookup[cls]
-            if cls == ArmorStockItem and item.type in item.armortypes:
-                filename = 'helmet.png'
-            elif cls == PotionStockItem and item.cls in self.iconlookup:
-                filename = self.iconlookup[item.cls]
-            filename = 'icons/' + filename
-            if 'style' in dir(item) and item.style in self.iconlookup:  # Weapon
-                filename = 'icons/' + self.iconlookup[item.style]
-            if os.path.isfile(filename):
-                self.setIcon(self.col_icon, QtGui.QIcon(filename))
-
-            if 'itemtype' in dir(item):
-                self.setToolTip(self.col_icon, item.itemtype)
-            if cls == ArmorStockItem and item.type in item.shieldtypes:
-                self.setToolTip(self.col_icon, 'Shield')
-            if cls == PotionStockItem:
-                tooltip = str(item.cls)      # "<'something.HealingPotion'>"
-                i1 = tooltip.rfind('.')
-                i2 = tooltip.find("'", i1)
-                tooltip = tooltip[i1+1:i2]   # e.g. 'HealingPotion'
-                self.setToolTip(self.col_icon, tooltip)
-            if cls == WeaponStockItem:
-                self.setToolTip(self.col_icon, item.style)
+        self._seticon(item)
 
         # Name & FMV
         name = item.short() if self.stockitem else str(item)
@@ -151,12 +98,12 @@ class ItemTree (QtGui.QTreeWidgetItem):
 
         # Store & Town
         if showloc:
-            if 'store' in dir(item):
+            if getattr(item, 'store', None) is not None:
                 self.setText(self.col_store, str(item.store))
                 self.setToolTip(self.col_store, str(item.store.description))
-            if 'town' in dir(item):
+            if getattr(item, 'town', None) is not None:
                 self.setText(self.col_town, str(item.town))
-                if 'description' in dir(item.town):
+                if hasattr(item.town, 'description'):
                     self.setToolTip(self.col_town, str(item.town.description))
 
         # Column Widths & Headers
@@ -178,13 +125,22 @@ class ItemTree (QtGui.QTreeWidgetItem):
             return
 
         # Show abilities
-        if 'abilities' in dir(item) and len(item.abilities) > 1:
+        if capabilities(item).abilities and len(item.abilities) > 1:
             try:
                 item.abilities.sort(key=attrgetter('IIQ'), reverse=True)
             except AttributeError: pass
             for ability in item.abilities:
                 a = AbilityTree(self, ability)
 
+    def _seticon(self, item):
+        """Set the icon and its tooltip, from the shared icon cache."""
+        icon = icons.itemicon(item)
+        if icon is not None:
+            self.setIcon(self.col_icon, icon)
+        tooltip = icons.itemtooltip(item)
+        if tooltip is not None:
+            self.setToolTip(self.col_icon, tooltip)
+
 
 class HealingPotionTree (ItemTree):
 
@@ -194,8 +150,9 @@ class HealingPotionTree (ItemTree):
 
         # Set icon
         if HealingPotion in self.iconlookup:  # inherited from above
-            filename = 'icons/' + self.iconlookup[HealingPotion]
-            self.setIcon(self.col_icon, QtGui.QIcon(filename))
+            icon = icons.icon(self.iconlookup[HealingPotion])
+            if icon is not None:
+                self.setIcon(self.col_icon, icon)
             self.setToolTip(self.col_icon, 'HealingPotion')
 
         # Set name/price
@@ -224,16 +181,7 @@ class HealingPotionTree (ItemTree):
 
 class StoreTree (QtGui.QTreeWidgetItem):
 
-    iconlookup = {store.GeneralStore : 'general.png',
-                  store.AnimalStore : 'animal.png',
-                  store.BookStore : 'book.png',
-                  store.PotionStore : 'potion.png',
-                  store.PhysicalWeaponStore : 'weapon.png',
-                  store.WeaponStore : 'rod.png',
-                  store.ArmorStore : 'armorstore.png',
-                  store.MagicStore : 'magic.png',
-                  store.GemStore : 'gem.png',
-                 }
+    iconlookup = icons.storeicons
 
     # Columns:
     col_icon = 0
@@ -249,9 +197,9 @@ class StoreTree (QtGui.QTreeWidgetItem):
 
         cls = type(store)
         if cls in self.iconlookup:
-            filename = 'icons/' + self.iconlookup[cls]
-            if os.path.isfile(filename):
-                self.setIcon(self.col_icon, QtGui.QIcon(filename))
+            icon = icons.storeicon(store)
+            if icon is not None:
+                self.setIcon(self.col_icon, icon)
             self.setToolTip(self.col_icon, cls.__doc__)
 
         self.setText(self.col_name, str(store))
@@ -275,18 +223,17 @@ class TownTree (QtGui.QTreeWidgetItem):
     col_size = 2
     col_stores = 3
 
-    def __init__(self, parent, town):
+    def __init__(self, parent, entry, index):
+        """Display a town from its index entry; stores are shown on expand."""
         QtGui.QTreeWidgetItem.__init__(self, parent)
-        self.town = town
+        self.entry = entry
+        self.index = index
 
-        self.setText(self.col_name, str(town.name))
-        if 'description' in dir(town):
-            self.setToolTip(self.col_name, town.description)
-        self.setText(self.col_size, str(town.size))
-        self.setText(self.col_stores, str(len(town.stores)))
-        for store in town.stores:
-            s = StoreTree(self, store, showitems=False)
-            s.town = town
+        self.setText(self.col_name, str(entry.name))
+        self.setToolTip(self.col_name, '%s items for sale' % entry.items)
+        self.setText(self.col_size, str(entry.size))
+        self.setText(self.col_stores, str(entry.stores))
+        self.setChildIndicatorPolicy(QtGui.QTreeWidgetItem.ShowIndicator)
 
         # Column Headers & Widths
         self.treeWidget().setHeaderLabels(('', 'Name', 'Size', '# Stores'))
@@ -297,6 +244,20 @@ class TownTree (QtGui.QTreeWidgetItem):
         self.setTextAlignment(self.col_size, QtCore.Qt.AlignCenter)
         self.setTextAlignment(self.col_stores, QtCore.Qt.AlignCenter)
 
+    @property
+    def town(self):
+        """The full Town, loaded from disk on first use."""
+        return self.index.load(self.entry)
+
+    def populate(self):
+        """Add a StoreTree for each store, if not already shown."""
+        if self.childCount() > 0:
+            return
+        town = self.town
+        for store in town.stores:
+            s = StoreTree(self, store, showitems=False)
+            s.town = town
+
     def rename(self, name):
         self.setText(self.col_name, name)
 
@@ -1,9 +1,13 @@
+import hashlib
+import heapq
 import random
 import math
 import re
 
 from elvenfire import bonus25
 from storemanager import StoreMgrError
+from storemanager.stockitems import abilitypool
+from storemanager.stockitems.potion import ishealing
 
 
 class StoreError (StoreMgrError):
@@ -14,6 +18,153 @@ class TownError (StoreMgrError):
     pass
 
 
+def derive(seed, *key):
+    """Return a 64-bit seed derived from seed and a stable key.
+
+    The result depends only on its arguments, e.g. derive(seed, 'store', 3)
+    is the same in every process and on every run.
+
+    """
+    key = ':'.join(str(k) for k in (seed,) + key)
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+class RandomStream (random.Random):
+
+    """Seeded random stream, used in place of the global random module.
+
+    The elvenfire artifacts and the store code draw their numbers from the
+    global random module. Within a "with stream:" block, the global module
+    is switched to this stream, and switched back afterwards, so all random
+    choices made within the block depend only on the stream's seed.
+
+    Streams are not thread-safe: use one thread per process.
+
+    """
+
+    def __init__(self, seed):
+        random.Random.__init__(self, seed)
+        self._saved = []
+
+    def __enter__(self):
+        self._saved.append(random.getstate())
+        random.setstate(self.getstate())
+        return self
+
+    def __exit__(self, *exc):
+        self.setstate(random.getstate())
+        random.setstate(self._saved.pop())
+
+
+def roll(die, n):
+    """Return a list of n rolls of a die with the given number of sides."""
+    return random.choices(range(1, die + 1), k=n)
+
+
+def construct(classes):
+    """Return a new instance of each class in classes, in the same order.
+
+    Instances are created class by class, rather than in the given order.
+
+    """
+    items = [None] * len(classes)
+    groups = {}
+    for i, cls in enumerate(classes):
+        groups.setdefault(cls, []).append(i)
+    for cls, positions in groups.items():
+        for i in positions:
+            items[i] = cls()
+    return items
+
+
+class Inventory:
+
+    """Items in stock, in display order, keyed by item id.
+
+    Each item is given a stable id (item.id) when first stocked, derived
+    from the seed given here, so membership, removal and lookup by id take
+    constant time. Items can still be reached by position (inventory[3],
+    inventory[:5]) and sorted or shuffled like a list, but positional
+    access copies the items, so it takes linear time.
+
+    Items stocked share their abilities through the AbilityPool.
+
+    """
+
+    def __init__(self, seed, items=()):
+        self.seed = seed
+        self.issued = 0
+        self._items = {}
+        for item in items:
+            self.append(item)
+
+    def _newid(self):
+        self.issued += 1
+        return derive(self.seed, 'item', self.issued)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __contains__(self, item):
+        return self._items.get(getattr(item, 'id', None)) is item
+
+    def __getitem__(self, index):
+        return list(self._items.values())[index]
+
+    def get(self, id):
+        """Return the item with the given id, or None."""
+        return self._items.get(id)
+
+    def index(self, item):
+        """Return the position of item."""
+        return list(self._items.values()).index(item)
+
+    def append(self, item):
+        """Add item at the end, with a new id if its id is None or taken."""
+        if item in self:
+            raise StoreError('Item "%s" is already in stock!' % item)
+        while item.id is None or item.id in self._items:
+            item.id = self._newid()  # issued may lag behind replayed ids
+        abilitypool.internitem(item)
+        self._items[item.id] = item
+
+    def remove(self, item):
+        """Remove item; raise StoreError if it is not in stock."""
+        if item not in self:
+            raise StoreError('Item "%s" is not in stock!' % item)
+        del self._items[item.id]
+
+    def cheapest(self, k):
+        """Return the k items with the lowest markups, lowest first.
+
+        Items with equal markups are taken in inventory order. The heap is
+        built in linear time, so this takes O(n + k log n).
+
+        """
+        heap = [(item.markup, i, item) for i, item in enumerate(self)]
+        heapq.heapify(heap)
+        return [heapq.heappop(heap)[2] for i in range(min(k, len(heap)))]
+
+    def _reorder(self, items):
+        self._items = {item.id: item for item in items}
+
+    def arrange(self, ids):
+        """Put the items in the order of ids, the ids of all of them."""
+        self._reorder([self._items[id] for id in ids])
+
+    def sort(self, key=None, reverse=False):
+        self._reorder(sorted(self._items.values(), key=key, reverse=reverse))
+
+    def shuffle(self):
+        items = list(self._items.values())
+        random.shuffle(items)
+        self._reorder(items)
+
+
 class _Store:
 
     """Abstract class: store.
@@ -21,42 +172,67 @@ class _Store:
     Attributes:
       name          -- name of store
       description   -- brief description of the store and/or its usual contents
-      inventory     -- list of items in stock
+      inventory     -- Inventory of items in stock
       healingpotion -- points of healing potion in stock
       healingmarkup -- this week's markup on healing potion (95-120)
       numdice       -- number of dice to roll at each restock
       diesize       -- size of each die to roll at restock
+      seed          -- seed of the store's random streams (see stream())
+      updates       -- number of updates so far
+      diverted      -- number of healing potions generated into .healingpotion
+
+    All random choices are made within the store's own RandomStream: one
+    for initial stock, and one for each update. A store created with a
+    given seed therefore stocks and updates the same way every time, no
+    matter which other stores are generated alongside it, or in which
+    process.
 
     To implement, override the following:
       randomname()  -- (optional) used to generate a name when none is given
-      randomitem()  -- return a random StockItem of your desired type
+      itemclasses(n) -- return a list of n random StockItem classes of your
+                        desired types (or override randomitem() instead)
       defaultdesc() -- return a string describing the contents of the store
                        note that the user may override this description
 
     (Optional):
+      randomitem()    -- return a random StockItem of your desired type
       randomdice()    -- determine correct die roll based on .townsize
       sortinventory() -- sort inventory in any order desired for display
 
     Public Methods:
-      Store(name, size) -- initialize the store and generate starting inventory
+      Store(name, size, desc, seed)
+                        -- initialize the store and generate starting inventory
       .purchase(item)   -- remove selected item from stock
       .update()         -- update available stock, including markdowns
-      .getitems()       -- return list of available items
+      .advance(weeks)   -- update weeks times, keeping only commissions due
+      .getitems()       -- return the Inventory of available items
 
     """
 
+    seed = None
+    updates = 0
+    diverted = 0
+    maxbatches = 50     # of random items per _newitems() call
+
     ## Private Functions
 
-    def __init__(self, name, size, desc=None):
+    def __init__(self, name, size, desc=None, seed=None):
 
         """Determine initial attributes and inventory.
 
         name -- desired name of store, or None to generate randomly
         size -- either die rolls ('3d6') or a town size (integer)
         desc -- (optional) brief description of store
+        seed -- (optional) seed for the store's random streams
 
         """
 
+        self.seed = seed
+        with self.stream('init'):
+            self._init(name, size, desc)
+
+    def _init(self, name, size, desc):
+        """Initialize the store, within its 'init' stream."""
         # Determine name & description
         self.name = name
         if self.name is None:
@@ -76,24 +252,52 @@ class _Store:
             self.randomdice()
 
         # Generate starting inventory
-        self.inventory = []
+        self.inventory = Inventory(self.seed)
         self.healingpotion = 0
         self._sethealingmarkup()
-        inventorysize = self._storesize()
-        for i in range(inventorysize):
-            self._newitem()
+        self._newitems(self._storesize())
+
+    def stream(self, *key):
+        """Return the RandomStream of this store for key."""
+        if self.seed is None:
+            self.seed = random.getrandbits(64)
+        return RandomStream(derive(self.seed, *key))
+
+    def __setstate__(self, state):
+        """Restore a pickled store; older stores kept their stock in a list."""
+        self.__dict__.update(state)
+        if isinstance(self.inventory, list):
+            if self.seed is None:
+                self.seed = random.getrandbits(64)
+            self.inventory = Inventory(self.seed, self.inventory)
+
+    def _nextupdate(self):
+        """Return the RandomStream for the next update."""
+        self.updates += 1
+        return self.stream('update', self.updates)
 
     def _storesize(self):
         """Roll the store dice."""
         return sum(random.randint(1, self.diesize) for i in range(self.numdice))
 
-    def _newitem(self):
-        """Add a random item to stock, filtering out healing potions."""
-        item = self.randomitem()
-        if "Healing Potion" in str(item):
-            self.healingpotion += item.doses
-            return self._newitem()
-        self.inventory.append(item)
+    def _newitems(self, n):
+        """Add n random items to stock, filtering out healing potions.
+
+        Healing potions are added to .healingpotion instead, and replaced.
+        At most maxbatches batches are generated, so a store that only ever
+        generates healing potions ends up short rather than looping forever.
+
+        """
+        for batch in range(self.maxbatches):
+            if n <= 0:
+                return
+            for item in self.randomitems(n):
+                if ishealing(item):
+                    self.healingpotion += item.doses
+                    self.diverted += 1
+                else:
+                    self.inventory.append(item)
+                    n -= 1
 
     def _sethealingmarkup(self):
         self.healingmarkup = random.randint(95, 120)
@@ -118,48 +322,87 @@ class _Store:
         self.numdice = self.townsize
         self.diesize = 6
 
+    def itemclasses(self, n):
+        """Return a list of n random item classes for inventory."""
+        return None
+
     def randomitem(self):
         """Return an appropriate random item for inventory."""
-        raise NotImplementedError()
+        classes = self.itemclasses(1)
+        if classes is None:
+            raise NotImplementedError()
+        return classes[0]()
+
+    def randomitems(self, n):
+        """Return a list of n appropriate random items for inventory.
+
+        The dice for all n items are rolled at once by itemclasses(), and
+        the items of each class are created together. Stores overriding
+        only randomitem() get n calls to it instead.
+
+        """
+        classes = self.itemclasses(n)
+        if classes is None:
+            return [self.randomitem() for i in range(n)]
+        return construct(classes)
 
     def sortinventory(self):
         """Sort inventory in the correct order for display."""
-        random.shuffle(self.inventory)
+        self.inventory.shuffle()
 
     ## Public Functions
 
     def getitems(self):
-        """Return list of current items for sale."""
+        """Return the Inventory of current items for sale."""
         return self.inventory
 
     def purchase(self, item):
         """Remove item from the store's inventory."""
-        if not item in self.inventory:
-            if "Healing Potion" in str(item):
-                self.healingpotion -= item.doses
-            else:
-                raise StoreException('Item "%s" is not in inventory of %s!' %
-                                     (item, self.name))
+        if ishealing(item):
+            self.healingpotion -= item.doses
+        elif item not in self.inventory:
+            raise StoreError('Item "%s" is not in inventory of %s!' %
+                             (item, self.name))
         else:
             self.inventory.remove(item)
 
     def additem(self, item):
         """Add item to store's inventory."""
-        if "Healing Potion" in str(item):
+        if ishealing(item):
             self.healingpotion += item.doses
         else:
             self.inventory.append(item)
 
     def update(self):
 
-        """Update store, refreshing inventory lists and reducing all markups."""
+        """Update store, refreshing inventory lists and reducing all markups.
 
-        # Reduce all markups; re-sort
+        Returns the items removed from stock, e.g. to pay out commissions.
+
+        """
+
+        with self._nextupdate():
+            return self._update()
+
+    def advance(self, weeks):
+        """Update the store weeks times; return removed items with commissions.
+
+        Each week is the same as a call to update(), but removed items
+        without a commission are not kept.
+
+        """
+        commissions = []
+        for week in range(weeks):
+            commissions += [item for item in self.update() if item.commission]
+        return commissions
+
+    def _update(self):
+        """Update the store, within its stream for this update."""
+        # Reduce all markups
         for item in self.inventory:
             item.reduce_markup()
-        self.inventory.sort()
 
-        # Remove roll/8 items (potion 20% of the time)
+        # Remove the roll/8 cheapest items (potion 20% of the time)
         removedlist = []
         removal = math.ceil(self._storesize() / 8)
         if (self.healingpotion > 0 and random.randint(1, 5) == 1):
@@ -167,14 +410,14 @@ class _Store:
             self.healingpotion -= min(self.healingpotion, potion)
             removal -= 1
         if removal > 0:
-            self.inventory = self.inventory[removal:]
-            removedlist = self.inventory[:removal]
+            removedlist = self.inventory.cheapest(removal)
+            for item in removedlist:
+                self.inventory.remove(item)
 
         # Bring store size back up to new roll
         newsize = self._storesize()
         if newsize > len(self.inventory):
-            for i in range(newsize - len(self.inventory)):
-                self._newitem()
+            self._newitems(newsize - len(self.inventory))
 
         # Sort appropriately for sale
         self.sortinventory()
@@ -186,16 +429,19 @@ class _Store:
 
     def readable(self):
         """Return store contents, in human-readable format."""
-        val = "\n\n********************************************************\n"
-        val += ' %s (%s items)\n' % (self.name, len(self.inventory))
-        val += '********************************************************\n\n'
+        return ''.join(self.iterreadable())
+
+    def iterreadable(self):
+        """Yield readable() a piece at a time, e.g. to write to a file."""
+        yield "\n\n********************************************************\n"
+        yield ' %s (%s items)\n' % (self.name, len(self.inventory))
+        yield '********************************************************\n\n'
         if self.healingpotion > 0:
             string = 'points' if self.healingpotion > 1 else 'point'
             string = "%s %s of healing potion" % (self.healingpotion, string)
-            val += "%-50s FMV: $50/point\n\n" % string
+            yield "%-50s FMV: $50/point\n\n" % string
         for item in self.inventory:
-            val += item.readable() + '\n'
-        return val
+            yield item.readable() + '\n'
 
     def __str__(self):
         """Return brief name of store, with number of available items."""
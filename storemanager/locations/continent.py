@@ -0,0 +1,322 @@
+import concurrent.futures
+import multiprocessing
+import random
+import time
+import shutil
+import math
+import os
+
+from storemanager.locations import RandomStream, derive
+from storemanager.locations.town import Town
+from storemanager.storage.index import TownEntry
+from storemanager.storage.sqlite import ContinentDB
+
+
+def _split(jobs, workers):
+    """Split a list of jobs into roughly four shards per worker."""
+    size = max(1, math.ceil(len(jobs) / (workers * 4)))
+    return [jobs[i:i+size] for i in range(0, len(jobs), size)]
+
+
+def _database(index):
+    """Return the database file of a ContinentDB index, or None."""
+    if isinstance(index, ContinentDB):
+        return index.filename
+    return None
+
+
+def _generate_shard(shard, database=None):
+    """Worker: generate and save each (name, size, seed) town in shard.
+
+    Returns a list of TownEntries, one per town. The continent index is left
+    for the parent process to update. If database is given, the towns are
+    saved to that ContinentDB instead of to town files.
+
+    """
+    results = []
+    db = None if database is None else ContinentDB(database)
+    for name, size, seed in shard:
+        town = Town(name, size, seed)
+        if db is not None:
+            results.append(db.save(town))
+            continue
+        checksum = town.write(full=True)
+        results.append(TownEntry(town, town.filename(), checksum))
+    return results
+
+
+def _update_shard(shard, weeks=1, database=None):
+    """Worker: advance and save each town filename in shard.
+
+    Returns a list of (TownEntry, commissions due) pairs, one per town. The
+    continent index is left for the parent process to update. If database
+    is given, the towns are loaded from and saved to that ContinentDB, and
+    each filename is a town name.
+
+    """
+    results = []
+    db = None if database is None else ContinentDB(database)
+    for filename in shard:
+        if db is not None:
+            town = db.town(filename)
+            commissions = town.advance(weeks)
+            results.append((db.save(town), commissions))
+            continue
+        town = Town.load(filename)
+        commissions = town.advance(weeks)
+        checksum = town.write(full=True)
+        results.append((TownEntry(town, filename, checksum), commissions))
+    return results
+
+
+def _print_shard(shard, partname, database=None):
+    """Worker: write the readable listing of each town in shard to partname.
+
+    shard is a list of town filenames (or names, if database is given).
+    Returns the number of towns printed.
+
+    """
+    db = None if database is None else ContinentDB(database)
+    file = open(partname, 'w')
+    try:
+        for filename in shard:
+            if db is not None:
+                town = db.town(filename)
+            else:
+                town = Town.load(filename)
+            town.printto(file)
+    finally:
+        file.close()
+    return len(shard)
+
+
+class ParallelUpdate:
+
+    """Update many saved towns at once, sharded across worker processes.
+
+    Each town is loaded, advanced by the given number of weeks (see
+    Town.advance), and saved once entirely within a worker. Every store
+    updates within its own random stream, derived from its seed and its
+    number of updates (see _Store.update), so a town advances the same way
+    whichever worker it is sharded to. The removed
+    items with commissions due in every town are merged and returned to
+    the caller, e.g. for CommissionWindow.
+
+    Attributes:
+      index   -- ContinentIndex of the towns to update
+      workers -- number of worker processes (default: number of CPUs)
+      weeks   -- number of weeks to advance each town by (default: 1)
+      removed -- removed items with commissions due so far, across all towns
+      elapsed -- seconds taken so far
+
+    Usage:
+      update = ParallelUpdate(index)
+      for done, total in update.run():
+          ...  # report progress; called at least every poll seconds
+      CommissionWindow(parent, update.removed)
+
+    """
+
+    def __init__(self, index, workers=None, weeks=1):
+        self.index = index
+        self.workers = workers
+        if self.workers is None:
+            self.workers = multiprocessing.cpu_count()
+        self.weeks = weeks
+        self.removed = []
+        self.elapsed = 0
+
+    def _shards(self):
+        """Split the towns into roughly four shards per worker."""
+        return _split([e.filename for e in self.index], self.workers)
+
+    def run(self, poll=0.1):
+        """Update all towns, yielding (towns done, total towns) as they finish.
+
+        Progress is also yielded every poll seconds while waiting, so a GUI
+        can process its events between steps. When the generator finishes,
+        the continent index and any cached towns have been brought up to
+        date.
+
+        """
+        start = time.time()
+        shards = self._shards()
+        total = sum(len(s) for s in shards)
+        done = 0
+        entries = []
+        yield (done, total)
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+            pending = set(pool.submit(_update_shard, s, self.weeks,
+                                      _database(self.index))
+                          for s in shards)
+            while pending:
+                finished, pending = concurrent.futures.wait(pending, poll)
+                for future in finished:
+                    for entry, commissions in future.result():
+                        entries.append(entry)
+                        self.removed += commissions
+                        done += 1
+                self.elapsed = time.time() - start
+                yield (done, total)
+        self.index.update_entries(entries)
+        self.index.reload()
+        self.elapsed = time.time() - start
+
+
+class ParallelGenerate:
+
+    """Generate many new towns at once, across worker processes.
+
+    The name, size, and seed of every town are chosen up front from the
+    continent seed, so the towns generated depend only on the seed (and on
+    the names already taken), not on the number of workers. Each town is
+    then generated and written (atomically; see Journal.compact) within a
+    worker, and the continent index is updated once at the end.
+
+    Attributes:
+      index   -- ContinentIndex to add the towns to
+      count   -- number of towns to generate
+      sizes   -- list of (size, weight) pairs to choose town sizes from, or
+                 None for the usual distribution (see Town.randomsize)
+      seed    -- continent seed; random if not given
+      workers -- number of worker processes (default: number of CPUs)
+      towns   -- list of (name, size, seed) of the towns to generate
+      items   -- number of items for sale in the towns generated so far
+      elapsed -- seconds taken so far
+
+    Usage:
+      generate = ParallelGenerate(index, 1000, [(2, 1), (3, 1)])
+      for done, total in generate.run():
+          ...  # report progress; called at least every poll seconds
+
+    """
+
+    def __init__(self, index, count, sizes=None, seed=None, workers=None):
+        self.index = index
+        self.count = count
+        self.sizes = sizes
+        self.seed = seed
+        if self.seed is None:
+            self.seed = random.getrandbits(64)
+        self.workers = workers
+        if self.workers is None:
+            self.workers = multiprocessing.cpu_count()
+        self.towns = []
+        self.items = 0
+        self.elapsed = 0
+
+    def _plan(self):
+        """Choose the name, size, and seed of each town."""
+        namer = Town.__new__(Town)  # only its naming methods are used
+        taken = set(entry.name for entry in self.index)
+        self.towns = []
+        with RandomStream(derive(self.seed, 'continent')):
+            for i in range(self.count):
+                name = namer.randomname_nodupes(taken)
+                taken.add(name)
+                if self.sizes is None:
+                    size = namer.randomsize()
+                else:
+                    sizes, weights = zip(*self.sizes)
+                    size = random.choices(sizes, weights)[0]
+                self.towns.append((name, size, derive(self.seed, 'town', i)))
+
+    def run(self, poll=0.1):
+        """Generate all towns, yielding (towns done, total towns) as they finish.
+
+        Progress is also yielded every poll seconds while waiting. When the
+        generator finishes, the continent index includes the new towns.
+
+        """
+        start = time.time()
+        self._plan()
+        if not os.path.isdir(self.index.directory):
+            os.mkdir(self.index.directory)
+        shards = _split(self.towns, self.workers)
+        total = len(self.towns)
+        done = 0
+        entries = []
+        yield (done, total)
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+            pending = set(pool.submit(_generate_shard, s,
+                                      _database(self.index))
+                          for s in shards)
+            while pending:
+                finished, pending = concurrent.futures.wait(pending, poll)
+                for future in finished:
+                    for entry in future.result():
+                        entries.append(entry)
+                        self.items += entry.items
+                        done += 1
+                self.elapsed = time.time() - start
+                yield (done, total)
+        self.index.update_entries(entries)
+        self.elapsed = time.time() - start
+
+
+class ParallelPrint:
+
+    """Print the readable listing of every town to one file, in parallel.
+
+    The towns are split into shards in order, and each worker loads its
+    towns and writes their listings (see Town.printto) to a part file
+    beside the output file. The parts are then concatenated in order, so
+    the output is the same as printing each town in turn, and neither the
+    workers nor the parent hold more than one town's listing in memory.
+
+    Attributes:
+      index    -- ContinentIndex of the towns to print
+      filename -- file to write
+      workers  -- number of worker processes (default: number of CPUs)
+      elapsed  -- seconds taken so far
+
+    Usage:
+      printer = ParallelPrint(index, 'continent.txt')
+      for done, total in printer.run():
+          ...  # report progress; called at least every poll seconds
+
+    """
+
+    def __init__(self, index, filename, workers=None):
+        self.index = index
+        self.filename = filename
+        self.workers = workers
+        if self.workers is None:
+            self.workers = multiprocessing.cpu_count()
+        self.elapsed = 0
+
+    def run(self, poll=0.1):
+        """Print all towns, yielding (towns done, total towns) as they finish.
+
+        Progress is also yielded every poll seconds while waiting.
+
+        """
+        start = time.time()
+        shards = _split([entry.filename for entry in self.index],
+                        self.workers)
+        parts = ['%s.%s.part' % (self.filename, i) for i in range(len(shards))]
+        total = sum(len(s) for s in shards)
+        done = 0
+        yield (done, total)
+        try:
+            with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+                pending = set(pool.submit(_print_shard, shard, part,
+                                          _database(self.index))
+                              for shard, part in zip(shards, parts))
+                while pending:
+                    finished, pending = concurrent.futures.wait(pending, poll)
+                    for future in finished:
+                        done += future.result()
+                    self.elapsed = time.time() - start
+                    yield (done, total)
+            output = open(self.filename, 'w')
+            for part in parts:
+                file = open(part)
+                shutil.copyfileobj(file, output)
+                file.close()
+            output.close()
+        finally:
+            for part in parts:
+                if os.path.isfile(part):
+                    os.remove(part)
+        self.elapsed = time.time() - start
@@ -1,6 +1,6 @@
 import random
 
-from storemanager.locations import StoreError, _Store
+from storemanager.locations import StoreError, _Store, roll
 from storemanager.stockitems.special import *
 from storemanager.stockitems.combat import *
 from storemanager.stockitems.greater import *
@@ -32,35 +32,26 @@ class GeneralStore (_Store):
               "Blue Light Special: Lightning Rods!",
                              ))
 
-    def randomitem(self):
-        """Return an appropriate random artifact."""
-        d6 = random.randint(1, 6)   # 1-2 = possibly Greater
-        d20 = random.randint(1, 20) # 1-11 = Greater
-        d10 = random.randint(1, 10) # for Lesser
-        if d6 <= 2 and d20 <= 11:
-            if d20 == 1:
-                return SpecialArtifactStockItem()
-            elif d20 <= 3:
-                return STBatteryStockItem()
-            elif d20 <= 5:
-                return RingStockItem()
-            elif d20 <= 7:
-                return WeaponStockItem()
-            elif d20 <= 9:
-                return ArmorStockItem()
-            else:
-                return RodStockItem()
-        else:
-            if d10 == 1:
-                return AmuletStockItem()
-            elif d10 <= 3:
-                return BookStockItem()
-            elif d10 <= 5:
-                return GemStockItem()
-            elif d10 <= 7:
-                return ScrollStockItem()
-            else:
-                return PotionStockItem()
+    # Greater artifacts by d20 (1-11), and lesser artifacts by d10
+    greater = (None, SpecialArtifactStockItem,
+               STBatteryStockItem, STBatteryStockItem,
+               RingStockItem, RingStockItem,
+               WeaponStockItem, WeaponStockItem,
+               ArmorStockItem, ArmorStockItem,
+               RodStockItem, RodStockItem)
+    lesser = (None, AmuletStockItem,
+              BookStockItem, BookStockItem,
+              GemStockItem, GemStockItem,
+              ScrollStockItem, ScrollStockItem,
+              PotionStockItem, PotionStockItem, PotionStockItem)
+
+    def itemclasses(self, n):
+        """Return classes of n appropriate random artifacts."""
+        d6s = roll(6, n)    # 1-2 = possibly Greater
+        d20s = roll(20, n)  # 1-11 = Greater
+        d10s = roll(10, n)  # for Lesser
+        return [self.greater[d20] if d6 <= 2 and d20 <= 11 else self.lesser[d10]
+                for d6, d20, d10 in zip(d6s, d20s, d10s)]
 
 
 class AnimalStore (_Store):
@@ -77,8 +68,8 @@ class AnimalStore (_Store):
                               'For all your animal needs.',
                               'Where the pets go'))
 
-    def randomitem(self):
-        return TrainableAnimalStockItem()
+    def itemclasses(self, n):
+        return [TrainableAnimalStockItem] * n
 
 
 class BookStore (_Store):
@@ -106,13 +97,10 @@ class BookStore (_Store):
               "For literate eyes only",
                             ))
 
-    def randomitem(self):
-        """Return a random book or scroll."""
-        roll = random.randint(1, 6)
-        if roll <= 3:
-            return BookStockItem()
-        else:
-            return ScrollStockItem()
+    def itemclasses(self, n):
+        """Return classes of n random books or scrolls."""
+        return [BookStockItem if d6 <= 3 else ScrollStockItem
+                for d6 in roll(6, n)]
 
 
 class PotionStore (_Store):
@@ -140,9 +128,9 @@ class PotionStore (_Store):
               "Antidotes found here; don't mind the markup...",
                              ))
 
-    def randomitem(self):
-        """Return a random potion, poison, or grenade."""
-        return PotionStockItem()
+    def itemclasses(self, n):
+        """Return classes of n random potions, poisons, or grenades."""
+        return [PotionStockItem] * n
 
 
 class PhysicalWeaponStore (_Store):
@@ -169,9 +157,9 @@ class PhysicalWeaponStore (_Store):
               "Sheathe our weekly specials!",
                              ))
 
-    def randomitem(self):
-        """Return a random physical weapon."""
-        return WeaponStockItem()
+    def itemclasses(self, n):
+        """Return classes of n random physical weapons."""
+        return [WeaponStockItem] * n
 
 
 class WeaponStore (_Store):
@@ -197,13 +185,10 @@ class WeaponStore (_Store):
               "Hacking and slashing prices every Thursday!",
                              ))
 
-    def randomitem(self):
-        """Return a random weapon or rod."""
-        roll = random.randint(1, 6)
-        if roll <= 4:
-            return WeaponStockItem()
-        else:
-            return RodStockItem()
+    def itemclasses(self, n):
+        """Return classes of n random weapons or rods."""
+        return [WeaponStockItem if d6 <= 4 else RodStockItem
+                for d6 in roll(6, n)]
 
 
 class ArmorStore (_Store):
@@ -230,9 +215,9 @@ class ArmorStore (_Store):
               "Our shields will survive - even if you don't...",
                              ))
 
-    def randomitem(self):
-        """Return a random shield or suit of armor."""
-        return ArmorStockItem()
+    def itemclasses(self, n):
+        """Return classes of n random shields or suits of armor."""
+        return [ArmorStockItem] * n
 
 
 class MagicStore (_Store):
@@ -253,21 +238,15 @@ class MagicStore (_Store):
               "Artifacts: special, amulets, rods, rings, and gems.",
                             ))
 
-    def randomitem(self):
-        """Return an appropriate random artifact."""
-        roll = random.randint(1, 21)
-        if roll == 1:
-            return SpecialArtifactStockItem()
-        elif roll <= 3:
-            return STBatteryStockItem()
-        elif roll <= 6:
-            return AmuletStockItem()
-        elif roll <= 10:
-            return RodStockItem()
-        elif roll <= 15:
-            return RingStockItem()
-        else:
-            return GemStockItem()
+    # Artifacts by d21
+    artifacts = ((None, SpecialArtifactStockItem) +
+                 (STBatteryStockItem,) * 2 + (AmuletStockItem,) * 3 +
+                 (RodStockItem,) * 4 + (RingStockItem,) * 5 +
+                 (GemStockItem,) * 6)
+
+    def itemclasses(self, n):
+        """Return classes of n appropriate random artifacts."""
+        return [self.artifacts[d21] for d21 in roll(21, n)]
 
     def randomdice(self):
         """Determine store's die rolls based on townsize."""
@@ -291,10 +270,9 @@ class GemStore (_Store):
               "Magic stones of all sorts.",
                             ))
 
-    def randomitem(self):
-        """Return an appropriate random artifact."""
-        if random.randint(1, 20) == 1:
-            return STBatteryStockItem()
-        else:
-            return GemStockItem()
+    def itemclasses(self, n):
+        """Return classes of n appropriate random artifacts."""
+        return [STBatteryStockItem if d20 == 1 else GemStockItem
+                for d20 in roll(20, n)]
+
 
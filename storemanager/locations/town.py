@@ -3,8 +3,13 @@ import pickle
 import os
 
 from elvenfire import bonus5
-from storemanager.locations import TownError, _Store
+from storemanager.locations import TownError, _Store, RandomStream, derive
 from storemanager.locations.store import GeneralStore
+from storemanager.storage import binary
+from storemanager.storage.journal import Journal
+from storemanager.storage.index import ContinentIndex
+from storemanager.search.index import ItemIndex
+from storemanager.search.columns import ItemColumns
 
 
 class Town:
@@ -15,19 +20,51 @@ class Town:
       name   -- name of town
       size   -- size of town (integer 1..5)
       stores -- list of available Stores in town
+      seed   -- seed of the town's random stream
+
+    The town is generated within its own RandomStream, and each store it
+    picks is given a seed derived from the town seed (see _Store), so a
+    town generated from a given seed is always the same.
+
+    Changes made through the Town methods (purchase, additem, update, etc)
+    are journaled, so save() only writes what changed. After changing a
+    store or item directly, call save(full=True) instead.
+
+    The store holding each item is found through a map of item ids (see
+    holder()), kept up to date by the same methods, as is the number of
+    items for sale (see itemcount()). They also drop the columnar snapshot
+    kept for searching (see columns()).
+
+    If Town.database is set to a ContinentDB, save() and delete() use it
+    instead of town files (see storage.index.opencontinent). Otherwise,
+    they update the entry of the town in Town.continent, the open
+    ContinentIndex, which is opened on the towns directory if none is.
 
     """
 
-    def __init__(self, name=None, size=None):
+    seed = None
+    database = None
+    continent = None
+
+    def __init__(self, name=None, size=None, seed=None):
         """Initialize all attributes and generate stores."""
-        if name is None:
-            name = self.randomname_nodupes()
-        self.name = name
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed
         self.stores = []
-        if size is None:
-            size = self.randomsize()
-        self.size = size
-        self.pickstores()
+        self._journal = Journal()
+        self._itemindex = None
+        self._holders = None
+        self._columns = None
+        self._itemcount = None
+        with RandomStream(derive(self.seed, 'init')):
+            if name is None:
+                name = self.randomname_nodupes()
+            self.name = name
+            if size is None:
+                size = self.randomsize()
+            self.size = size
+            self.pickstores()
 
     def __random_town_name(self, count=1):
         """Return a random name, getting more creative with a higher count.
@@ -50,13 +87,14 @@ class Town:
                 newname += random.choice('abcdefghijklmnopqrstuvwxyz   ')
             words = newname.split()
             if not words:   # got all spaces!
-                return self.__random_store_name(store, count+1)
+                return self.__random_town_name(count+1)
             return ' '.join([w.capitalize() for w in words])
 
-    def randomname_nodupes(self):
+    def randomname_nodupes(self, taken=()):
+        """Return a random name not used by a saved town, nor in taken."""
         count = 1
         name = self.randomname()
-        while os.path.isfile(self.__filename(name)):
+        while name in taken or os.path.isfile(self.__filename(name)):
             name = self.__random_town_name(count)
             count += 1
         return name
@@ -83,15 +121,44 @@ class Town:
     def pickstores(self):
         """Populate self.stores with all available stores."""
         numspecialty = random.randint(self.size-1, self.size**2-self.size)
-        self.stores.append(GeneralStore(None, self.size))  # always 1
+        self.stores.append(GeneralStore(None, self.size,
+                                        seed=self.storeseed(0)))  # always 1
         stores = _Store.__subclasses__()
         for i in range(numspecialty):
             this = random.choice(stores)
-            self.stores.append(this(None, self.size))
+            self.stores.append(this(None, self.size, seed=self.storeseed(i+1)))
         self.__rename_duplicates()
 
+    def storeseed(self, number):
+        """Return the seed for the store picked in position number."""
+        return derive(self.seed, 'store', number)
+
     def addstore(self, store):
         self.stores.append(store)
+        self._columns = None
+        if self._itemcount is not None:
+            self._itemcount += len(store.getitems())
+        self._journal.record('addstore', store)
+        if self._itemindex is not None:
+            self._itemindex.addstore(store)
+        self._addholder(store)
+
+    def removestore(self, store):
+        """Permanently close store, removing it from the town."""
+        index = self.stores.index(store)
+        del self.stores[index]
+        self._journal.record('removestore', index)
+        self._columns = None
+        if self._itemcount is not None:
+            self._itemcount -= len(store.getitems())
+        if self._itemindex is not None:
+            self._itemindex.removestore(store)
+        self._removeholder(store)
+
+    def renamestore(self, store, name):
+        """Change the name of store."""
+        store.name = name
+        self._journal.record('rename', self.stores.index(store), name)
 
     def __random_store_name(self, store, count=1):
         """Return a random name, getting more creative with a higher count.
@@ -146,10 +213,90 @@ class Town:
     def update(self):
         """Update all stores in town, refreshing inventory and pricing."""
         removedlist = []
-        for store in self.stores:
+        self._columns = None
+        for index, store in enumerate(self.stores):
+            if self._itemindex is not None:
+                self._itemindex.removestore(store)
+            self._removeholder(store)
+            before = list(store.getitems())
             removedlist += store.update()
+            self._count(store, len(before))
+            self._journal.record('update', index,
+                                 *Journal.changes(store, before))
+            if self._itemindex is not None:
+                self._itemindex.addstore(store)
+            self._addholder(store)
         return removedlist
 
+    def advance(self, weeks):
+        """Update all stores weeks times over, as if by weekly update() calls.
+
+        The item index is rebuilt once afterwards rather than every week, and
+        only the final state of each store is journaled. Returns the removed
+        items with commissions due, across all weeks.
+
+        """
+        commissions = []
+        self._itemindex = None
+        self._holders = None
+        self._columns = None
+        for index, store in enumerate(self.stores):
+            before = list(store.getitems())
+            commissions += store.advance(weeks)
+            self._count(store, len(before))
+            self._journal.record('update', index,
+                                 *Journal.changes(store, before))
+        return commissions
+
+    def itemindex(self):
+        """Return the ItemIndex of all items for sale, building it if needed."""
+        if self._itemindex is None:
+            self._itemindex = ItemIndex(self.stores)
+        return self._itemindex
+
+    def holder(self, item):
+        """Return the store holding item, or None, building the map if needed."""
+        if self._holders is None:
+            self._holders = {}
+            for store in self.stores:
+                self._addholder(store)
+        store = self._holders.get(item.id)
+        if store is not None and item in store.inventory:
+            return store
+        return None
+
+    def _addholder(self, store):
+        if self._holders is not None:
+            for item in store.getitems():
+                self._holders[item.id] = store
+
+    def _removeholder(self, store):
+        if self._holders is not None:
+            for item in store.getitems():
+                self._holders.pop(item.id, None)
+
+    def columns(self):
+        """Return a columnar snapshot (ItemColumns) of all items for sale.
+
+        The snapshot is kept until the stock changes, so repeated searches
+        of the town reuse it, and the sorted columns it builds.
+
+        """
+        if self._columns is None:
+            self._columns = ItemColumns([self])
+        return self._columns
+
+    def itemcount(self):
+        """Return the number of items for sale, counting them if needed."""
+        if self._itemcount is None:
+            self._itemcount = sum(len(s.getitems()) for s in self.stores)
+        return self._itemcount
+
+    def _count(self, store, before):
+        """Add the change in the number of store's items since before."""
+        if self._itemcount is not None:
+            self._itemcount += len(store.getitems()) - before
+
     def getitems(self):
         """Return a list of all items available for sale within the town."""
         items = []
@@ -163,10 +310,14 @@ class Town:
                                             len(self.stores), s)
 
     def readable(self):
-        val = "\n\nTown: %s\n\n" % self.name
+        return ''.join(self.iterreadable())
+
+    def iterreadable(self):
+        """Yield readable() a piece at a time, e.g. to write to a file."""
+        yield "\n\nTown: %s\n\n" % self.name
         for store in self.stores:
-            val += store.readable() + "\n"
-        return val
+            yield from store.iterreadable()
+            yield "\n"
 
 
     def __filename(self, name=None):
@@ -175,30 +326,147 @@ class Town:
             name = self.name
         return os.path.join('towns', '%s.town' % name)
 
-    def save(self):
+    def filename(self):
+        """Return the file the town is saved in."""
+        return self.__filename()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_journal', None)
+        state.pop('_itemindex', None)
+        state.pop('_holders', None)
+        state.pop('_columns', None)
+        state.pop('_itemcount', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._journal = Journal()
+        self._itemindex = None
+        self._holders = None
+        self._columns = None
+        self._itemcount = None
+
+    def write(self, full=False):
+        """Write pending changes, or a full snapshot if full is True.
+
+        Unlike save(), the continent index is not updated. Returns the
+        CRC-32 of the snapshot if one was written, otherwise None.
+
+        """
         filename = self.__filename()
-        file = open(filename, 'wb')
-        pickle.dump(self, file)
-        file.close()
+        if full:
+            self._itemcount = None  # stores may have been changed directly
+        if (full or not os.path.isfile(filename) or
+                self._journal.needs_compaction()):
+            return self._journal.compact(filename, self)
+        self._journal.flush(filename, self)
+        return None
+
+    def save(self, full=False):
+        """Write pending changes and update the continent index."""
+        if Town.database is not None:
+            Town.database.write(self, full)
+            return
+        checksum = self.write(full)
+        filename = self.__filename()
+        self.__continent(filename).update(self, filename, checksum)
+
+    def __continent(self, filename):
+        """Return the ContinentIndex of the directory holding filename.
+
+        If it is not the open Town.continent, it is opened in its place, so
+        later saves reuse it.
+
+        """
+        directory = os.path.dirname(filename)
+        if (Town.continent is None or os.path.normpath(directory) !=
+                os.path.normpath(Town.continent.directory)):
+            Town.continent = ContinentIndex(directory)
+        return Town.continent
 
     def load(filename):
+        """Return the town saved in filename (as a snapshot and journal).
+
+        Snapshots written before the binary format are unpickled instead.
+
+        """
         file = open(str(filename), 'rb')
-        t = pickle.load(file)
+        if binary.isbinary(filename):
+            t = binary.load(file)
+        else:
+            t = pickle.load(file)
         file.close()
+        t._journal = Journal.replay(filename, t)
         return t
 
     def delete(self):
+        if Town.database is not None:
+            Town.database.remove(self.name)
+            return
         filename = self.__filename()
         os.remove(filename)
+        self._journal.remove(filename)
+        self.__continent(filename).remove(filename)
 
-    def purchase(self, item):
-        for store in self.stores:
-            if item in store.inventory:
-                return store.purchase(item)
-        raise TownError('Item "%s" cannot be found in any store of %s!' %
-                        (item, self.name))
+    def _locate(self, item, store=None):
+        """Return (store index, item id) of item within the town."""
+        if store is None or item not in store.inventory:
+            store = self.holder(item)
+        if store is None:
+            raise TownError('Item "%s" cannot be found in any store of %s!' %
+                            (item, self.name))
+        return (self.stores.index(store), item.id)
+
+    def purchase(self, item, store=None):
+        """Remove item from the store (or any store in town) selling it."""
+        s, i = self._locate(item, store)
+        self.stores[s].purchase(item)
+        self._journal.record('purchase', s, i)
+        self._columns = None
+        if self._itemcount is not None:
+            self._itemcount -= 1
+        if self._itemindex is not None:
+            self._itemindex.remove(item)
+        if self._holders is not None:
+            del self._holders[i]
+
+    def purchase_healingpotion(self, store, doses):
+        """Remove doses of healing potion from store's stock."""
+        store.healingpotion -= doses
+        self._journal.record('healing', self.stores.index(store),
+                             store.healingpotion)
+
+    def additem(self, store, item):
+        """Add item to the inventory of store."""
+        if any(s.inventory.get(item.id) not in (None, item)
+               for s in self.stores):
+            item.id = None  # taken by another item in town; get a new one
+        store.additem(item)
+        self._journal.record('additem', self.stores.index(store), item)
+        self._columns = None
+        if item in store.inventory:
+            if self._itemcount is not None:
+                self._itemcount += 1
+            if self._itemindex is not None:
+                self._itemindex.add(item, store)
+            if self._holders is not None:
+                self._holders[item.id] = store
+
+    def setmarkup(self, item, markup):
+        """Change the markup of an item for sale within the town."""
+        s, i = self._locate(item)
+        item.markup = markup
+        self._journal.record('markup', s, i, markup)
+        self._columns = None
+        if self._itemindex is not None:
+            self._itemindex.add(item, self.stores[s])
 
     def print(self, filename):
         file = open(filename, 'w')
-        file.write(self.readable())
+        self.printto(file)
         file.close()
+
+    def printto(self, file):
+        """Write readable() to an open file, without building it in memory."""
+        file.writelines(self.iterreadable())
@@ -21,6 +21,7 @@ class Class (_StockItem):
       
     """
 
+    provides = ('ability',)
     classtimes = (1, 2, 4, 8, 16)
     Monday, Tuesday, Wednesday, Thursday, Friday, AllDays = 0, 1, 2, 3, 4, 5
     Days = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "every day")
@@ -84,9 +85,9 @@ class University (_Store):
 
     """
 
-    def __init__(self, name, size, desc=None):
+    def __init__(self, name, size, desc=None, seed=None):
         """Extend _Store.__init__ to initialize course lists."""
-        _Store.__init__(self, name, size, desc)
+        _Store.__init__(self, name, size, desc, seed)
         self.activecourses = []
         self.update()
 
@@ -95,18 +96,17 @@ class University (_Store):
         s = 's' if numcourses > 1 else ''
         return '%s (%s course%s)' % (self.name, numcourses, s)
 
-    def readable(self):
-        """Return university catalog, in human-readable format."""
+    def iterreadable(self):
+        """Yield the university catalog, in human-readable format."""
         numcourses = sum([len(i) for i in self.courses])
-        val = "\n\n********************************************************\n"
-        val += ' %s (%s courses)\n' % (self.name, numcourses)
-        val += '********************************************************\n\n'
+        yield "\n\n********************************************************\n"
+        yield ' %s (%s courses)\n' % (self.name, numcourses)
+        yield '********************************************************\n\n'
         for day in range(5):
-            val += '\n%s:\n' % ['Monday', 'Tuesday', 'Wednesday',
-                                'Thursday', 'Friday'][day]
+            yield '\n%s:\n' % ['Monday', 'Tuesday', 'Wednesday',
+                               'Thursday', 'Friday'][day]
             for course in self.courses[day]:
-                val += '  ' + course.readable() + '\n'
-        return val
+                yield '  ' + course.readable() + '\n'
 
     def randomname(self):
         """Return a random name."""
@@ -153,9 +153,10 @@ class University (_Store):
 
     def update(self):
         """Generate a new week's classes."""
-        self.courses = [[] for i in range(5)]
-        for day in range(5):
-            self._updateday(day)
+        with self._nextupdate():
+            self.courses = [[] for i in range(5)]
+            for day in range(5):
+                self._updateday(day)
         return []
 
     def _updateday(self, day):
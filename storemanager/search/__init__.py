@@ -14,8 +14,18 @@ class _Criterion:
                      no need to call Criterion.__init__()
       match(item) -- returns boolean indicating whether the item matches
 
+    (Optional):
+      lookup(index) -- return the ids of candidate items from an ItemIndex
+      mask(columns) -- return the mask of matching rows of an ItemColumns
+      sql(db)       -- return an SQL condition selecting matching items
+      cost          -- relative cost of one match() call, for the Planner
+      selectivity   -- estimated fraction of items matching, for the Planner
+
     """
 
+    cost = 1
+    selectivity = 0.5
+
     def __init__(self):
         raise NotImplementedError()
 
@@ -23,11 +33,48 @@ class _Criterion:
         """Return boolean indicating whether item matches this criterion."""
         raise NotImplementedError()
 
+    def lookup(self, index):
+        """Return set of ids of items in index which may match, or None.
+
+        The result must include every matching item, but may include some
+        that do not match; search() checks each candidate with match().
+        None means the index cannot narrow the search.
+
+        """
+        return None
+
+    def mask(self, columns):
+        """Return the mask of rows of ItemColumns which match, or None.
+
+        columns may also be a MappedColumns, which has no items, only their
+        values and keys (see search.index.exactkeys). Unlike lookup(), the
+        mask must be exact. None means the criterion must be checked item
+        by item with match().
+
+        """
+        return None
+
+    def sql(self, db):
+        """Return (condition, parameters) selecting matches in db, or None.
+
+        db is a ContinentDB; the condition is an SQL expression over its
+        items table, built with its helpers (db.between(), db.haskey(),
+        etc). Like mask(), the condition must be exact. None means the
+        criterion must be checked item by item with match().
+
+        """
+        return None
+
     def filter(self, itemlist):
         """Return only matching items out of itemlist."""
         return [i for i in itemlist if self.match(i)]
 
     def search(self, loc):
         """Return matching items from specified Town/Store."""
+        if hasattr(loc, 'itemindex'):
+            index = loc.itemindex()
+            ids = self.lookup(index)
+            if ids is not None:
+                return self.filter(index.getitems(ids))
         return self.filter(loc.getitems())
 
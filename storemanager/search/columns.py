@@ -0,0 +1,242 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress
+
+from storemanager.stockitems import capabilities
+from storemanager.search.criteriaset import ANDCriteriaSet
+
+
+class ItemColumns:
+
+    """Columnar snapshot of the items for sale in one or more towns.
+
+    Each row is one item; each column is a typed array holding one value per
+    row. Criteria that support it (see _Criterion.mask) are evaluated over
+    whole columns at once, producing a mask: an int holding one byte per row,
+    1 if the row matches and 0 if not. Masks are combined with the bitwise
+    operators (& for AND, | for OR, invert() for NOT), so a criteria tree
+    over the whole continent costs a few passes over flat arrays rather
+    than a chain of method calls per item. between() and isin() look their
+    bounds up in a sorted copy of the column, made the first time the
+    column is searched, and only set the bytes of the rows found.
+
+    The snapshot is not kept up to date; build a new one after the towns
+    change.
+
+    Attributes:
+      items     -- list of the _StockItems, by row
+      stores    -- list of Stores; the store column holds indices into it
+      towns     -- list of Towns; the town column holds indices into it
+      types     -- list of item classes; the type column holds indices into it
+      value     -- array of fair market values
+      markup    -- array of markups
+      price     -- array of prices
+      type      -- array of type codes
+      charges   -- array of charges (NONE if the item has no charges)
+      abilities -- array of number of abilities (NONE if only a single one)
+      store     -- array of store codes
+      town      -- array of town codes
+
+    """
+
+    NONE = -1
+
+    def __init__(self, towns=()):
+        self.items = []
+        self.stores = []
+        self.towns = []
+        self.types = []
+        self._typecodes = {}
+        self.value = array('q')
+        self.markup = array('q')
+        self.price = array('q')
+        self.type = array('l')
+        self.charges = array('q')
+        self.abilities = array('q')
+        self.store = array('l')
+        self.town = array('l')
+        self._sortedcolumns = {}
+        self._rows = {}  # id(item) -> row, for ItemIndex lookups
+        for town in towns:
+            self.addtown(town)
+        self._full = self._mask(b'\x01' * len(self))
+
+    def __len__(self):
+        return len(self.items)
+
+    def _typecode(self, cls):
+        if cls not in self._typecodes:
+            self._typecodes[cls] = len(self.types)
+            self.types.append(cls)
+        return self._typecodes[cls]
+
+    def addtown(self, town):
+        """Append a row for every item for sale in town."""
+        t = len(self.towns)
+        self.towns.append(town)
+        self._sortedcolumns = {}
+        self._full = None
+        for store in town.stores:
+            s = len(self.stores)
+            self.stores.append(store)
+            for item in store.getitems():
+                caps = capabilities(item)
+                self._rows[id(item)] = len(self.items)
+                self.items.append(item)
+                self.value.append(item.value)
+                self.markup.append(item.markup)
+                self.price.append(item.price())
+                self.type.append(self._typecode(type(item)))
+                self.charges.append(item.charges if caps.charges
+                                    else self.NONE)
+                self.abilities.append(len(item.abilities) if caps.abilities
+                                      else self.NONE)
+                self.store.append(s)
+                self.town.append(t)
+
+    ## Masks
+
+    def _mask(self, flags):
+        """Return the mask for an iterable of one boolean per row."""
+        return int.from_bytes(bytes(flags), 'little')
+
+    def all(self):
+        """Return the mask matching every row, made once for all searches."""
+        if self._full is None:
+            self._full = self._mask(b'\x01' * len(self))
+        return self._full
+
+    def invert(self, mask):
+        """Return the mask matching every row not matched by mask."""
+        return mask ^ self.all()
+
+    def _sorted(self, column):
+        """Return (values, rows): column's values in order, and their rows."""
+        key = id(column)
+        if key not in self._sortedcolumns:
+            rows = sorted(range(len(column)), key=column.__getitem__)
+            self._sortedcolumns[key] = ([column[r] for r in rows], rows)
+        return self._sortedcolumns[key]
+
+    def _spans(self, rows, spans):
+        """Return the mask of rows[lo:hi] for each (lo, hi) in spans.
+
+        spans must be in order and not overlap. If they hold more than half
+        the rows, the rows between them are cleared from a full mask instead.
+
+        """
+        flags, flag = bytearray(len(self)), 1
+        if sum(hi - lo for lo, hi in spans) * 2 > len(self):
+            gaps, start = [], 0
+            for lo, hi in spans:
+                gaps.append((start, lo))
+                start = hi
+            gaps.append((start, len(self)))
+            flags, flag, spans = bytearray(b'\x01') * len(self), 0, gaps
+        for lo, hi in spans:
+            for row in rows[lo:hi]:
+                flags[row] = flag
+        return self._mask(flags)
+
+    def between(self, column, min=None, max=None):
+        """Return the mask of rows where min <= column <= max.
+
+        A bound of None is open. Note that NONE is less than any count.
+
+        """
+        if min is None and max is None:
+            return self.all()
+        values, rows = self._sorted(column)
+        lo = 0 if min is None else bisect_left(values, min)
+        hi = len(values) if max is None else bisect_right(values, max)
+        return self._spans(rows, [(lo, hi)] if lo < hi else [])
+
+    def isin(self, column, values):
+        """Return the mask of rows where column holds one of values."""
+        column, rows = self._sorted(column)
+        spans = [(bisect_left(column, v), bisect_right(column, v))
+                 for v in sorted(set(values))]
+        return self._spans(rows, [(lo, hi) for lo, hi in spans if lo < hi])
+
+    def haskey(self, kind, test):
+        """Return the mask of rows with a key (kind, a, b) where test(a, b).
+
+        Keys are those of search.index.exactkeys(). ItemColumns does not
+        keep them, so this returns None: with the items at hand, match()
+        is as quick.
+
+        """
+        return None
+
+    def text(self, find):
+        """Return the mask of rows for which find(searchtext) is true.
+
+        Like haskey(), this returns None for ItemColumns.
+
+        """
+        return None
+
+    def rows(self, mask):
+        """Return the list of rows matched by mask."""
+        return list(compress(range(len(self)), mask.to_bytes(len(self),
+                                                              'little')))
+
+    ## Searching
+
+    def chunks(self, criterion, size=100, index=None):
+        """Yield the rows of items matching criterion, size rows at a time.
+
+        If criterion cannot be evaluated as a mask, but is an AND set, the
+        children that can be are used to narrow the rows, and only those
+        rows are checked with match() against the others, one chunk at a
+        time. Given the ItemIndex of the same items (see Town.itemindex()),
+        the rows are narrowed further to the candidates the other criteria
+        look up in it (see _Criterion.lookup), before any match().
+
+        """
+        if isinstance(criterion, ANDCriteriaSet):
+            mask = self.all()
+            rest = []
+            for child in criterion.criteria:
+                found = child.mask(self)
+                if found is None:
+                    rest.append(child)
+                else:
+                    mask &= found
+        else:
+            mask = criterion.mask(self)
+            rest = [] if mask is not None else [criterion]
+        ids = None
+        if rest and index is not None:
+            ids = ANDCriteriaSet(rest).lookup(index)
+        if ids is not None:
+            candidates = sorted(self._rows[i] for i in ids if i in self._rows)
+            if mask is not None:
+                flags = mask.to_bytes(len(self), 'little')
+                candidates = [r for r in candidates if flags[r]]
+        elif mask is None:
+            candidates = range(len(self))
+        else:
+            candidates = self.rows(mask)
+        items = self.items
+        for start in range(0, len(candidates), size):
+            rows = candidates[start:start+size]
+            if rest:
+                rows = [r for r in rows
+                        if all(c.match(items[r]) for c in rest)]
+            yield list(rows)
+
+    def select(self, criterion):
+        """Return the rows of items matching criterion (see chunks())."""
+        rows = []
+        for chunk in self.chunks(criterion, max(len(self), 1)):
+            rows += chunk
+        return rows
+
+    def search(self, criterion):
+        """Return the items matching criterion."""
+        return [self.items[r] for r in self.select(criterion)]
+
+    def locate(self, row):
+        """Return (store, town) selling the item in row."""
+        return (self.stores[self.store[row]], self.towns[self.town[row]])
@@ -2,9 +2,23 @@
 from storemanager.search import _Criterion
 
 
-class ANDCriteriaSet (_Criterion):
+def _join(db, criteria, operator, empty):
+    """Return the SQL conditions of criteria joined by operator, or None."""
+    clauses, params = [], []
+    for criterion in criteria:
+        found = criterion.sql(db)
+        if found is None:
+            return None
+        clauses.append('(%s)' % found[0])
+        params.extend(found[1])
+    if not clauses:
+        return empty
+    return ((' %s ' % operator).join(clauses), params)
 
-    """Item matches if it matches ALL child criteria."""
+
+class _CriteriaSet (_Criterion):
+
+    """Abstract class: a criterion combining the child criteria in criteria."""
 
     def __init__(self, criteria):
         self.criteria = criteria
@@ -12,41 +26,94 @@ class ANDCriteriaSet (_Criterion):
     def addcriterion(self, criterion):
         self.criteria.append(criterion)
 
+
+class ANDCriteriaSet (_CriteriaSet):
+
+    """Item matches if it matches ALL child criteria."""
+
     def match(self, item):
         for criterion in self.criteria:
             if not criterion.match(item):
                 return False
         return True
 
+    def lookup(self, index):
+        """Intersect the candidates of all children that use the index."""
+        ids = None
+        for criterion in self.criteria:
+            found = criterion.lookup(index)
+            if found is None:
+                continue
+            ids = found if ids is None else ids & found
+        return ids
+
+    def mask(self, columns):
+        """Intersect the masks of all children, if all have one."""
+        mask = columns.all()
+        for criterion in self.criteria:
+            found = criterion.mask(columns)
+            if found is None:
+                return None
+            mask &= found
+        return mask
+
+    def sql(self, db):
+        """Join the conditions of all children with AND, if all have one."""
+        return _join(db, self.criteria, 'AND', db.all())
+
     def __str__(self):
         return 'AND Criteria Set'
 
 
-class ORCriteriaSet (_Criterion):
+class ORCriteriaSet (_CriteriaSet):
 
     """Item matches if it matches ANY child criteria."""
 
-    def __init__(self, criteria):
-        self.criteria = criteria
-
-    def addcriterion(self, criterion):
-        self.criteria.append(criterion)
-
     def match(self, item):
         for criterion in self.criteria:
             if criterion.match(item):
                 return True
         return False
 
+    def lookup(self, index):
+        """Unite the candidates of all children, if all use the index."""
+        ids = set()
+        for criterion in self.criteria:
+            found = criterion.lookup(index)
+            if found is None:
+                return None
+            ids |= found
+        return ids
+
+    def mask(self, columns):
+        """Unite the masks of all children, if all have one."""
+        mask = 0
+        for criterion in self.criteria:
+            found = criterion.mask(columns)
+            if found is None:
+                return None
+            mask |= found
+        return mask
+
+    def sql(self, db):
+        """Join the conditions of all children with OR, if all have one."""
+        return _join(db, self.criteria, 'OR', ('0', []))
+
     def __str__(self):
         return 'OR Criteria Set'
 
 
-class NOTCriteriaSet (_Criterion):
+class NOTCriteriaSet (_CriteriaSet):
     def __init__(self, criterion):
         self.criteria = [criterion,]
     def match(self, item):
         return not self.criteria[0].match(item)
+    def mask(self, columns):
+        found = self.criteria[0].mask(columns)
+        return None if found is None else columns.invert(found)
+    def sql(self, db):
+        found = self.criteria[0].sql(db)
+        return None if found is None else ('NOT (%s)' % found[0], found[1])
     def __str__(self):
         return 'NOT'
 
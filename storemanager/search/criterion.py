@@ -6,22 +6,97 @@ from elvenfire.artifacts.potion import Potion
 from elvenfire.abilities.charabilities import _CharacterAbility
 from elvenfire.abilities.charabilities import *
 from elvenfire.abilities.itemabilities import *
+from storemanager.stockitems import _StockItem, capabilities
 from storemanager.search import _Criterion
+from storemanager.search.index import pricebucket
 
 
 class TextCriterion (_Criterion):
 
-    """Items match if the specified text appears anywhere in the item name."""
+    """Items match if the specified text appears anywhere in the item name.
 
-    def __init__(self, text):
+    The text is a case-insensitive regular expression. Text without any
+    regular expression characters is matched as a plain substring. If
+    allwords is True, the text is split into words and items must contain
+    every word, in any order; text with no words at all matches every item.
+
+    """
+
+    cost = 20
+    selectivity = 0.1
+
+    metachars = set('.^$*+?{}[]\\|()')
+
+    allwords = False
+    _find = None
+    _literal = None
+
+    def __init__(self, text, allwords=False):
         """Define text to search for."""
         self.text = text
+        self.allwords = allwords
+
+    def _compile(self):
+        """Prepare the literal or compiled pattern used by match()."""
+        terms = self.text.split() if self.allwords else [self.text]
+        if not terms:
+            self._find = self._findall
+            return
+        literal = not any(c in self.metachars for c in self.text)
+        if literal and len(terms) == 1:
+            self._literal = self.text.casefold()
+            self._find = self._findliteral
+            return
+        if literal:
+            terms = [re.escape(t.casefold()) for t in terms]
+        if len(terms) > 1:  # all terms, in any order, in one pass
+            pattern = re.compile(''.join('(?=.*?%s)' % t for t in terms),
+                                 re.IGNORECASE | re.DOTALL)
+            self._find = pattern.match
+        else:
+            self._find = re.compile(terms[0], re.IGNORECASE).search
+
+    def _findliteral(self, text):
+        return self._literal in text
+
+    def _findall(self, text):
+        return True
 
     def match(self, item):
         """Return boolean indicating whether the text appears for this item."""
-        return re.search(self.text, str(item), re.IGNORECASE) is not None
+        if self._find is None:
+            self._compile()
+        if isinstance(item, _StockItem):
+            text = item.searchtext()
+        else:
+            text = str(item).casefold()
+        return bool(self._find(text))
+
+    def mask(self, columns):
+        if self._find is None:
+            self._compile()
+        return columns.text(self._find)
+
+    def sql(self, db):
+        terms = self.text.split() if self.allwords else [self.text]
+        if not terms:
+            return db.all()
+        if any(c in self.metachars for c in self.text):
+            found = [db.regexp(term) for term in terms]
+        else:
+            found = [db.contains(term) for term in terms]
+        return (' AND '.join(clause for clause, params in found),
+                [param for clause, params in found for param in params])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_find', None)
+        state.pop('_literal', None)
+        return state
 
     def __str__(self):
+        if self.allwords:
+            return 'Text contains all of: %s' % self.text
         return 'Text contains: %s' % self.text
 
 
@@ -29,6 +104,9 @@ class TypeCriterion (_Criterion):
 
     """Items match if they are of the specified type (class name)."""
 
+    cost = 1
+    selectivity = 0.15
+
     def __init__(self, type):
         """Define type to search for, as a class."""
         self.type = type
@@ -37,6 +115,17 @@ class TypeCriterion (_Criterion):
         """Return boolean indicating whether item is of the correct type."""
         return isinstance(item, self.type)
 
+    def lookup(self, index):
+        return index.get('type', self.type)
+
+    def mask(self, columns):
+        codes = [code for code, cls in enumerate(columns.types)
+                 if issubclass(cls, self.type)]
+        return columns.isin(columns.type, codes)
+
+    def sql(self, db):
+        return db.istype(self.type)
+
     def __str__(self):
         itemtype = str(self.type)   # <class 'Something.Weapon'>
         i1 = itemtype.rfind('.')
@@ -49,6 +138,9 @@ class AttributeCriterion (_Criterion):
 
     """Items which contain an AttributeAbility of the specified type."""
 
+    cost = 6
+    selectivity = 0.1
+
     def __init__(self, attr, minsize=None, maxsize=None):
         """Define attribute [and size] to search for ('ST', 'DX', etc)."""
         self.attr = attr
@@ -60,7 +152,7 @@ class AttributeCriterion (_Criterion):
         if not (isinstance(ability, AttributeAbility) or
                 isinstance(ability, AmuletAbility)):
             return False
-        if 'attr' not in dir(ability) or 'size' not in dir(ability):
+        if not (hasattr(ability, 'attr') and hasattr(ability, 'size')):
             return False
         if self.attr != ability.attr:
             return False
@@ -74,15 +166,40 @@ class AttributeCriterion (_Criterion):
 
     def match(self, item):
         """Return boolean indicating whether item has a matching AttrAbility."""
-        if 'ability' in dir(item):
+        caps = capabilities(item)
+        if caps.ability:
             if self._attrmatch(item.ability):
                 return True
-        if 'abilities' in dir(item):
+        if caps.abilities:
             for ability in item.abilities:
                 if self._attrmatch(ability):
                     return True
         return False
 
+    def lookup(self, index):
+        def test(attr, size):
+            return ((self.attr is None or self.attr == attr) and
+                    (self.minsize is None or self.minsize <= size) and
+                    (self.maxsize is None or self.maxsize >= size))
+        return index.where('attr', test)
+
+    def mask(self, columns):
+        def test(attr, size):
+            return (self.attr == attr and
+                    (self.minsize is None or self.minsize <= size) and
+                    (self.maxsize is None or self.maxsize >= size))
+        return columns.haskey('attr', test)
+
+    def sql(self, db):
+        clauses, params = ['k.a IS ?'], [self.attr]
+        if self.minsize is not None:
+            clauses.append('k.b >= ?')
+            params.append(self.minsize)
+        if self.maxsize is not None:
+            clauses.append('k.b <= ?')
+            params.append(self.maxsize)
+        return db.haskey('attr', ' AND '.join(clauses), params)
+
     def __str__(self):
         if self.attr is None:
             val = 'Any Attribute +'
@@ -107,6 +224,9 @@ class WeaponClassCriterion (_Criterion):
 
     """
 
+    cost = 4
+    selectivity = 0.05
+
     def __init__(self, style):
         """Define class to search for (e.g. 'Unusual Weapon')."""
         self.style = style
@@ -120,6 +240,9 @@ class WeaponClassCriterion (_Criterion):
                     self.match(item.secondaryweapon))
         return item.type in item.weaponlist(self.style)
 
+    def lookup(self, index):
+        return index.get('type', Weapon)
+
     def __str__(self):
         return 'Weapon style: %s' % self.style
 
@@ -128,6 +251,9 @@ class WeaponTypeCriterion (_Criterion):
 
     """Weapons of the exact type specified (e.g. 'Great Sword')."""
 
+    cost = 2
+    selectivity = 0.02
+
     def __init__(self, type):
         """Define type to search for (e.g. 'Great Sword')."""
         self.type = type
@@ -143,6 +269,21 @@ class WeaponTypeCriterion (_Criterion):
             return self.type in item.type
         return item.type == self.type
 
+    def lookup(self, index):
+        if self.type == 'Trident' or self.type == 'Net':
+            return index.where('weapontype', lambda t: self.type in t)
+        return index.get('weapontype', self.type)
+
+    def mask(self, columns):
+        if self.type == 'Trident' or self.type == 'Net':
+            return columns.haskey('weapontype', lambda t, b: self.type in t)
+        return columns.haskey('weapontype', lambda t, b: t == self.type)
+
+    def sql(self, db):
+        if self.type == 'Trident' or self.type == 'Net':
+            return db.haskey('weapontype', 'instr(k.a, ?) > 0', [self.type])
+        return db.haskey('weapontype', 'k.a = ?', [self.type])
+
     def __str__(self):
         return 'Weapon type: %s' % self.type
 
@@ -151,6 +292,9 @@ class ArmorTypeCriterion (_Criterion):
  
     """Armor/shields of the exact type specified (e.g. 'Small Shield')."""
 
+    cost = 1
+    selectivity = 0.03
+
     def __init__(self, type):
         """Define type to search for (e.g. 'Small Shield')."""
         self.type = type
@@ -161,6 +305,15 @@ class ArmorTypeCriterion (_Criterion):
             return False
         return item.type == self.type
 
+    def lookup(self, index):
+        return index.get('armortype', self.type)
+
+    def mask(self, columns):
+        return columns.haskey('armortype', lambda t, b: t == self.type)
+
+    def sql(self, db):
+        return db.haskey('armortype', 'k.a = ?', [self.type])
+
     def __str__(self):
         return 'Armor/shield type: %s' % self.type
 
@@ -169,6 +322,9 @@ class ArmorWearerCriterion (_Criterion):
 
     """Armor/shields for 'Character' or for 'Mount'."""
 
+    cost = 1
+    selectivity = 0.1
+
     def __init__(self, wearer):
         """Define wearer: 'Character' or 'Mount'."""
         self.wearer = wearer
@@ -181,6 +337,15 @@ class ArmorWearerCriterion (_Criterion):
             return False
         return item.wearer == self.wearer
 
+    def lookup(self, index):
+        return index.get('wearer', self.wearer)
+
+    def mask(self, columns):
+        return columns.haskey('wearer', lambda w, b: w == self.wearer)
+
+    def sql(self, db):
+        return db.haskey('wearer', 'k.a = ?', [self.wearer])
+
     def __str__(self):
         return 'Armor wearer: %s' % self.wearer
 
@@ -194,6 +359,9 @@ class CharacterAbilityCriterion (_Criterion):
 
     """
 
+    cost = 8
+    selectivity = 0.1
+
     def __init__(self, name=None, minIIQ=None, maxIIQ=None):
         """Define name and/or IIQ of desired ability."""
         self.name = name
@@ -222,15 +390,43 @@ class CharacterAbilityCriterion (_Criterion):
 
     def match(self, item):
         """Return boolean indicating whether item has specified ability."""
-        if 'ability' in dir(item):
+        caps = capabilities(item)
+        if caps.ability:
             if self._abilitymatch(item.ability):
                 return True
-        if 'abilities' in dir(item):
+        if caps.abilities:
             for ability in item.abilities:
                 if self._abilitymatch(ability):
                     return True
         return False
 
+    def lookup(self, index):
+        def test(name, IIQ):
+            return ((self.name is None or self.name == name) and
+                    (self.minIIQ is None or self.minIIQ <= IIQ) and
+                    (self.maxIIQ is None or self.maxIIQ >= IIQ))
+        return index.where('ability', test)
+
+    def mask(self, columns):
+        def test(name, IIQ):
+            return ((self.name is None or self.name == name) and
+                    (self.minIIQ is None or self.minIIQ <= IIQ) and
+                    (self.maxIIQ is None or self.maxIIQ >= IIQ))
+        return columns.haskey('ability', test)
+
+    def sql(self, db):
+        clauses, params = ['1'], []
+        if self.name is not None:
+            clauses.append('k.a = ?')
+            params.append(self.name)
+        if self.minIIQ is not None:
+            clauses.append('k.b >= ?')
+            params.append(self.minIIQ)
+        if self.maxIIQ is not None:
+            clauses.append('k.b <= ?')
+            params.append(self.maxIIQ)
+        return db.haskey('ability', ' AND '.join(clauses), params)
+
     def __str__(self):
         val = ''
         if self.name is not None:
@@ -252,6 +448,9 @@ class NumAbilitiesCriterion (_Criterion):
 
     """Item contains the specified number of abilities."""
 
+    cost = 3
+    selectivity = 0.3
+
     def __init__(self, min=None, max=None, exact=None):
         self.min = min
         self.max = max
@@ -261,7 +460,7 @@ class NumAbilitiesCriterion (_Criterion):
 
     def match(self, item):
         """Return boolean indicating if item has specified number of abilities."""
-        if 'abilities' in dir(item):
+        if capabilities(item).abilities:
             num = len(item.abilities)
             if self.min is not None:
                 if self.min > num:
@@ -274,6 +473,18 @@ class NumAbilitiesCriterion (_Criterion):
             return (self.min is None or self.min <= 1)
             # max cannot be less than 1
 
+    def mask(self, columns):
+        mask = columns.between(columns.abilities, self.min, self.max)
+        if self.min is None or self.min <= 1:
+            mask |= columns.isin(columns.abilities, (columns.NONE,))
+        return mask
+
+    def sql(self, db):
+        clause, params = db.between('abilities', self.min, self.max)
+        if self.min is None or self.min <= 1:
+            clause = '(%s) OR items.abilities IS NULL' % clause
+        return (clause, params)
+
     def __str__(self):
         if self.min == self.max:
             return '%s abilities' % self.min
@@ -284,6 +495,9 @@ class PriceCriterion (_Criterion):
 
     """Item is within the specified price range."""
 
+    cost = 3
+    selectivity = 0.3
+
     def __init__(self, min=None, max=None):
         self.min = min
         self.max = max
@@ -298,6 +512,18 @@ class PriceCriterion (_Criterion):
                 return False
         return True
 
+    def lookup(self, index):
+        def test(bucket):
+            return ((self.min is None or pricebucket(self.min) <= bucket) and
+                    (self.max is None or pricebucket(self.max) >= bucket))
+        return index.where('price', test)
+
+    def mask(self, columns):
+        return columns.between(columns.price, self.min, self.max)
+
+    def sql(self, db):
+        return db.between('price', self.min, self.max)
+
     def __str__(self):
         if self.min == self.max:
             return '$%s' % self.min
@@ -308,6 +534,9 @@ class MarkupCriterion (_Criterion):
 
     """Item is within the specified price range."""
 
+    cost = 1
+    selectivity = 0.3
+
     def __init__(self, min=None, max=None):
         self.min = min
         self.max = max
@@ -322,6 +551,12 @@ class MarkupCriterion (_Criterion):
                 return False
         return True
 
+    def mask(self, columns):
+        return columns.between(columns.markup, self.min, self.max)
+
+    def sql(self, db):
+        return db.between('markup', self.min, self.max)
+
     def __str__(self):
         if self.min == self.max:
             return '%s%% markup' % self.min
@@ -332,13 +567,16 @@ class ChargesCriterion (_Criterion):
 
     """Item has the specified number of charges."""
 
+    cost = 3
+    selectivity = 0.1
+
     def __init__(self, min=None, max=None):
         self.min = min
         self.max = max
 
     def match(self, item):
         """Return boolean indicating if charges are within specified range."""
-        if 'charges' not in dir(item):
+        if not capabilities(item).charges:
             return False
         if self.min is not None:
             if self.min > item.charges:
@@ -348,6 +586,19 @@ class ChargesCriterion (_Criterion):
                 return False
         return True
 
+    def lookup(self, index):
+        def test(charges):
+            return ((self.min is None or self.min <= charges) and
+                    (self.max is None or self.max >= charges))
+        return index.where('charges', test)
+
+    def mask(self, columns):
+        lo = 0 if self.min is None else max(self.min, 0)  # skip NONE
+        return columns.between(columns.charges, lo, self.max)
+
+    def sql(self, db):
+        return db.between('charges', self.min, self.max)
+
     def __str__(self):
         if self.min == self.max:
             return '%s charges' % self.min
@@ -358,15 +609,27 @@ class LanguageCriterion (_Criterion):
 
     """Language on book/scroll."""
 
+    cost = 3
+    selectivity = 0.05
+
     def __init__(self, language):
         """Define language."""
         self.language = language
 
     def match(self, item):
         """Return boolean indicating whether item is of correct language."""
-        if 'language' not in dir(item):
+        if not capabilities(item).language:
             return False
         return item.language == self.language
 
+    def lookup(self, index):
+        return index.get('language', self.language)
+
+    def mask(self, columns):
+        return columns.haskey('language', lambda l, b: l == self.language)
+
+    def sql(self, db):
+        return db.haskey('language', 'k.a = ?', [self.language])
+
     def __str__(self):
         return 'Language: %s' % self.language
@@ -0,0 +1,203 @@
+from elvenfire.artifacts.combat import Weapon, Armor
+from elvenfire.abilities.charabilities import _CharacterAbility
+from elvenfire.abilities.itemabilities import *
+from storemanager.stockitems import capabilities
+
+
+def pricebucket(price):
+    """Return the index bucket for a price: 0, 1, 2-3, 4-7, 8-15, ..."""
+    return int(max(price, 0)).bit_length()
+
+
+def _abilities(item):
+    """Yield every ability a criterion may inspect on item."""
+    abilities = []
+    caps = capabilities(item)
+    if caps.ability:
+        abilities.append(item.ability)
+    if caps.abilities:
+        abilities.extend(item.abilities)
+    while abilities:
+        ability = abilities.pop()
+        if isinstance(ability, WeaponAbility) and ability.type == 'Enhanced':
+            abilities.extend(ability.abilities)
+        yield ability
+
+
+def _weapontypes(item):
+    """Yield the weapon type of item and of any Changling sub-weapons."""
+    if item.changling:
+        yield from _weapontypes(item.primaryweapon)
+        yield from _weapontypes(item.secondaryweapon)
+    else:
+        yield item.type
+
+
+def itemkeys(item):
+    """Return the set of index keys describing item.
+
+    Keys are tuples of (kind, value, ...):
+      ('type', cls)                -- every class item is an instance of
+      ('ability', name, IIQ)       -- character ability
+      ('attr', attr, size)         -- attribute bonus
+      ('language', language)       -- book/scroll language
+      ('weapontype', type)         -- exact weapon type
+      ('armortype', type)          -- exact armor/shield type
+      ('wearer', wearer)           -- armor wearer
+      ('charges', charges)         -- number of charges
+      ('price', bucket)            -- see pricebucket()
+
+    """
+    keys = set(('type', cls) for cls in type(item).__mro__)
+    caps = capabilities(item)
+    for ability in _abilities(item):
+        if isinstance(ability, _CharacterAbility):
+            keys.add(('ability', ability.name, ability.IIQ))
+        if (isinstance(ability, AttributeAbility) or
+                isinstance(ability, AmuletAbility)):
+            if hasattr(ability, 'attr') and hasattr(ability, 'size'):
+                keys.add(('attr', ability.attr, ability.size))
+    if caps.language:
+        keys.add(('language', item.language))
+    if isinstance(item, Weapon):
+        for weapontype in _weapontypes(item):
+            keys.add(('weapontype', weapontype))
+    if isinstance(item, Armor):
+        keys.add(('armortype', item.type))
+        keys.add(('wearer', item.wearer))
+    if caps.charges:
+        keys.add(('charges', item.charges))
+    keys.add(('price', pricebucket(item.price())))
+    return keys
+
+
+def exactkeys(item):
+    """Return the set of (kind, a, b) keys describing item exactly.
+
+    Unlike itemkeys(), each kind answers one criterion exactly, so criteria
+    can be evaluated from the keys alone (see _Criterion.sql and mask):
+      ('ability', name, IIQ)    -- character ability, incl. Enhanced weapons
+      ('attr', attr, size)      -- attribute bonus of the item's own abilities
+      ('language', language)    -- book/scroll language
+      ('weapontype', type)      -- weapon type, incl. Changling sub-weapons
+      ('armortype', type)       -- armor/shield type
+      ('wearer', wearer)        -- armor wearer
+
+    """
+    keys = set()
+    caps = capabilities(item)
+    for ability in _abilities(item):
+        if isinstance(ability, _CharacterAbility):
+            keys.add(('ability', ability.name, ability.IIQ))
+    own = ([item.ability] if caps.ability else []) + \
+          (list(item.abilities) if caps.abilities else [])
+    for ability in own:
+        if (isinstance(ability, AttributeAbility) or
+                isinstance(ability, AmuletAbility)):
+            if hasattr(ability, 'attr') and hasattr(ability, 'size'):
+                keys.add(('attr', ability.attr, ability.size))
+    if caps.language:
+        keys.add(('language', item.language, None))
+    if isinstance(item, Weapon):
+        for weapontype in _weapontypes(item):
+            keys.add(('weapontype', weapontype, None))
+    if isinstance(item, Armor):
+        keys.add(('armortype', item.type, None))
+        if item.wearer is not None:
+            keys.add(('wearer', item.wearer, None))
+    return keys
+
+
+class ItemIndex:
+
+    """Inverted index of the items for sale within a town.
+
+    Each index key (see itemkeys()) maps to a posting list: the set of ids
+    of items with that key. Criteria use lookup() to narrow a search to a
+    set of candidate ids with set intersections and unions, and only the
+    candidates are checked with match().
+
+    The index is kept up to date incrementally by the Town as items are
+    purchased, added, repriced, or restocked.
+
+    Attributes:
+      items    -- dict of id(item) -> item
+      stores   -- dict of id(item) -> store holding the item
+      postings -- dict of kind -> {key values: set of ids}
+
+    """
+
+    def __init__(self, stores=()):
+        self.items = {}
+        self.stores = {}
+        self.postings = {}
+        self._keys = {}
+        self._bystore = {}
+        for store in stores:
+            self.addstore(store)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item, store):
+        """Index item, held by store."""
+        i = id(item)
+        if i in self.items:
+            self.remove(item)
+        self.items[i] = item
+        self.stores[i] = store
+        self._bystore.setdefault(id(store), set()).add(i)
+        keys = itemkeys(item)
+        self._keys[i] = keys
+        for key in keys:
+            self.postings.setdefault(key[0], {}).setdefault(key[1:],
+                                                            set()).add(i)
+
+    def remove(self, item):
+        """Remove item from the index, if present."""
+        i = id(item)
+        if i not in self.items:
+            return
+        for key in self._keys.pop(i):
+            kind = self.postings[key[0]]
+            kind[key[1:]].discard(i)
+            if not kind[key[1:]]:
+                del kind[key[1:]]
+        del self.items[i]
+        self._bystore[id(self.stores.pop(i))].discard(i)
+
+    def addstore(self, store):
+        """Index every item currently for sale in store."""
+        for item in store.getitems():
+            self.add(item, store)
+
+    def removestore(self, store):
+        """Remove every item of store from the index."""
+        for i in list(self._bystore.get(id(store), ())):
+            self.remove(self.items[i])
+        self._bystore.pop(id(store), None)
+
+    def store(self, item):
+        """Return the store holding item."""
+        return self.stores[id(item)]
+
+    def get(self, *key):
+        """Return the posting list for an exact key, e.g. get('type', Rod)."""
+        return self.postings.get(key[0], {}).get(key[1:], set())
+
+    def where(self, kind, test):
+        """Return the union of posting lists of kind whose values pass test.
+
+        test is called with the key values, e.g. test(name, IIQ) for
+        'ability' keys.
+
+        """
+        ids = set()
+        for values, posting in self.postings.get(kind, {}).items():
+            if test(*values):
+                ids |= posting
+        return ids
+
+    def getitems(self, ids):
+        """Return the items for a set of ids."""
+        return [self.items[i] for i in ids]
@@ -0,0 +1,159 @@
+from storemanager.search.criterion import PriceCriterion, MarkupCriterion
+from storemanager.search.criteriaset import *
+from storemanager.search.criteriaset import _CriteriaSet
+
+
+class Planner:
+
+    """Rewrite a criteria tree into an equivalent one that is cheaper to run.
+
+    The planner never modifies the tree it is given. The rewritten tree:
+      - has NOT pushed down to the leaves (De Morgan), with NOT NOT removed
+      - has nested AND sets collapsed into their AND parent (OR likewise),
+        and single-child sets replaced by the child
+      - has PriceCriterion/MarkupCriterion ranges merged: intersected within
+        an AND set, and overlapping ranges united within an OR set
+      - has the children of each set ordered so the cheapest, most decisive
+        checks run first: AND children that reject the most items per unit
+        of cost, and OR children that accept the most, come first
+
+    Costs and selectivities are taken from each criterion class (see
+    _Criterion). If an ItemIndex is given, selectivities of criteria that
+    can use the index are measured from it instead.
+
+    Public Methods:
+      Planner(index)     -- create a planner, optionally using an ItemIndex
+      .plan(criterion)    -- return the rewritten criteria tree
+      .explain(criterion) -- return the rewritten tree as readable text
+
+    """
+
+    ranged = (PriceCriterion, MarkupCriterion)
+
+    def __init__(self, index=None):
+        self.index = index
+
+    ## Estimates
+
+    def selectivity(self, criterion):
+        """Return the estimated fraction of items matching criterion."""
+        if isinstance(criterion, NOTCriteriaSet):
+            return 1 - self.selectivity(criterion.criteria[0])
+        if isinstance(criterion, ANDCriteriaSet):
+            sel = 1
+            for c in criterion.criteria:
+                sel *= self.selectivity(c)
+            return sel
+        if isinstance(criterion, ORCriteriaSet):
+            miss = 1
+            for c in criterion.criteria:
+                miss *= 1 - self.selectivity(c)
+            return 1 - miss
+        if self.index is not None and len(self.index) > 0:
+            ids = criterion.lookup(self.index)
+            if ids is not None:
+                return len(ids) / len(self.index)
+        return criterion.selectivity
+
+    def cost(self, criterion):
+        """Return the expected cost of criterion.match() on one item.
+
+        For a set, this assumes its children are evaluated in order and
+        evaluation stops at the first decisive child.
+
+        """
+        if isinstance(criterion, NOTCriteriaSet):
+            return self.cost(criterion.criteria[0])
+        if isinstance(criterion, ANDCriteriaSet):
+            total, reach = 0, 1
+            for c in criterion.criteria:
+                total += reach * self.cost(c)
+                reach *= self.selectivity(c)
+            return total
+        if isinstance(criterion, ORCriteriaSet):
+            total, reach = 0, 1
+            for c in criterion.criteria:
+                total += reach * self.cost(c)
+                reach *= 1 - self.selectivity(c)
+            return total
+        return criterion.cost
+
+    def _rank(self, criterion, isand):
+        """Return sort key: expected cost per item decided."""
+        sel = self.selectivity(criterion)
+        decided = (1 - sel) if isand else sel
+        if decided <= 0:
+            return float('inf')
+        return self.cost(criterion) / decided
+
+    ## Rewriting
+
+    def _mergeranges(self, criteria, isand):
+        """Merge the Price/Markup ranges among criteria."""
+        for cls in self.ranged:
+            ranges = [c for c in criteria if type(c) is cls]
+            if len(ranges) < 2:
+                continue
+            position = criteria.index(ranges[0])
+            criteria = [c for c in criteria if type(c) is not cls]
+            if isand:
+                mins = [c.min for c in ranges if c.min is not None]
+                maxes = [c.max for c in ranges if c.max is not None]
+                merged = [cls(max(mins) if mins else None,
+                              min(maxes) if maxes else None)]
+            else:
+                merged = []
+                lowest = float('-inf')
+                for c in sorted(ranges, key=lambda c: lowest if c.min is None
+                                                      else c.min):
+                    last = merged[-1] if merged else None
+                    if (last is not None and (last.max is None or
+                            c.min is None or c.min <= last.max)):
+                        if last.max is not None and (c.max is None or
+                                                     c.max > last.max):
+                            merged[-1] = cls(last.min, c.max)
+                    else:
+                        merged.append(cls(c.min, c.max))
+            criteria[position:position] = merged
+        return criteria
+
+    def _rewrite(self, criterion, negate=False):
+        if isinstance(criterion, NOTCriteriaSet):
+            return self._rewrite(criterion.criteria[0], not negate)
+        if not (isinstance(criterion, ANDCriteriaSet) or
+                isinstance(criterion, ORCriteriaSet)):
+            return NOTCriteriaSet(criterion) if negate else criterion
+        isand = isinstance(criterion, ANDCriteriaSet) != negate
+        settype = ANDCriteriaSet if isand else ORCriteriaSet
+        children = []
+        for child in criterion.criteria:
+            child = self._rewrite(child, negate)
+            if isinstance(child, settype):
+                children.extend(child.criteria)
+            else:
+                children.append(child)
+        children = self._mergeranges(children, isand)
+        if len(children) == 1:
+            return children[0]
+        children.sort(key=lambda c: self._rank(c, isand))
+        return settype(children)
+
+    ## Public
+
+    def plan(self, criterion):
+        """Return an equivalent, cheaper criteria tree."""
+        return self._rewrite(criterion)
+
+    def explain(self, criterion):
+        """Return the plan for criterion, with estimates, as readable text."""
+        lines = []
+        self._explain(self.plan(criterion), 0, lines)
+        return '\n'.join(lines)
+
+    def _explain(self, criterion, depth, lines):
+        lines.append('%s%s  (cost %.1f, selectivity %.3f)' %
+                     ('  ' * depth, criterion, self.cost(criterion),
+                      self.selectivity(criterion)))
+        if isinstance(criterion, _CriteriaSet):
+            for child in criterion.criteria:
+                self._explain(child, depth + 1, lines)
@@ -0,0 +1,293 @@
+import struct
+import mmap
+import os
+
+from array import array
+
+from storemanager.search import SearchError
+from storemanager.search.index import exactkeys
+from storemanager.search.columns import ItemColumns
+from storemanager.search.criteriaset import ANDCriteriaSet
+from storemanager.storage import StorageError, binary
+
+
+MAGIC = b'ELFS'
+VERSION = 1
+
+_header = struct.Struct('<4sHH')            # magic, version, sections
+_section = struct.Struct('<16sc7xQQ')       # name, typecode, offset, count
+
+# Sections, by name: typecode (fixed-size, so the layout is the same on
+# every platform)
+_layout = {
+    # one value per row
+    'value': 'q', 'markup': 'q', 'price': 'q', 'charges': 'q',
+    'abilities': 'q', 'type': 'i', 'town': 'i', 'store': 'i', 'id': 'Q',
+    'texts': 'i',
+    # one value per type code or town code
+    'typenames': 'i', 'townnames': 'i', 'mtimes': 'd',
+    # keys (see exactkeys), grouped by kind; kinds[k] are the rows
+    # kstart[k]:kstart[k+1]
+    'kinds': 'i', 'kstart': 'Q', 'krow': 'i', 'ka': 'i', 'kb': 'q',
+    # string table: string i is strdata[stroff[i]:stroff[i+1]]
+    'stroff': 'Q', 'strdata': 'B',
+}
+
+
+def filename(index):
+    """Return the snapshot file beside the towns of a continent index."""
+    return os.path.join(index.directory, 'continent.snapshot')
+
+
+def export(index, name=None):
+    """Write a snapshot of the items for sale in every town of index.
+
+    The snapshot holds, for every item, the columns of an ItemColumns, the
+    item's id, its search text, and its keys (see exactkeys), with every
+    string in a shared string table. It is written to a temporary file and
+    then renamed, so readers that already have the old snapshot open are
+    not disturbed. Returns the snapshot's filename.
+
+    """
+    if name is None:
+        name = filename(index)
+    strings = {}
+    def intern(s):
+        return strings.setdefault(s, len(strings))
+    entries = list(index)
+    columns = ItemColumns()
+    sections = {key: array(code) for key, code in _layout.items()}
+    keys = {}
+    for t, entry in enumerate(entries):
+        town = index.load(entry)
+        first = len(columns)
+        columns.addtown(town)
+        sections['townnames'].append(intern(town.name))
+        sections['mtimes'].append(entry.mtime)
+        for s, store in enumerate(town.stores):
+            sections['store'].extend([s] * len(store.getitems()))
+        for row in range(first, len(columns)):
+            item = columns.items[row]
+            sections['id'].append(item.id)
+            sections['texts'].append(intern(item.searchtext()))
+            for kind, a, b in exactkeys(item):
+                keys.setdefault(kind, []).append(
+                    (row, intern(a), columns.NONE if b is None else b))
+    for key in ('value', 'markup', 'price', 'charges', 'abilities', 'type',
+                'town'):
+        sections[key].fromlist(getattr(columns, key).tolist())
+    for cls in columns.types:
+        sections['typenames'].append(
+            intern(':'.join(binary._classname(cls))))
+    for kind in sorted(keys):
+        sections['kinds'].append(intern(kind))
+        sections['kstart'].append(len(sections['krow']))
+        for row, a, b in sorted(keys[kind]):
+            sections['krow'].append(row)
+            sections['ka'].append(a)
+            sections['kb'].append(b)
+    sections['kstart'].append(len(sections['krow']))
+    offset = 0
+    for s in strings:  # in insertion order, i.e. by index
+        sections['stroff'].append(offset)
+        data = s.encode('utf-8')
+        sections['strdata'].frombytes(data)
+        offset += len(data)
+    sections['stroff'].append(offset)
+
+    tmpname = name + '.tmp'
+    file = open(tmpname, 'wb')
+    file.write(_header.pack(MAGIC, VERSION, len(sections)))
+    offset = _header.size + _section.size * len(sections)
+    for key, values in sections.items():
+        offset += -offset % 8
+        file.write(_section.pack(key.encode('ascii'),
+                                 values.typecode.encode('ascii'),
+                                 offset, len(values)))
+        offset += len(values) * values.itemsize
+    for values in sections.values():
+        file.write(b'\0' * (-file.tell() % 8))
+        values.tofile(file)
+    file.close()
+    os.replace(tmpname, name)
+    return name
+
+
+def opensnapshot(index):
+    """Return the MappedColumns of index's snapshot, or None if it has none."""
+    if not os.path.isfile(filename(index)):
+        return None
+    return MappedColumns(filename(index))
+
+
+class MappedColumns (ItemColumns):
+
+    """Read-only, memory-mapped snapshot of a continent (see export()).
+
+    The columns are views straight into the mapped file, so opening a
+    snapshot reads nothing until it is searched, and every process using
+    the same snapshot shares its pages. Criteria are evaluated as masks,
+    as for an ItemColumns, but without loading (or unpickling) any town:
+    there are no items, only their values, search text, and keys.
+
+    Rows are located by (town name, store number, item id); items() looks
+    up the live items in towns loaded from a continent index. The snapshot
+    is not kept up to date; stale() lists the towns saved since it was
+    exported.
+
+    Attributes:
+      filename -- snapshot file
+      towns    -- list of town names; the town column holds indices into it
+      types    -- list of item classes; the type column holds indices into it
+      id       -- column of item ids
+      store    -- column of store numbers, within each town
+      (and the other columns of ItemColumns, except items and stores)
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._sortedcolumns = {}
+        file = open(str(filename), 'rb')
+        try:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            file.close()
+        if len(self._map) < _header.size:
+            magic = version = count = None
+        else:
+            magic, version, count = _header.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise StorageError('Not a continent snapshot: %s' % filename)
+        if version != VERSION:
+            self._map.close()
+            raise StorageError('Snapshot version %s is not supported (version'
+                               ' %s); export it again' % (version, VERSION))
+        buffer = memoryview(self._map)
+        self._views = [buffer]
+        for i in range(count):
+            key, typecode, offset, length = _section.unpack_from(
+                self._map, _header.size + _section.size * i)
+            typecode = typecode.decode('ascii')
+            end = offset + length * struct.calcsize(typecode)
+            view = buffer[offset:end].cast(typecode)
+            self._views.append(view)
+            setattr(self, key.rstrip(b'\0').decode('ascii'), view)
+        self.towns = [self.string(i) for i in self.townnames]
+        self.types = [binary._resolve(self.string(i).split(':'))
+                      for i in self.typenames]
+        self.kindnames = [self.string(i) for i in self.kinds]
+        self._full = self._mask(b'\x01' * len(self))
+
+    def close(self):
+        """Unmap the file; the snapshot cannot be searched afterwards."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+
+    def __len__(self):
+        return len(self.price)
+
+    def string(self, i):
+        """Return string i of the string table."""
+        return str(self.strdata[self.stroff[i]:self.stroff[i+1]], 'utf-8')
+
+    ## Masks
+
+    def haskey(self, kind, test):
+        """Return the mask of rows with a key (kind, a, b) where test(a, b).
+
+        test is called once per distinct key, not once per row.
+
+        """
+        if kind not in self.kindnames:
+            return 0
+        k = self.kindnames.index(kind)
+        start, end = self.kstart[k], self.kstart[k+1]
+        tested = {}
+        flags = bytearray(len(self))
+        for row, a, b in zip(self.krow[start:end], self.ka[start:end],
+                             self.kb[start:end]):
+            if (a, b) not in tested:
+                tested[a, b] = test(self.string(a),
+                                    None if b == self.NONE else b)
+            if tested[a, b]:
+                flags[row] = 1
+        return self._mask(flags)
+
+    def text(self, find):
+        """Return the mask of rows for which find(searchtext) is true."""
+        string = self.string
+        return self._mask(bool(find(string(t))) for t in self.texts)
+
+    ## Searching
+
+    def candidates(self, criterion):
+        """Return (rows, rest): candidate rows, and criteria left to match.
+
+        As in ItemColumns.chunks(), the children of an AND set that cannot
+        be evaluated as masks are returned in rest, to be checked with
+        match() against the live items.
+
+        """
+        mask = criterion.mask(self)
+        if mask is not None:
+            return self.rows(mask), []
+        if not isinstance(criterion, ANDCriteriaSet):
+            return range(len(self)), [criterion]
+        mask = self.all()
+        rest = []
+        for child in criterion.criteria:
+            found = child.mask(self)
+            if found is None:
+                rest.append(child)
+            else:
+                mask &= found
+        return self.rows(mask), rest
+
+    def chunks(self, criterion, size=100):
+        """Yield the rows matching criterion, size rows at a time.
+
+        Raises SearchError if the criterion cannot be evaluated as a mask.
+
+        """
+        rows, rest = self.candidates(criterion)
+        if rest:
+            raise SearchError('%s cannot be evaluated on a snapshot' %
+                              rest[0])
+        for start in range(0, len(rows), size):
+            yield rows[start:start+size]
+
+    def search(self, criterion):
+        """Return the locations (see locate()) of the items matching."""
+        return [self.locate(row) for row in self.select(criterion)]
+
+    def locate(self, row):
+        """Return (town name, store number, item id) of the item in row."""
+        return (self.towns[self.town[row]], self.store[row], self.id[row])
+
+    def stale(self, index):
+        """Return the set of names of towns saved since the export."""
+        mtimes = dict(zip(self.towns, self.mtimes))
+        names = set(entry.name for entry in index
+                    if mtimes.get(entry.name) != entry.mtime)
+        return names | (set(self.towns) - set(e.name for e in index))
+
+    def items(self, index, rows):
+        """Yield (item, store, town) for the live item in each row.
+
+        Towns are loaded from index. Rows of towns no longer in index, or
+        of items since sold, are skipped.
+
+        """
+        entries = dict((entry.name, entry) for entry in index)
+        for row in rows:
+            name, s, id = self.locate(row)
+            if name not in entries:
+                continue
+            town = index.load(entries[name])
+            item = town.stores[s].inventory.get(id)
+            if item is not None:
+                yield (item, town.stores[s], town)
@@ -0,0 +1,114 @@
+import threading
+
+
+class SearchJob:
+
+    """Search every town on the continent, in chunks that can be cancelled.
+
+    The job is independent of the GUI, so it can be run in a background
+    thread (see GUI.search.SearchThread): run() yields the matching items a
+    chunk at a time, and cancel() may be called from any thread to stop it
+    at the next chunk.
+
+    Towns are loaded through the ContinentIndex as they are reached, and
+    searched using a columnar snapshot (see ItemColumns), with criteria
+    that have no mask narrowed through the town's ItemIndex first. A
+    ContinentDB is searched with a single query instead (see
+    ContinentDB.search), and only the towns holding matches are loaded.
+    Likewise, given an exported snapshot of the continent (see
+    search.snapshot), the criteria are evaluated on the snapshot first;
+    only towns saved since the export are searched the usual way. Matches
+    are yielded as (item, store, town) tuples; the items themselves, which
+    other threads may be using, are not changed.
+
+    Attributes:
+      index     -- ContinentIndex of the towns to search
+      criterion -- criteria to search for (already planned, if desired)
+      snapshot  -- MappedColumns of the continent, or None
+      chunksize -- maximum number of items checked per chunk
+      done      -- number of towns searched so far
+      total     -- number of towns to search
+      found     -- number of items found so far
+
+    """
+
+    chunksize = 100
+
+    def __init__(self, index, criterion, chunksize=None, snapshot=None):
+        self.index = index
+        self.criterion = criterion
+        if chunksize is not None:
+            self.chunksize = chunksize
+        self.snapshot = snapshot
+        self.done = 0
+        self.total = len(index)
+        self.found = 0
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Stop the search at the next chunk."""
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def run(self):
+        """Yield non-empty lists of (item, store, town) until done or cancelled."""
+        if self.snapshot is not None:
+            yield from self._runsnapshot()
+            return
+        if hasattr(self.index, 'search'):
+            yield from self._rundb()
+            return
+        entries = list(self.index)
+        self.total = len(entries)
+        yield from self._runtowns(entries)
+
+    def _runtowns(self, entries):
+        """Search each town in entries in turn."""
+        for entry in entries:
+            if self.cancelled():
+                return
+            town = self.index.load(entry)
+            columns = town.columns()
+            for rows in columns.chunks(self.criterion, self.chunksize,
+                                       town.itemindex()):
+                if self.cancelled():
+                    return
+                items = [(columns.items[row],) + columns.locate(row)
+                         for row in rows]
+                if items:
+                    self.found += len(items)
+                    yield items
+            self.done += 1
+
+    def _rundb(self):
+        """Search a ContinentDB, yielding the matches a town at a time."""
+        for entry, items in self.index.search(self.criterion):
+            for i in range(0, len(items), self.chunksize):
+                if self.cancelled():
+                    return
+                self.found += len(items[i:i+self.chunksize])
+                yield items[i:i+self.chunksize]
+            self.done += 1
+        self.done = self.total
+
+    def _runsnapshot(self):
+        """Search the snapshot, then the towns saved since its export."""
+        stale = self.snapshot.stale(self.index)
+        entries = [entry for entry in self.index if entry.name in stale]
+        rows, rest = self.snapshot.candidates(self.criterion)
+        rows = [r for r in rows
+                if self.snapshot.towns[self.snapshot.town[r]] not in stale]
+        self.total = len(self.index)
+        for start in range(0, len(rows), self.chunksize):
+            if self.cancelled():
+                return
+            items = [found for found in self.snapshot.items(
+                         self.index, rows[start:start+self.chunksize])
+                     if all(c.match(found[0]) for c in rest)]
+            if items:
+                self.found += len(items)
+                yield items
+        self.done = self.total - len(entries)
+        yield from self._runtowns(entries)
@@ -1,4 +1,5 @@
 
+import weakref
 import random
 
 from storemanager import StoreMgrError
@@ -8,6 +9,54 @@ class StockItemError (StoreMgrError):
     pass
 
 
+class Capabilities:
+
+    """Optional attributes offered by a stock item, for searches and display.
+
+    Each attribute in names is a boolean indicating whether the item has
+    an attribute of that name (e.g. caps.charges -> item.charges exists).
+
+    Capabilities are computed once per stock-item class from the provides
+    tuples declared on it and its base classes. Classes whose items vary
+    (e.g. PotionStockItem) leave provides as None, and their items are
+    checked individually.
+
+    """
+
+    names = ('ability', 'abilities', 'charges', 'language', 'itemtype',
+             'style')
+
+    def __init__(self, provided):
+        for name in self.names:
+            setattr(self, name, name in provided)
+
+
+_capabilities = {}
+
+
+def _declared(cls):
+    """Return the union of provides declared in cls.__mro__, or None."""
+    provided = None
+    for c in cls.__mro__:
+        declared = c.__dict__.get('provides')
+        if declared is not None:
+            provided = (provided or ()) + tuple(declared)
+    return provided
+
+
+def capabilities(item):
+    """Return the Capabilities of item (or any other artifact)."""
+    cls = type(item)
+    if cls not in _capabilities:
+        provided = _declared(cls)
+        _capabilities[cls] = None if provided is None else \
+                             Capabilities(provided)
+    caps = _capabilities[cls]
+    if caps is None:  # varies by item
+        caps = Capabilities([n for n in Capabilities.names if hasattr(item, n)])
+    return caps
+
+
 class _StockItem:
 
     """Abstract class: an item available for purchase from a store.
@@ -17,6 +66,7 @@ class _StockItem:
       desc     -- (optional) description of item
       value    -- fair market value of item
       markup   -- percentage used to calculate cost (100 == FMV)
+      id       -- stable id, unique within its town; set when first stocked
 
       commission           -- boolean: does a commission exist for this item
       commission_rate      -- multiplier for commission (e.g. 0.60)
@@ -26,14 +76,26 @@ class _StockItem:
 
     Printing options:
       str()         -- normal string listing, with pricing information
+      searchtext()  -- str(), case-folded and cached, for text searches
       readable()    -- long-hand listing, formatted with spaces for readability
       short()       -- 30 characters or less, with minimum information
       description() -- description of the item, with usage information
 
-    To implement, set name and value [and desc] before calling __init__.
+    To implement, set name and value [and desc] before calling __init__,
+    and declare the optional attributes items provide (see Capabilities).
+
+    The search text cache is kept in a slot, rather than in the item's
+    __dict__, and is not pickled: adding it to the __dict__ of an item
+    already in stock takes the dict out of its compact, shared-key form.
 
     """
 
+    __slots__ = ('_searchcache',)
+
+    provides = None
+
+    id = None
+
     commission = False
     commission_rate = 0
     commission_player = None
@@ -42,6 +104,29 @@ class _StockItem:
     def __init__(self):
         self._setmarkup()
 
+    def __getstate__(self):
+        """Return the state to pickle, without the search cache.
+
+        A store or town set on the item (as searches used to) is left out
+        too: it is not part of the item, and pickling it would pickle the
+        whole town, e.g. into every journal record holding the item.
+
+        """
+        state = self.__dict__
+        if 'store' in state or 'town' in state:
+            state = dict(state)
+            state.pop('store', None)
+            state.pop('town', None)
+        return state
+
+    def __setstate__(self, state):
+        """Restore the item; drop what older items pickled besides."""
+        if isinstance(state, tuple):  # (__dict__, slots)
+            state = state[0]
+        self.__dict__.update(state)
+        for name in ('_searchkey', '_searchtext', 'store', 'town'):
+            self.__dict__.pop(name, None)
+
     def _setmarkup(self):
         """Set initial self.markup."""
         self.markup = random.randint(101, 120)
@@ -69,10 +154,27 @@ class _StockItem:
         """Return a short version of the name, hopefully under 30 characters."""
         return self.name
 
+    def searchtext(self):
+        """Return str(self), case-folded, for text searches.
+
+        The text is cached until the name or markup changes.
+
+        """
+        try:
+            name, markup, text = self._searchcache
+            if name == self.name and markup == self.markup:
+                return text
+        except AttributeError:  # not searched yet
+            pass
+        text = str(self).casefold()
+        self._searchcache = (self.name, self.markup, text)
+        return text
+
     def description(self):
         """Return a long-hand description of the item."""
-        if 'desc' in dir(self):
-            return self.desc
+        desc = getattr(self, 'desc', None)
+        if desc is not None:
+            return desc
         return self.readable()
 
     def reduce_markup(self):
@@ -101,13 +203,14 @@ class _MultiAbilityStockItem (_StockItem):
     """Extends _StockItem with better print methods for multi-ability items."""
 
     abilityname = 'abilities'
+    provides = ('abilities', 'itemtype')
 
     def readable(self):
         """Return a longer, hopefully more readable listing."""
-        val = "%-50s FMV $%8s:  $%8s" % (self.itemtype, self.value, self.price())
-        for ability in self.abilities:
-            val += "\n - %s" % ability
-        return val
+        val = ["%-50s FMV $%8s:  $%8s" % (self.itemtype, self.value,
+                                           self.price())]
+        val.extend(" - %s" % ability for ability in self.abilities)
+        return '\n'.join(val)
 
     def short(self):
         """Return a short version of the name, hopefully under 30 characters."""
@@ -119,11 +222,12 @@ class _MultiAbilityStockItem (_StockItem):
             minIIQ = 6
             maxIIQ = 0
             for ability in self.abilities:
-                if 'IIQ' in dir(ability):
-                    if ability.IIQ < minIIQ:
-                        minIIQ = ability.IIQ
-                    if ability.IIQ > maxIIQ:
-                        maxIIQ = ability.IIQ
+                IIQ = getattr(ability, 'IIQ', None)
+                if IIQ is not None:
+                    if IIQ < minIIQ:
+                        minIIQ = IIQ
+                    if IIQ > maxIIQ:
+                        maxIIQ = IIQ
             if minIIQ < maxIIQ:
                 val += " (IIQ %s to %s)" % (minIIQ, maxIIQ)
             elif minIIQ == maxIIQ:
@@ -131,7 +235,7 @@ class _MultiAbilityStockItem (_StockItem):
         return val
 
     def description(self):
-        if 'desc' in dir(self):
+        if getattr(self, 'desc', None) is not None:
             val = self.desc
             if len(self.abilities) <= 3:
                 val += '\n\n'
@@ -140,3 +244,69 @@ class _MultiAbilityStockItem (_StockItem):
         return self.readable()
 
 
+def _abilitykey(obj):
+    """Return a hashable key equal for abilities of equal type and state.
+
+    Raises TypeError if obj holds state that cannot be compared this way.
+
+    """
+    if isinstance(obj, (list, tuple)):
+        return (type(obj),) + tuple(_abilitykey(o) for o in obj)
+    if hasattr(obj, '__dict__'):
+        return (type(obj),) + tuple((name, _abilitykey(value)) for name, value
+                                    in sorted(obj.__dict__.items()))
+    hash(obj)
+    return obj
+
+
+class AbilityPool:
+
+    """Shared ability instances, looked up by type and state (flyweights).
+
+    Identical abilities (e.g. the same character ability at the same IIQ,
+    or the same attribute bonus) recur thousands of times across a
+    continent. intern() returns one shared instance for each, so items
+    hold references to it instead of copies; the binary town format then
+    writes each one once per town (see storage.binary).
+
+    Shared abilities must be treated as read-only: to change an item's
+    ability, replace it instead of modifying it. Abilities whose state
+    cannot be compared are left alone. The pool holds its abilities
+    weakly, so those no longer used by any item are released.
+
+    """
+
+    def __init__(self):
+        self._pool = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self._pool)
+
+    def intern(self, ability):
+        """Return the shared ability equal to ability, adding it if new."""
+        try:
+            key = _abilitykey(ability)
+        except TypeError:
+            return ability
+        shared = self._pool.get(key)
+        if shared is not None:
+            return shared
+        inner = getattr(ability, 'abilities', None)  # e.g. Enhanced weapons
+        if isinstance(inner, list):
+            inner[:] = [self.intern(a) for a in inner]
+        try:
+            self._pool[key] = ability
+        except TypeError:  # cannot be weakly referenced
+            pass
+        return ability
+
+    def internitem(self, item):
+        """Replace item's abilities by the shared ones."""
+        caps = capabilities(item)
+        if caps.ability:
+            item.ability = self.intern(item.ability)
+        if caps.abilities and isinstance(item.abilities, list):
+            item.abilities[:] = [self.intern(a) for a in item.abilities]
+
+
+abilitypool = AbilityPool()
@@ -5,6 +5,7 @@ from storemanager.stockitems import _MultiAbilityStockItem
 
 class WeaponStockItem (_MultiAbilityStockItem, Weapon):
     """Enhanced Weapon for sale."""
+    provides = ('style',)
     def __init__(self, style=None, type=None, abilities=None,
                        secondary=False, secondaryweapon=None):
         _MultiAbilityStockItem.__init__(self)
@@ -5,6 +5,7 @@ from storemanager.stockitems import _StockItem, _MultiAbilityStockItem
 
 class RodStockItem (_StockItem, Rod):
     """Rod for sale."""
+    provides = ('ability', 'charges')
     def __init__(self, charges=None, ability=None, IIQ=None):
         Rod.__init__(self, charges, ability, IIQ)
         _StockItem.__init__(self)
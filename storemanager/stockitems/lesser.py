@@ -5,6 +5,7 @@ from storemanager.stockitems import _StockItem, _MultiAbilityStockItem
 
 class GemStockItem (_StockItem, Gem):
     """Gem for sale."""
+    provides = ('ability',)
     def __init__(self, ability=None, IIQ=None):
         Gem.__init__(self, ability, IIQ)
         _StockItem.__init__(self)
@@ -10,6 +10,12 @@ class PotionStockItem (_StockItem, Potion):
         _StockItem.__init__(self)
 
 
+def ishealing(item):
+    """Return True if item is a healing potion (stocked by the dose)."""
+    return (isinstance(item, HealingPotion) or
+            getattr(item, 'cls', None) is HealingPotion)
+
+
 class HealingPotionStockItem(PotionStockItem, HealingPotion):
     """Not generally used, as healing potion is treated separately."""
     def __init__(self, doses=None):
@@ -12,6 +12,8 @@ class TrainableAnimalStockItem (_StockItem):
 
     """
 
+    provides = ()
+
     def __init__(self, name=None, subtype=None):
         self.animal = TrainableAnimal(name, subtype)
         self.name = self.animal.name
@@ -31,6 +33,7 @@ class SpecialArtifactStockItem (_StockItem, SpecialArtifact):
 
 class STBatteryStockItem (_StockItem, STBattery):
     """Strength Battery for sale."""
+    provides = ('charges',)
     def __init__(self, charges=None):
         STBattery.__init__(self, charges)
         _StockItem.__init__(self)
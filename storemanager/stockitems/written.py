@@ -5,6 +5,7 @@ from storemanager.stockitems import _MultiAbilityStockItem
 
 class ScrollStockItem (_MultiAbilityStockItem, Scroll):
     """Scroll for sale."""
+    provides = ('language',)
     def __init__(self, abilities=None, language=None):
         Scroll.__init__(self, abilities, language)
         _MultiAbilityStockItem.__init__(self)
@@ -14,6 +15,7 @@ class ScrollStockItem (_MultiAbilityStockItem, Scroll):
 class BookStockItem (_MultiAbilityStockItem, Book):
     """Book for sale."""
     abilityname = 'pages'
+    provides = ('language',)
     def __init__(self, abilities=None, language=None):
         Book.__init__(self, abilities, language)
         _MultiAbilityStockItem.__init__(self)
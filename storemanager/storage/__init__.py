@@ -0,0 +1,5 @@
+from storemanager import StoreMgrError
+
+
+class StorageError (StoreMgrError):
+    pass
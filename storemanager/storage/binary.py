@@ -0,0 +1,364 @@
+import threading
+import importlib
+import pickle
+import struct
+import io
+
+from storemanager.stockitems import capabilities, abilitypool
+from storemanager.storage import StorageError
+
+
+MAGIC = b'ELFT'
+VERSION = 3
+
+# Classes renamed or moved since a file was written:
+#   ('oldmodule', 'OldName') -> ('newmodule', 'NewName')
+renamed = {}
+
+# Functions to bring a Town loaded from an older version up to date:
+#   version -> function(town), applied in order for every version from the
+#   file's version up to (not including) VERSION. A town whose journal is
+#   older than its snapshot is migrated again, so they must be idempotent.
+migrations = {}
+
+_header = struct.Struct('<4sH')
+_size = struct.Struct('<I')
+_version = struct.Struct('<H')
+
+
+class _Context (threading.local):
+
+    """The town being written or read by this thread.
+
+    References to the town or one of its stores from within another record
+    are pickled as references to this context, and resolved against the
+    town being loaded. abilities holds the town's ability table while its
+    records are read, and version the version of the file being read.
+
+    """
+
+    town = None
+    stores = ()
+    abilities = []
+    version = VERSION
+
+    def __reduce__(self):
+        return '_context'
+
+    def store(self, number):
+        return self.stores[number]
+
+
+_context = _Context()
+
+
+class _Pickler (pickle.Pickler):
+
+    """Pickle one record, writing the town and its stores as references.
+
+    The abilities of the town's ability table, if given, are written as
+    persistent ids: their index in the table. With stores False, stores
+    are written in full, as change records hold them.
+
+    """
+
+    def __init__(self, file, town, abilities=(), stores=True):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.refs = {id(town): (getattr, (_context, 'town'))}
+        self.dispatch_table = {type(town): self._reduce}
+        for number, store in enumerate(town.stores if stores else ()):
+            self.refs[id(store)] = (_context.store, (number,))
+            self.dispatch_table[type(store)] = self._reduce
+        self.table = dict((id(ability), number)
+                          for number, ability in enumerate(abilities))
+
+    def persistent_id(self, obj):
+        return self.table.get(id(obj))
+
+    def _reduce(self, obj):
+        if id(obj) in self.refs:
+            return self.refs[id(obj)]
+        return obj.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+
+
+class _Unpickler (pickle.Unpickler):
+
+    """Unpickle one record, following any class renames.
+
+    Persistent ids are looked up in the ability table being read.
+
+    """
+
+    def __init__(self, file):
+        pickle.Unpickler.__init__(self, file)
+        self.persistent_load = _context.abilities.__getitem__
+
+    def find_class(self, module, name):
+        module, name = renamed.get((module, name), (module, name))
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+class _MemoUnpickler (pickle._Unpickler):
+
+    """Unpickle one record of a version 2 file.
+
+    Version 2 wrote abilities as references to the memo, preloaded with
+    the ability table. Only the pure-Python unpickler lets its memo be set.
+
+    """
+
+    def __init__(self, file):
+        pickle._Unpickler.__init__(self, file)
+        self.memo = dict(enumerate(_context.abilities))
+
+    def find_class(self, module, name):
+        module, name = renamed.get((module, name), (module, name))
+        return pickle._Unpickler.find_class(self, module, name)
+
+
+def _classname(cls):
+    return (cls.__module__, cls.__qualname__)
+
+
+def _resolve(classname):
+    module, name = renamed.get(tuple(classname), tuple(classname))
+    obj = importlib.import_module(module)
+    for attr in name.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def _setstate(obj, state):
+    """Restore obj from state, as unpickling would."""
+    if hasattr(obj, '__setstate__'):
+        obj.__setstate__(state)
+    elif isinstance(state, tuple):  # (__dict__, __slots__ values)
+        state, slots = state
+        if state:
+            obj.__dict__.update(state)
+        for name, value in (slots or {}).items():
+            setattr(obj, name, value)
+    elif state:
+        obj.__dict__.update(state)
+
+
+def _getstate(obj):
+    if hasattr(obj, '__getstate__'):
+        return obj.__getstate__()
+    return obj.__dict__
+
+
+def _abilities(stores):
+    """Return the distinct abilities held directly by items in stores."""
+    abilities = {}
+    for store in stores:
+        for item in store.getitems():
+            caps = capabilities(item)
+            if caps.ability:
+                abilities.setdefault(id(item.ability), item.ability)
+            if caps.abilities:
+                for ability in item.abilities:
+                    abilities.setdefault(id(ability), ability)
+    return list(abilities.values())
+
+
+def _write(file, town, value, abilities=()):
+    buffer = io.BytesIO()
+    _Pickler(buffer, town, abilities).dump(value)
+    file.write(_size.pack(len(buffer.getvalue())))
+    file.write(buffer.getvalue())
+
+
+def _read(file):
+    """Return the next record; raise EOFError after the last."""
+    size = file.read(_size.size)
+    if len(size) < _size.size:
+        raise EOFError()
+    size = _size.unpack(size)[0]
+    data = file.read(size)
+    if len(data) < size:
+        raise StorageError('Truncated town file')
+    if _context.version == 2 and _context.abilities:
+        return _MemoUnpickler(io.BytesIO(data)).load()
+    return _Unpickler(io.BytesIO(data)).load()
+
+
+def isbinary(filename):
+    """Return True if filename holds a town in this format."""
+    file = open(str(filename), 'rb')
+    magic = file.read(len(MAGIC))
+    file.close()
+    return magic == MAGIC
+
+
+def dump(town, file):
+    """Write town to an open binary file.
+
+    After a header (MAGIC and VERSION), the file holds length-prefixed
+    records: a summary of the town (see summary()), the town's ability
+    table, the town without its stores, and then each store in turn. Each
+    record can be read without the ones following it.
+
+    The ability table lists each distinct ability held by the town's items
+    once; items refer to abilities by their index in it, so an ability
+    shared by many items (see AbilityPool) is written only once.
+
+    """
+    state = dict(_getstate(town))
+    stores = state.pop('stores')
+    abilities = _abilities(stores)
+    file.write(_header.pack(MAGIC, VERSION))
+    _write(file, town, {'name': town.name, 'size': town.size,
+                        'stores': len(stores),
+                        'items': sum(len(s.getitems()) for s in stores),
+                        'town': _classname(type(town)),
+                        'classes': [_classname(type(s)) for s in stores]})
+    _write(file, town, abilities)
+    _write(file, town, state, abilities)
+    for store in stores:
+        _write(file, town, _getstate(store), abilities)
+
+
+def _open(file):
+    """Check the header of an open file; return (version, summary)."""
+    magic, version = _header.unpack(file.read(_header.size))
+    if magic != MAGIC:
+        raise StorageError('Not a binary town file')
+    if version > VERSION:
+        raise StorageError('Town file version %s is newer than this program'
+                           ' (version %s)' % (version, VERSION))
+    return version, _read(file)
+
+
+def summary(filename):
+    """Return a dict of the name, size, stores, and items of a saved town.
+
+    Only the first record is read, so no store or item is loaded.
+
+    """
+    file = open(str(filename), 'rb')
+    try:
+        return _open(file)[1]
+    finally:
+        file.close()
+
+
+def _shells(summary):
+    """Set up the context with empty objects for the town and its stores."""
+    town = _resolve(summary['town'])
+    _context.town = town.__new__(town)
+    _context.stores = [cls.__new__(cls) for cls in
+                       map(_resolve, summary['classes'])]
+
+
+def _readabilities(file, version):
+    """Return the ability table of a town, shared through the AbilityPool."""
+    if version < 2:  # no ability table
+        return []
+    return [abilitypool.intern(ability) for ability in _read(file)]
+
+
+def _setabilities(abilities, version=VERSION):
+    """Set the ability table used to read the following records."""
+    _context.abilities = abilities
+    _context.version = version
+
+
+def iterstores(filename):
+    """Yield the stores of a saved town one at a time, without the town.
+
+    References from a store back to its town refer to an
+    empty Town object, and those to stores not yet read to empty stores.
+
+    """
+    file = open(str(filename), 'rb')
+    try:
+        version, summary = _open(file)
+        abilities = _readabilities(file, version)
+        _read(file)
+        _shells(summary)
+        town, stores = _context.town, _context.stores
+        _context.town, _context.stores = None, ()
+        for store in stores:
+            _context.town, _context.stores = town, stores
+            _setabilities(abilities, version)
+            try:
+                _setstate(store, _read(file))
+            finally:
+                _context.town, _context.stores = None, ()
+                _setabilities([])
+            yield store
+    finally:
+        file.close()
+
+
+def load(file):
+    """Read and return a town from an open binary file."""
+    version, summary = _open(file)
+    try:
+        _setabilities(_readabilities(file, version), version)
+        _shells(summary)
+        town, stores = _context.town, _context.stores
+        state = _read(file)
+        for store in stores:
+            _setstate(store, _read(file))
+    finally:
+        _context.town, _context.stores = None, ()
+        _setabilities([])
+    state['stores'] = stores
+    _setstate(town, state)
+    migrate(town, version)
+    return town
+
+
+def migrate(town, version):
+    """Bring town, read (in part) from the given version, up to date."""
+    for v in range(version, VERSION):
+        if v in migrations:
+            migrations[v](town)
+
+
+def dumprecord(town, record):
+    """Return a change record of town (see Journal) as bytes.
+
+    The record is pickled as the records of a town file are, after the
+    version it is written in, so loadrecord() follows any class renames and
+    the town can be migrated from it.
+
+    """
+    buffer = io.BytesIO()
+    buffer.write(_version.pack(VERSION))
+    _Pickler(buffer, town, stores=False).dump(record)
+    return buffer.getvalue()
+
+
+def loadrecord(town, data):
+    """Return (version, record) from the bytes of a record of town.
+
+    References to the town resolve to town. Records written
+    before dumprecord() are plain pickles, and read as version 2.
+
+    """
+    if data[:1] == b'\x80':  # pickle protocol 2 and up
+        version = 2
+    else:
+        version = _version.unpack_from(data)[0]
+        data = data[_version.size:]
+    if version > VERSION:
+        raise StorageError('Change record version %s is newer than this'
+                           ' program (version %s)' % (version, VERSION))
+    _context.town = town
+    try:
+        return version, _Unpickler(io.BytesIO(data)).load()
+    finally:
+        _context.town = None
+
+
+def _internabilities(town):
+    """Share the abilities of a town written before the ability table."""
+    for store in town.stores:
+        for item in store.getitems():
+            abilitypool.internitem(item)
+
+
+migrations[1] = _internabilities
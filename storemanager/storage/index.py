@@ -0,0 +1,257 @@
+import threading
+import pickle
+import glob
+import zlib
+import os
+
+from storemanager.storage import binary
+from storemanager.storage.journal import Journal
+
+
+def _mtime(filename):
+    """Return the latest modification time of a town snapshot and journal."""
+    mtime = os.stat(filename).st_mtime
+    logname = Journal.logname(filename)
+    if os.path.isfile(logname):
+        mtime = max(mtime, os.stat(logname).st_mtime)
+    return mtime
+
+
+def _checksum(filename):
+    """Return the CRC-32 of a town snapshot file."""
+    file = open(filename, 'rb')
+    checksum = zlib.crc32(file.read())
+    file.close()
+    return checksum
+
+
+class TownEntry:
+
+    """Summary of a saved town, sufficient to list it without loading it.
+
+    Attributes:
+      name     -- name of town
+      size     -- size of town (integer 1..5)
+      stores   -- number of stores in town
+      items    -- number of items for sale across all stores
+      filename -- snapshot file the town is saved in
+      mtime    -- latest modification time of the snapshot and its journal
+      checksum -- CRC-32 of the snapshot file
+
+    """
+
+    def __init__(self, town, filename, checksum):
+        self.name = town.name
+        self.size = town.size
+        self.stores = len(town.stores)
+        self.items = town.itemcount()
+        self.filename = filename
+        self.mtime = _mtime(filename)
+        self.checksum = checksum
+
+    def fromsummary(summary, filename, checksum):
+        """Return the TownEntry for a snapshot's summary (see binary.summary)."""
+        entry = TownEntry.__new__(TownEntry)
+        entry.name = summary['name']
+        entry.size = summary['size']
+        entry.stores = summary['stores']
+        entry.items = summary['items']
+        entry.filename = filename
+        entry.mtime = _mtime(filename)
+        entry.checksum = checksum
+        return entry
+
+    def __str__(self):
+        s = 's' if self.stores > 1 else ''
+        return "%s (size %s): %s store%s" % (self.name, self.size,
+                                            self.stores, s)
+
+
+class ContinentIndex:
+
+    """Index of every town saved on the continent.
+
+    The index is stored beside the towns (towns/continent.index) and is kept
+    in sync by Town.save() and Town.delete(), so the continent can be listed
+    without unpickling any town. Full towns are loaded only on request, and
+    are cached so each town is loaded at most once.
+
+    Attributes:
+      directory -- directory containing the town files
+      filename  -- index file
+      entries   -- dict of TownEntry, keyed by town filename
+      towns     -- dict of fully loaded Towns, keyed by town filename
+
+    """
+
+    def __init__(self, directory='towns'):
+        self.directory = directory
+        self.filename = os.path.join(directory, 'continent.index')
+        self.entries = {}
+        self.towns = {}
+        self._lock = threading.Lock()
+        self._read()
+
+    def __iter__(self):
+        return iter(sorted(self.entries.values(), key=lambda e: e.name))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _key(self, filename):
+        return os.path.normpath(str(filename))
+
+    def _read(self):
+        self.entries = {}
+        self._appended = 0
+        if os.path.isfile(self.filename):
+            file = open(self.filename, 'rb')
+            try:
+                self.entries = pickle.load(file)
+                while True:  # changes appended since (see _append)
+                    key, entry = pickle.load(file)
+                    if entry is None:
+                        self.entries.pop(key, None)
+                    else:
+                        self.entries[key] = entry
+                    self._appended += 1
+            except (EOFError, pickle.UnpicklingError):
+                pass  # rebuilt by refresh()
+            file.close()
+
+    def _write(self):
+        if not os.path.isdir(self.directory): os.mkdir(self.directory)
+        tmpname = self.filename + '.tmp'
+        file = open(tmpname, 'wb')
+        pickle.dump(self.entries, file)
+        file.close()
+        os.replace(tmpname, self.filename)
+        self._appended = 0
+
+    def _append(self, key, entry):
+        """Record a single changed (or, if entry is None, removed) entry.
+
+        The change is appended to the index file rather than rewriting it,
+        until there are more changes than entries.
+
+        """
+        if (not os.path.isfile(self.filename) or
+                self._appended >= max(len(self.entries), 1)):
+            self._write()
+            return
+        file = open(self.filename, 'ab')
+        pickle.dump((key, entry), file)
+        file.close()
+        self._appended += 1
+
+    def refresh(self):
+        """Re-read the index, re-indexing any towns changed behind its back.
+
+        Towns that were added, changed, or removed without going through
+        Town.save() or Town.delete() are detected by modification time. A
+        binary snapshot without a journal is indexed from its summary,
+        without loading the town.
+
+        """
+        from storemanager.locations.town import Town
+        with self._lock:  # load() may be called from a SearchJob thread
+            self._read()
+            changed = False
+            files = set(self._key(f) for f in
+                        glob.glob(os.path.join(self.directory, '*.town')))
+            for key in list(self.entries):
+                if key not in files:
+                    del self.entries[key]
+                    changed = True
+            for key in files:
+                entry = self.entries.get(key)
+                if entry is None or entry.mtime != _mtime(key):
+                    if (binary.isbinary(key) and
+                            not os.path.isfile(Journal.logname(key))):
+                        self.entries[key] = TownEntry.fromsummary(
+                            binary.summary(key), key, _checksum(key))
+                        self.towns.pop(key, None)
+                    else:
+                        town = Town.load(key)
+                        self.entries[key] = TownEntry(town, key,
+                                                      _checksum(key))
+                        self.towns[key] = town
+                    changed = True
+            for key in list(self.towns):
+                if key not in self.entries:
+                    del self.towns[key]
+            if changed:
+                self._write()
+
+    def update(self, town, filename, checksum=None):
+        """Record the current state of a saved town.
+
+        checksum -- CRC-32 of a freshly written snapshot, or None if only
+                    the journal changed
+
+        """
+        key = self._key(filename)
+        if checksum is None:
+            if key in self.entries:
+                checksum = self.entries[key].checksum
+            else:
+                checksum = _checksum(key)
+        self.entries[key] = TownEntry(town, key, checksum)
+        self._append(key, self.entries[key])
+
+    def update_entries(self, entries):
+        """Record several freshly built TownEntries at once."""
+        for entry in entries:
+            self.entries[self._key(entry.filename)] = entry
+        self._write()
+
+    def reload(self):
+        """Reload cached towns in place, after other processes saved them.
+
+        The cached Town objects keep their identity, so open windows that
+        hold a reference see the new state.
+
+        """
+        from storemanager.locations.town import Town
+        with self._lock:
+            for key, town in self.towns.items():
+                if key in self.entries:
+                    town.__dict__.update(Town.load(key).__dict__)
+
+    def remove(self, filename):
+        """Forget a deleted town."""
+        key = self._key(filename)
+        self.entries.pop(key, None)
+        self.towns.pop(key, None)
+        self._append(key, None)
+
+    def cache(self, town):
+        """Remember an already-loaded town, so load() returns it."""
+        key = self._key(os.path.join(self.directory, '%s.town' % town.name))
+        self.towns[key] = town
+
+    def load(self, entry):
+        """Return the full Town for entry, loading it if necessary."""
+        from storemanager.locations.town import Town
+        with self._lock:  # may be called from a SearchJob thread
+            if entry.filename not in self.towns:
+                self.towns[entry.filename] = Town.load(entry.filename)
+            return self.towns[entry.filename]
+
+
+def opencontinent(directory='towns'):
+    """Return the continent saved in directory.
+
+    If the directory holds a continent database (see storage.sqlite), the
+    ContinentDB is returned, and towns are saved to it from then on (see
+    Town.database). Otherwise, the ContinentIndex of its town files is, and
+    Town.save() and Town.delete() keep it up to date (see Town.continent).
+
+    """
+    from storemanager.storage.sqlite import ContinentDB
+    from storemanager.locations.town import Town
+    if ContinentDB.exists(directory):
+        Town.database = ContinentDB(os.path.join(directory, 'continent.db'))
+        return Town.database
+    Town.continent = ContinentIndex(directory)
+    return Town.continent
@@ -0,0 +1,231 @@
+import pickle
+import struct
+import zlib
+import io
+import os
+
+from storemanager.storage import StorageError, binary
+
+
+MAGIC = b'ELFJ'
+
+_size = struct.Struct('<I')
+
+
+class Journal:
+
+    """Append-only change log for a single Town.
+
+    A town is persisted as a full snapshot (towns/NAME.town, in the format
+    of storage.binary) plus a journal (towns/NAME.log) of the changes made
+    since that snapshot was written.
+    Each change is a small record, so saving a purchase costs time
+    proportional to the change rather than to the size of the town. Once
+    the journal grows past compact_after records, the next save writes a
+    fresh snapshot and truncates the journal.
+
+    After MAGIC, the journal holds length-prefixed records, each written in
+    the versioned format of storage.binary (see binary.dumprecord()), so
+    classes renamed since are followed and the town is migrated after the
+    journal is replayed. A journal of plain pickles, from before, is
+    replayed too, and replaced by a snapshot on the next save.
+
+    Records (stores are list indices at time of change; items are item ids):
+      ('purchase', store, item)        -- item removed from inventory
+      ('healing', store, points)       -- healing potion stock set to points
+      ('additem', store, item)         -- item object added to inventory
+      ('markup', store, item, markup)  -- item markup set to markup
+      ('update', store, fields, issued, ids, markups, items)
+                                       -- store updated: its other attributes
+                                          set to fields, items added, the
+                                          rest of its stock removed, and the
+                                          stock ordered as ids, with markups
+                                          (see changes())
+      ('update', store, storeobj)      -- store replaced, in older journals
+      ('addstore', storeobj)           -- new store appended to the town
+      ('removestore', store)           -- store removed from the town
+      ('rename', store, name)          -- store renamed
+
+    Attributes:
+      pending -- records not yet written to disk
+      logged  -- number of records on disk since the last snapshot
+      legacy  -- True if the journal on disk is of plain pickles
+
+    """
+
+    compact_after = 100
+
+    def __init__(self, logged=0, legacy=False):
+        self.pending = []
+        self.logged = logged
+        self.legacy = legacy
+
+    def logname(snapshot):
+        """Return the journal filename belonging to a snapshot filename."""
+        return os.path.splitext(str(snapshot))[0] + '.log'
+
+    def record(self, op, *args):
+        """Queue a change record to be written on the next flush."""
+        self.pending.append((op,) + args)
+
+    def needs_compaction(self):
+        """Return True if the next save should write a full snapshot."""
+        return (self.legacy or
+                self.logged + len(self.pending) > self.compact_after)
+
+    def flush(self, snapshot, town):
+        """Append all pending records of town to the journal beside snapshot."""
+        if not self.pending:
+            return
+        file = open(Journal.logname(snapshot), 'ab')
+        if file.tell() == 0:
+            file.write(MAGIC)
+        for record in self.pending:
+            data = binary.dumprecord(town, record)
+            file.write(_size.pack(len(data)))
+            file.write(data)
+        file.close()
+        self.logged += len(self.pending)
+        self.pending = []
+
+    def compact(self, snapshot, town):
+        """Write town as a new snapshot, discard the journal; return CRC-32."""
+        buffer = io.BytesIO()
+        binary.dump(town, buffer)
+        data = buffer.getvalue()
+        tmpname = str(snapshot) + '.tmp'
+        file = open(tmpname, 'wb')
+        file.write(data)
+        file.close()
+        os.replace(tmpname, str(snapshot))
+        self.remove(snapshot)
+        self.pending = []
+        self.logged = 0
+        self.legacy = False
+        return zlib.crc32(data)
+
+    def remove(self, snapshot):
+        """Delete the journal beside snapshot, if any."""
+        logname = Journal.logname(snapshot)
+        if os.path.isfile(logname):
+            os.remove(logname)
+
+    def replay(snapshot, town):
+        """Apply the journal beside snapshot to town; return a new Journal.
+
+        A partially written record at the end of the journal (e.g. from a
+        crash mid-save) is ignored, and cut off so that later records are
+        appended after the last whole one.
+
+        """
+        logname = Journal.logname(snapshot)
+        if not os.path.isfile(logname):
+            return Journal()
+        file = open(logname, 'rb')
+        try:
+            if file.read(len(MAGIC)) != MAGIC:
+                file.seek(0)
+                return Journal.replaypickles(file, town)
+            count, oldest, end = 0, binary.VERSION, file.tell()
+            while True:
+                size = file.read(_size.size)
+                if len(size) < _size.size:
+                    break
+                data = file.read(_size.unpack(size)[0])
+                if len(data) < _size.unpack(size)[0]:
+                    break
+                version, record = binary.loadrecord(town, data)
+                Journal.apply(town, record)
+                oldest = min(oldest, version)
+                count += 1
+                end = file.tell()
+            truncated = file.tell() > end
+        finally:
+            file.close()
+        if truncated:
+            os.truncate(logname, end)
+        binary.migrate(town, oldest)
+        return Journal(count)
+
+    def replaypickles(file, town):
+        """Apply a journal of plain pickles to town; return a new Journal."""
+        count = 0
+        while True:
+            try:
+                record = pickle.load(file)
+            except (EOFError, pickle.UnpicklingError):
+                break
+            Journal.apply(town, record)
+            count += 1
+        return Journal(count, legacy=True)
+
+    def changes(store, before):
+        """Return the arguments of the 'update' record of a store.
+
+        before is the list of the items the store held before the update.
+        Only the items it added are recorded in full; the others are listed
+        by id, with their markups.
+
+        """
+        fields = dict(store.__dict__)
+        inventory = fields.pop('inventory')
+        held = set(map(id, before))
+        return (fields, inventory.issued,
+                [item.id for item in inventory],
+                [item.markup for item in inventory],
+                [item for item in inventory if id(item) not in held])
+
+    def _update(store, fields, issued, ids, markups, items):
+        """Apply the changes of an 'update' record to store."""
+        store.__dict__.update(fields)
+        inventory = store.inventory
+        kept = set(ids)
+        for item in list(inventory):
+            if item.id not in kept:
+                inventory.remove(item)
+        for item in items:
+            inventory.append(item)
+        for key, markup in zip(ids, markups):
+            inventory.get(key).markup = markup
+        inventory.arrange(ids)
+        inventory.issued = issued
+
+    def _item(store, key):
+        """Return the item of store with id key, or None if it is gone.
+
+        Journals written before items had ids give the item's position.
+
+        """
+        item = store.inventory.get(key)
+        if item is None and 0 <= key < len(store.inventory):
+            item = store.inventory[key]
+        return item
+
+    def apply(town, record):
+        """Apply a single change record to town."""
+        op, args = record[0], record[1:]
+        if op == 'purchase':
+            store = town.stores[args[0]]
+            item = Journal._item(store, args[1])
+            if item is not None:
+                store.purchase(item)
+        elif op == 'healing':
+            town.stores[args[0]].healingpotion = args[1]
+        elif op == 'additem':
+            town.stores[args[0]].additem(args[1])
+        elif op == 'markup':
+            item = Journal._item(town.stores[args[0]], args[1])
+            if item is not None:
+                item.markup = args[2]
+        elif op == 'update' and len(args) == 2:
+            town.stores[args[0]] = args[1]
+        elif op == 'update':
+            Journal._update(town.stores[args[0]], *args[1:])
+        elif op == 'addstore':
+            town.stores.append(args[0])
+        elif op == 'removestore':
+            del town.stores[args[0]]
+        elif op == 'rename':
+            town.stores[args[0]].name = args[1]
+        else:
+            raise StorageError('Unknown journal record: %s' % op)
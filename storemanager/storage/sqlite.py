@@ -0,0 +1,486 @@
+import threading
+import sqlite3
+import time
+import io
+import os
+import re
+
+from storemanager.stockitems import capabilities
+from storemanager.stockitems.potion import ishealing
+from storemanager.search.index import exactkeys
+from storemanager.search.criteriaset import ANDCriteriaSet
+from storemanager.storage import StorageError, binary
+from storemanager.storage.index import TownEntry
+from storemanager.storage.journal import Journal
+
+
+SCHEMA = 2  # PRAGMA user_version of a database in the current layout
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS towns (
+    name TEXT PRIMARY KEY, size INTEGER, stores INTEGER, items INTEGER,
+    saved REAL, data BLOB);
+CREATE TABLE IF NOT EXISTS changes (
+    town TEXT, seq INTEGER, record BLOB, PRIMARY KEY (town, seq));
+CREATE TABLE IF NOT EXISTS stores (
+    town TEXT, store INTEGER, name TEXT, class TEXT,
+    PRIMARY KEY (town, store));
+CREATE TABLE IF NOT EXISTS items (
+    town TEXT, id INTEGER, store INTEGER, value INTEGER, markup INTEGER,
+    price INTEGER, charges INTEGER, abilities INTEGER, text TEXT,
+    PRIMARY KEY (town, id));
+CREATE TABLE IF NOT EXISTS itemtypes (
+    town TEXT, id INTEGER, type TEXT);
+CREATE TABLE IF NOT EXISTS itemkeys (
+    town TEXT, id INTEGER, kind TEXT, a, b);
+CREATE INDEX IF NOT EXISTS items_store ON items (town, store);
+CREATE INDEX IF NOT EXISTS items_price ON items (price);
+CREATE INDEX IF NOT EXISTS items_markup ON items (markup);
+CREATE INDEX IF NOT EXISTS items_charges ON items (charges);
+CREATE INDEX IF NOT EXISTS items_abilities ON items (abilities);
+CREATE INDEX IF NOT EXISTS itemtypes_type ON itemtypes (type);
+CREATE INDEX IF NOT EXISTS itemtypes_item ON itemtypes (town, id);
+CREATE INDEX IF NOT EXISTS itemkeys_key ON itemkeys (kind, a, b);
+CREATE INDEX IF NOT EXISTS itemkeys_item ON itemkeys (town, id);
+'''
+
+_tables = ('towns', 'changes', 'stores', 'items', 'itemtypes', 'itemkeys')
+_itemtables = ('items', 'itemtypes', 'itemkeys')
+
+
+def typename(cls):
+    """Return the name a class is stored under in the itemtypes table."""
+    return '%s.%s' % (cls.__module__, cls.__qualname__)
+
+
+def _regexp(pattern, text):
+    return text is not None and re.search(pattern, text, re.I) is not None
+
+
+def _sqlid(id):
+    """Return a 64-bit item id as a signed integer, as SQLite stores it."""
+    return id - (1 << 64) if id >= (1 << 63) else id
+
+
+def _itemid(value):
+    """Return the item id stored by SQLite as value (see _sqlid)."""
+    return value + (1 << 64) if value < 0 else value
+
+
+class ContinentDB:
+
+    """Continent of towns kept in a single SQLite database.
+
+    An optional alternative to the directory of town files: each town is
+    stored as a binary snapshot (see storage.binary), and every item for
+    sale has a row in the items table, with its types and its abilities and
+    other searchable keys (see search.index.exactkeys) in the itemtypes and
+    itemkeys tables. Criteria
+    that support it (see _Criterion.sql) compile to a WHERE clause over
+    these tables, so a search of the whole continent is one indexed query,
+    and only the towns holding matches are loaded.
+
+    As with town files, changes made through the Town methods are
+    journaled (see Journal): write() adds them to the changes table, and
+    updates only the rows of the stores and items they touch. The snapshot
+    is rewritten, and the changes discarded, only when the town is saved
+    in full or has built up Journal.compact_after changes.
+
+    The interface matches ContinentIndex, so either can be used to list,
+    load, update, and search the continent. While a ContinentDB is in use,
+    Town.database is set to it, and Town.save() and Town.delete() write to
+    the database instead of to town files.
+
+    Items are identified by (town name, item id).
+
+    Attributes:
+      filename -- database file
+      entries  -- dict of TownEntry, keyed by town name
+      towns    -- dict of fully loaded Towns, keyed by town name
+
+    """
+
+    def __init__(self, filename=os.path.join('towns', 'continent.db')):
+        self.filename = filename
+        self.directory = os.path.dirname(filename)
+        self.entries = {}
+        self.towns = {}
+        self._lock = threading.RLock()
+        if self.directory and not os.path.isdir(self.directory):
+            os.mkdir(self.directory)
+        self.connection = sqlite3.connect(filename, timeout=60,
+                                          check_same_thread=False)
+        self.connection.create_function('REGEXP', 2, _regexp)
+        version = self._execute('PRAGMA user_version')[0][0]
+        if version < SCHEMA:
+            # Items used to be keyed by position; rebuild them by id
+            self.connection.executescript(''.join(
+                'DROP TABLE IF EXISTS %s;' % table
+                for table in ('stores',) + _itemtables))
+        self.connection.executescript(_schema)
+        self.refresh()
+        if version < SCHEMA:
+            for name in list(self.entries):
+                self.save(self.town(name))
+            self._execute('PRAGMA user_version = %d' % SCHEMA)
+
+    def exists(directory='towns'):
+        """Return True if directory holds a continent database."""
+        return os.path.isfile(os.path.join(directory, 'continent.db'))
+
+    def __iter__(self):
+        return iter(sorted(self.entries.values(), key=lambda e: e.name))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    ## ContinentIndex interface
+
+    def refresh(self):
+        """Re-read the list of towns from the database.
+
+        Cached towns that were deleted, or saved since they were loaded
+        (e.g. by another process), are dropped, to be loaded again.
+
+        """
+        entries = {}
+        for name, size, stores, items, saved in self._execute(
+                'SELECT name, size, stores, items, saved FROM towns'):
+            entry = TownEntry.__new__(TownEntry)
+            entry.name, entry.size = name, size
+            entry.stores, entry.items = stores, items
+            entry.filename = name
+            entry.mtime = saved
+            entry.checksum = None
+            entries[name] = entry
+        with self._lock:
+            for name in list(self.towns):
+                old = self.entries.get(name)
+                if (name not in entries or old is None or
+                        entries[name].mtime != old.mtime):
+                    del self.towns[name]
+            self.entries = entries
+
+    def update(self, town, filename=None, checksum=None):
+        """Save town; the filename and checksum are ignored."""
+        self.write(town)
+
+    def update_entries(self, entries):
+        """Towns saved by other processes are already in the database."""
+        self.refresh()
+
+    def reload(self):
+        """Reload cached towns in place, after other processes saved them."""
+        with self._lock:
+            for name, town in self.towns.items():
+                if name in self.entries:
+                    town.__dict__.update(self.town(name).__dict__)
+
+    def remove(self, name):
+        """Delete the town called name."""
+        with self._lock, self.connection:
+            for table in _tables:
+                self.connection.execute('DELETE FROM %s WHERE %s = ?' %
+                                        (table, 'name' if table == 'towns'
+                                         else 'town'), (name,))
+        self.entries.pop(name, None)
+        self.towns.pop(name, None)
+
+    def cache(self, town):
+        """Remember an already-loaded town, so load() returns it."""
+        self.towns[town.name] = town
+
+    def columns(self):
+        """Return a columnar snapshot (ItemColumns) of every town's items."""
+        from storemanager.search.columns import ItemColumns
+        return ItemColumns([self.load(entry) for entry in self])
+
+    def load(self, entry):
+        """Return the full Town for entry, loading it if necessary."""
+        with self._lock:  # may be called from a SearchJob thread
+            if entry.name not in self.towns:
+                self.towns[entry.name] = self.town(entry.name)
+            return self.towns[entry.name]
+
+    ## Storage
+
+    def town(self, name):
+        """Read and return the town called name (not cached).
+
+        The town's snapshot is read, and its changes since then applied.
+
+        """
+        with self._lock:
+            rows = self._execute('SELECT data FROM towns WHERE name = ?',
+                                 (name,))
+            if not rows:
+                raise StorageError('No town called %s in %s' %
+                                   (name, self.filename))
+            changes = self._execute('SELECT record FROM changes WHERE'
+                                    ' town = ? ORDER BY seq', (name,))
+        town = binary.load(io.BytesIO(rows[0][0]))
+        oldest = binary.VERSION
+        for data, in changes:
+            version, record = binary.loadrecord(town, data)
+            Journal.apply(town, record)
+            oldest = min(oldest, version)
+        binary.migrate(town, oldest)
+        town._journal = Journal(len(changes))
+        return town
+
+    def _itemrows(self, town, number, item):
+        """Insert the rows of item, for sale in store number of town."""
+        caps = capabilities(item)
+        id = _sqlid(item.id)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (town, id, number, item.value, item.markup, item.price(),
+             item.charges if caps.charges else None,
+             len(item.abilities) if caps.abilities else None,
+             str(item).casefold()))
+        self.connection.executemany(
+            'INSERT INTO itemtypes VALUES (?, ?, ?)',
+            [(town, id, typename(cls)) for cls in type(item).__mro__])
+        self.connection.executemany(
+            'INSERT INTO itemkeys VALUES (?, ?, ?, ?, ?)',
+            [(town, id) + key for key in exactkeys(item)])
+
+    def _storerows(self, town, number, store):
+        """Insert the rows of store number of town, and of its items."""
+        self.connection.execute(
+            'INSERT OR REPLACE INTO stores VALUES (?, ?, ?, ?)',
+            (town, number, store.name, typename(type(store))))
+        for item in store.getitems():
+            self._itemrows(town, number, item)
+
+    def _deleteitems(self, town, where, params):
+        """Delete the rows of the items of town matching a condition."""
+        for table in ('itemtypes', 'itemkeys'):
+            self.connection.execute(
+                'DELETE FROM %s WHERE town = ? AND id IN (SELECT id FROM'
+                ' items WHERE town = ? AND %s)' % (table, where),
+                [town, town] + list(params))
+        self.connection.execute('DELETE FROM items WHERE town = ? AND %s'
+                                % where, [town] + list(params))
+
+    def _entry(self, town, saved):
+        entry = TownEntry.__new__(TownEntry)
+        entry.name, entry.size = town.name, town.size
+        entry.stores, entry.items = len(town.stores), town.itemcount()
+        entry.filename, entry.mtime, entry.checksum = town.name, saved, None
+        self.entries[town.name] = entry
+        return entry
+
+    def save(self, town):
+        """Write town in full, replacing any saved town of the same name.
+
+        Returns the TownEntry of the saved town.
+
+        """
+        buffer = io.BytesIO()
+        binary.dump(town, buffer)
+        saved = time.time()
+        with self._lock, self.connection:
+            for table in _tables:
+                self.connection.execute('DELETE FROM %s WHERE %s = ?' %
+                                        (table, 'name' if table == 'towns'
+                                         else 'town'), (town.name,))
+            self.connection.execute(
+                'INSERT INTO towns VALUES (?, ?, ?, ?, ?, ?)',
+                (town.name, town.size, len(town.stores),
+                 town.itemcount(), saved, buffer.getvalue()))
+            for number, store in enumerate(town.stores):
+                self._storerows(town.name, number, store)
+        return self._entry(town, saved)
+
+    def write(self, town, full=False):
+        """Write the pending changes of town, or all of it if full is True.
+
+        The town is written in full (see save()) if it is not yet in the
+        database, or its journal needs compacting. Returns its TownEntry.
+
+        """
+        journal = town._journal
+        if (full or town.name not in self.entries or
+                journal.needs_compaction()):
+            entry = self.save(town)
+            town._journal = Journal()
+            return entry
+        saved = time.time()
+        with self._lock, self.connection:
+            seq = self.connection.execute(
+                'SELECT COALESCE(MAX(seq) + 1, 0) FROM changes WHERE'
+                ' town = ?', (town.name,)).fetchone()[0]
+            for record in journal.pending:
+                self.connection.execute(
+                    'INSERT INTO changes VALUES (?, ?, ?)',
+                    (town.name, seq, binary.dumprecord(town, record)))
+                self._apply(town, record)
+                seq += 1
+            self.connection.execute(
+                'UPDATE towns SET stores = ?, items = ?, saved = ? WHERE'
+                ' name = ?', (len(town.stores), town.itemcount(), saved,
+                              town.name))
+        journal.logged += len(journal.pending)
+        journal.pending = []
+        return self._entry(town, saved)
+
+    def _apply(self, town, record):
+        """Update the rows of town for a single change record (see Journal).
+
+        Stores are numbered as at the time of the change, as in the
+        record; items are written as they are now.
+
+        """
+        op, args = record[0], record[1:]
+        name = town.name
+        execute = self.connection.execute
+        if op == 'purchase':
+            self._deleteitems(name, 'id = ?', [_sqlid(args[1])])
+        elif op == 'additem':
+            item = args[1]
+            if item.id is not None and not ishealing(item):
+                self._itemrows(name, args[0], item)
+        elif op == 'markup':
+            for store in town.stores:
+                item = store.inventory.get(args[1])
+                if item is not None:
+                    self._deleteitems(name, 'id = ?', [_sqlid(item.id)])
+                    self._itemrows(name, args[0], item)
+        elif op == 'update' and len(args) > 2:
+            number, ids, items = args[0], args[3], args[5]
+            kept = [_sqlid(key) for key in ids]
+            self._deleteitems(name, 'store = ? AND id NOT IN (%s)' %
+                              ', '.join('?' * len(kept)), [number] + kept)
+            added = set(item.id for item in items)
+            rows = []
+            for key in ids:
+                if key in added:
+                    continue
+                for store in town.stores:
+                    item = store.inventory.get(key)
+                    if item is not None:
+                        rows.append((item.markup, item.price(),
+                                     str(item).casefold(), name, _sqlid(key)))
+                        break
+            self.connection.executemany(
+                'UPDATE items SET markup = ?, price = ?, text = ? WHERE'
+                ' town = ? AND id = ?', rows)
+            for item in items:
+                self._itemrows(name, number, item)
+        elif op in ('update', 'addstore'):
+            if op == 'update':
+                number, store = args
+                self._deleteitems(name, 'store = ?', [number])
+            else:
+                store = args[0]
+                number = execute('SELECT COUNT(*) FROM stores WHERE'
+                                 ' town = ?', (name,)).fetchone()[0]
+            self._storerows(name, number, store)
+        elif op == 'removestore':
+            self._deleteitems(name, 'store = ?', [args[0]])
+            execute('DELETE FROM stores WHERE town = ? AND store = ?',
+                    (name, args[0]))
+            for table in ('stores', 'items'):
+                execute('UPDATE %s SET store = store - 1 WHERE town = ? AND'
+                        ' store > ?' % table, (name, args[0]))
+        elif op == 'rename':
+            execute('UPDATE stores SET name = ? WHERE town = ? AND store = ?',
+                    (args[1], name, args[0]))
+
+    def importtowns(self, index):
+        """Save every town of a ContinentIndex into the database."""
+        for entry in index:
+            self.save(index.load(entry))
+
+    ## SQL helpers for _Criterion.sql()
+
+    def all(self):
+        """Return the condition matching every item."""
+        return ('1', [])
+
+    def between(self, column, min=None, max=None):
+        """Return the condition min <= column <= max; None bounds are open."""
+        clauses, params = ['items.%s IS NOT NULL' % column], []
+        if min is not None:
+            clauses.append('items.%s >= ?' % column)
+            params.append(min)
+        if max is not None:
+            clauses.append('items.%s <= ?' % column)
+            params.append(max)
+        return (' AND '.join(clauses), params)
+
+    def istype(self, cls):
+        """Return the condition matching instances of cls."""
+        return ('EXISTS (SELECT 1 FROM itemtypes t WHERE t.town = items.town'
+                ' AND t.id = items.id AND t.type = ?)', [typename(cls)])
+
+    def haskey(self, kind, condition='1', params=()):
+        """Return the condition matching items with a key of kind.
+
+        condition may further restrict the key's values, k.a and k.b.
+
+        """
+        return ('EXISTS (SELECT 1 FROM itemkeys k WHERE k.town = items.town'
+                ' AND k.id = items.id AND k.kind = ? AND (%s))' % condition,
+                [kind] + list(params))
+
+    def contains(self, text):
+        """Return the condition matching items whose text contains text."""
+        return ('instr(items.text, ?) > 0', [text.casefold()])
+
+    def regexp(self, pattern):
+        """Return the condition matching items whose text matches pattern."""
+        return ('items.text REGEXP ?', [pattern])
+
+    ## Searching
+
+    def _prefilter(self, criterion):
+        """Return (condition, exact) to select candidates for criterion."""
+        found = criterion.sql(self)
+        if found is not None:
+            return found, True
+        clauses, params = [], []
+        if isinstance(criterion, ANDCriteriaSet):
+            for child in criterion.criteria:
+                found = child.sql(self)
+                if found is not None:
+                    clauses.append('(%s)' % found[0])
+                    params.extend(found[1])
+        if not clauses:
+            return self.all(), False
+        return (' AND '.join(clauses), params), False
+
+    def search(self, criterion):
+        """Yield (entry, matches) for each town holding a match.
+
+        matches is a list of (item, store, town), for each item matching.
+        The list of towns is refreshed first, so towns saved by another
+        process are loaded again rather than searched as cached.
+
+        """
+        self.refresh()
+        (condition, params), exact = self._prefilter(criterion)
+        rows = self._execute('SELECT town, store, id FROM items WHERE %s'
+                             ' ORDER BY town, store, id' % condition, params)
+        bytown = {}
+        for name, store, id in rows:
+            bytown.setdefault(name, []).append((store, _itemid(id)))
+        for name, positions in bytown.items():
+            entry = self.entries.get(name)
+            if entry is None:
+                continue
+            town = self.load(entry)
+            items = []
+            for s, id in positions:
+                if s >= len(town.stores):
+                    continue
+                item = town.stores[s].inventory.get(id)
+                if item is not None and (exact or criterion.match(item)):
+                    items.append((item, town.stores[s], town))
+            if items:
+                yield (entry, items)
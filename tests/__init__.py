@@ -0,0 +1,44 @@
+from elvenfire.artifacts.combat import Weapon
+from elvenfire.artifacts.greater import Rod, Ring
+from storemanager.search.criterion import *
+from storemanager.search.criteriaset import *
+
+
+def randomcriterion(rng, depth=0):
+    """Return a random criteria tree."""
+    if depth > 3 or rng.random() < 0.3:
+        r = rng.randint(0, 6)
+        if r == 0:
+            return TypeCriterion(rng.choice([Weapon, Rod, Ring]))
+        if r == 1:
+            return PriceCriterion(rng.choice([None, 100, 500, 1000]),
+                                  rng.choice([None, 800, 2000, 4000]))
+        if r == 2:
+            return MarkupCriterion(rng.choice([None, 100, 105]),
+                                   rng.choice([None, 110, 115]))
+        if r == 3:
+            return TextCriterion(rng.choice(['of', 'Fire', 'Ring']))
+        if r == 4:
+            return CharacterAbilityCriterion(rng.choice([None, 'Fire']), 2, 5)
+        if r == 5:
+            return NumAbilitiesCriterion(rng.choice([None, 0, 1, 2]),
+                                         rng.choice([None, 1, 2, 4]))
+        return ChargesCriterion(2, 12)
+    r = rng.randint(0, 2)
+    if r == 2:
+        return NOTCriteriaSet(randomcriterion(rng, depth + 1))
+    children = [randomcriterion(rng, depth + 1)
+                for i in range(rng.randint(1, 4))]
+    return (ANDCriteriaSet if r == 0 else ORCriteriaSet)(children)
+
+
+def townstate(town):
+    """Return everything saved of town, as values that can be compared."""
+    stores = []
+    for store in town.stores:
+        state = dict(store.__dict__)
+        inventory = state.pop('inventory')
+        stores.append((type(store), sorted(state.items()), inventory.issued,
+                       [(item.id, item.markup, str(item))
+                        for item in inventory]))
+    return (town.name, town.size, town.seed, stores)
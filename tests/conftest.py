@@ -0,0 +1,12 @@
+import pytest
+
+from storemanager.locations.town import Town
+
+
+@pytest.fixture
+def towndir(tmp_path, monkeypatch):
+    """Work in an empty directory, with no continent open."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Town, 'continent', None)
+    monkeypatch.setattr(Town, 'database', None)
+    return tmp_path
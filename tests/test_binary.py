@@ -0,0 +1,88 @@
+import pickle
+import io
+
+import pytest
+
+from storemanager.locations.town import Town
+from storemanager.storage import binary
+from tests import townstate
+
+
+def dumpold(town, file, version):
+    """Write town as binary.dump() did in an older version.
+
+    Version 2 wrote abilities as references to the pickler's memo, preloaded
+    with the ability table; version 1 had no ability table.
+
+    """
+    state = dict(binary._getstate(town))
+    stores = state.pop('stores')
+    abilities = binary._abilities(stores) if version >= 2 else []
+
+    def write(value, memo=()):
+        buffer = io.BytesIO()
+        pickler = binary._Pickler(buffer, town)
+        pickler.memo = dict((id(ability), (number, ability))
+                            for number, ability in enumerate(memo))
+        pickler.dump(value)
+        file.write(binary._size.pack(len(buffer.getvalue())))
+        file.write(buffer.getvalue())
+
+    file.write(binary._header.pack(binary.MAGIC, version))
+    write({'name': town.name, 'size': town.size, 'stores': len(stores),
+           'items': sum(len(s.getitems()) for s in stores),
+           'town': binary._classname(type(town)),
+           'classes': [binary._classname(type(s)) for s in stores]})
+    if version >= 2:
+        write(abilities)
+    write(state, abilities)
+    for store in stores:
+        write(binary._getstate(store), abilities)
+
+
+@pytest.fixture
+def town():
+    town = Town('Foo', 5, seed=1)
+    town.update()
+    return town
+
+
+def test_current(town):
+    buffer = io.BytesIO()
+    binary.dump(town, buffer)
+    buffer.seek(0)
+    assert townstate(binary.load(buffer)) == townstate(town)
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_older(town, version):
+    buffer = io.BytesIO()
+    dumpold(town, buffer, version)
+    buffer.seek(0)
+    assert townstate(binary.load(buffer)) == townstate(town)
+
+
+def test_pickled(town, towndir):
+    town.save(full=True)
+    file = open(town.filename(), 'wb')
+    pickle.dump(town, file)
+    file.close()
+    assert townstate(Town.load(town.filename())) == townstate(town)
+
+
+def test_summary(town, towndir):
+    town.save(full=True)
+    summary = binary.summary(town.filename())
+    assert (summary['name'], summary['stores'], summary['items']) == \
+           (town.name, len(town.stores), town.itemcount())
+    stores = list(binary.iterstores(town.filename()))
+    assert [s.name for s in stores] == [s.name for s in town.stores]
+
+
+def test_newer(town):
+    buffer = io.BytesIO()
+    binary.dump(town, buffer)
+    data = bytearray(buffer.getvalue())
+    binary._header.pack_into(data, 0, binary.MAGIC, binary.VERSION + 1)
+    with pytest.raises(binary.StorageError):
+        binary.load(io.BytesIO(bytes(data)))
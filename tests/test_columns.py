@@ -0,0 +1,33 @@
+import random
+
+import pytest
+
+from storemanager.locations.town import Town
+from storemanager.search.columns import ItemColumns
+from tests import randomcriterion
+
+
+@pytest.fixture(scope='module')
+def columns():
+    return ItemColumns([Town('X', 5, seed=1), Town('Y', 4, seed=2),
+                        Town('Z', 3, seed=3)])
+
+
+def test_all(columns):
+    assert columns.rows(columns.all()) == list(range(len(columns)))
+    assert columns.all() is columns.all()
+    extended = ItemColumns(columns.towns)
+    extended.addtown(Town('W', 2, seed=4))
+    assert extended.rows(extended.all()) == list(range(len(extended)))
+
+
+def test_masks_equal_match(columns):
+    rng = random.Random(8)
+    for n in range(300):
+        criterion = randomcriterion(rng)
+        mask = criterion.mask(columns)
+        if mask is None:  # e.g. text, not held in the columns
+            continue
+        assert columns.rows(mask) == [row for row, item
+                                      in enumerate(columns.items)
+                                      if criterion.match(item)], criterion
@@ -0,0 +1,84 @@
+import pickle
+import os
+
+import pytest
+
+from storemanager.locations.town import Town
+from storemanager.stockitems.greater import RingStockItem
+from storemanager.storage.journal import Journal
+from storemanager.storage.sqlite import ContinentDB
+from tests import townstate
+
+
+def change(town):
+    """Make one of each kind of journaled change to town."""
+    store = town.stores[0]
+    town.purchase(store.inventory[0])
+    town.additem(store, RingStockItem())
+    town.setmarkup(store.inventory[1], 5)
+    town.renamestore(store, 'Bob')
+    town.purchase_healingpotion(store, 0)
+    town.update()
+    town.advance(2)
+    town.removestore(town.stores[-1])
+
+
+@pytest.fixture
+def town(towndir):
+    town = Town('Foo', 4, seed=1)
+    town.save()
+    return town
+
+
+def test_replay(town):
+    change(town)
+    town.save()
+    assert os.path.isfile(Journal.logname(town.filename()))
+    loaded = Town.load(town.filename())
+    assert townstate(loaded) == townstate(town)
+    assert loaded._journal.logged == town._journal.logged
+
+
+def test_truncated_tail(town):
+    change(town)
+    town.save()
+    logname = Journal.logname(town.filename())
+    size = os.path.getsize(logname)
+    file = open(logname, 'ab')
+    file.write(b'\xff\x00\x00\x00partial')
+    file.close()
+    loaded = Town.load(town.filename())
+    assert townstate(loaded) == townstate(town)
+    assert os.path.getsize(logname) == size
+    loaded.update()
+    loaded.save()
+    assert townstate(Town.load(town.filename())) == townstate(loaded)
+
+
+def test_pickled_journal(town):
+    """A journal of plain pickles is replayed, then replaced on save."""
+    store = town.stores[0]
+    file = open(Journal.logname(town.filename()), 'wb')
+    pickle.dump(('rename', 0, 'Bob'), file)
+    pickle.dump(('update', 1, town.stores[1]), file)
+    file.close()
+    store.name = 'Bob'
+    loaded = Town.load(town.filename())
+    assert townstate(loaded) == townstate(town)
+    assert loaded._journal.needs_compaction()
+    loaded.save()
+    assert not os.path.isfile(Journal.logname(town.filename()))
+    assert townstate(Town.load(town.filename())) == townstate(town)
+
+
+def test_database(towndir):
+    db = ContinentDB('db/continent.db')
+    Town.database = db
+    town = Town('Foo', 4, seed=1)
+    town.save()
+    change(town)
+    town.save()
+    assert townstate(db.town('Foo')) == townstate(town)
+    rows = db._execute('SELECT * FROM items ORDER BY id')
+    db.save(town)
+    assert db._execute('SELECT * FROM items ORDER BY id') == rows
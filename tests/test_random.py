@@ -0,0 +1,33 @@
+import random
+
+from storemanager.locations import RandomStream
+from storemanager.locations.town import Town
+from tests import townstate
+
+
+def test_stream():
+    random.seed(1)
+    expected = random.random()
+    random.seed(1)
+    with RandomStream(5):
+        first = [random.random() for i in range(5)]
+    assert random.random() == expected
+    with RandomStream(5):
+        assert [random.random() for i in range(5)] == first
+
+
+def test_town():
+    random.seed(1)
+    town = Town(None, None, seed=7)
+    random.seed(2)
+    assert townstate(Town(None, None, seed=7)) == townstate(town)
+
+
+def test_update():
+    towns = [Town('Foo', 3, seed=7) for i in range(2)]
+    random.seed(1)
+    towns[0].update()
+    towns[0].update()
+    random.seed(2)
+    towns[1].advance(2)
+    assert townstate(towns[1]) == townstate(towns[0])
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from storemanager.locations.town import Town
+from storemanager.search.columns import ItemColumns
+from storemanager.search.planner import Planner
+from storemanager.search.worker import SearchJob
+from storemanager.storage.index import ContinentIndex
+from storemanager.storage.sqlite import ContinentDB
+from tests import randomcriterion
+
+
+def criteria(seed, n=200):
+    rng = random.Random(seed)
+    return [randomcriterion(rng) for i in range(n)]
+
+
+def ids(items):
+    return sorted(id(item) for item in items)
+
+
+@pytest.fixture
+def towns(towndir):
+    towns = [Town(None, size, seed=seed) for seed, size
+             in enumerate((5, 4, 3, 2, 1))]
+    for town in towns:
+        town.save(full=True)
+    return towns
+
+
+def test_planner(towns):
+    items = sum((town.getitems() for town in towns), [])
+    for criterion in criteria(1):
+        assert (Planner().plan(criterion).filter(items) ==
+                criterion.filter(items)), criterion
+
+
+def test_columns(towns):
+    columns = ItemColumns(towns)
+    items = columns.items
+    for criterion in criteria(2):
+        assert columns.search(criterion) == criterion.filter(items)
+
+
+def test_itemindex(towns):
+    for criterion in criteria(3, 50):
+        for town in towns:
+            assert (ids(criterion.search(town)) ==
+                    ids(criterion.filter(town.getitems())))
+
+
+def test_searchjob(towns):
+    index = ContinentIndex()
+    index.refresh()
+    items = [item for entry in index for item in index.load(entry).getitems()]
+    for criterion in criteria(4, 50):
+        job = SearchJob(index, Planner().plan(criterion), chunksize=7)
+        found = [match[0] for chunk in job.run() for match in chunk]
+        assert ids(found) == ids(criterion.filter(items)), criterion
+
+
+def test_sql(towns):
+    db = ContinentDB('db/continent.db')
+    for town in towns:
+        db.save(town)
+    items = [item for entry in db for item in db.load(entry).getitems()]
+    for criterion in criteria(5, 50):
+        found = [match[0] for entry, matches in db.search(criterion)
+                 for match in matches]
+        assert ids(found) == ids(criterion.filter(items)), criterion